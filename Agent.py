@@ -1,15 +1,26 @@
+from typing import Dict, Iterator, List, Optional
+
 from toolkit import get_tools
-from cortex_inference import cortex_inference
+from cortex_client import DEFAULT_MODEL
+from cortex_inference import get_cortex_client
+from prompt_budget import PromptBudget, trim_history
+from tool_dispatch import ToolDispatcher, TurnBudget, parse_tool_calls, tool_instructions
+from tracing import span
+
+def run_agent(con, prompt: str, client=None, budget: Optional[TurnBudget] = None,
+              history: Optional[List[Dict[str, str]]] = None) -> str:
+    return "".join(stream_agent(con, prompt, client, budget, history))
 
-def run_agent(con, prompt: str) -> str:
-    tools = get_tools(con)
 
-    # Define a list of tool triggers to simulate the LLM calling these tools
-    tool_triggers = {
-        "run a query": tools["query_sql_database_tool"],
-        "describe table": tools["info_snowflake_table_tool"],
-        "check query": tools["query_sql_checker_tool"]
-    }
+def stream_agent(con, prompt: str, client=None, budget: Optional[TurnBudget] = None,
+                 history: Optional[List[Dict[str, str]]] = None) -> Iterator[str]:
+    """Yield the LLM response as it streams in, then the output of the tools it calls.
+
+    `history` holds earlier chat messages ({"role", "content"}); they are
+    trimmed so each prompt fits the model's context window.
+    """
+    client = client or get_cortex_client()
+    tools = get_tools(con, client)
 
     # System message unchanged
     system_message = """
@@ -39,34 +50,50 @@ def run_agent(con, prompt: str) -> str:
             - Any notable observations or recommendations for further action
     """
     
-    # Combine system message and user prompt for inference
-    full_prompt = f"{system_message}\nUser input: {prompt}"
-    llm_response = cortex_inference(full_prompt)
-
-    # Check if any tools should be triggered based on LLM response
-    for trigger_phrase, tool_function in tool_triggers.items():
-        if trigger_phrase in llm_response.lower():
-            # Extract the relevant query or table name
-            if "run a query" in trigger_phrase:
-                query = extract_query_from_prompt(prompt)
-                tool_response, query_id = tool_function(query)
-            elif "describe table" in trigger_phrase:
-                table_name = extract_table_from_prompt(prompt)
-                tool_response = tool_function(table_name)
-            elif "check query" in trigger_phrase:
-                query = extract_query_from_prompt(prompt)
-                tool_response = tool_function(query)
-
-            # Incorporate the tool's result into the LLM's response
-            llm_response += f"\n\nTool output:\n{tool_response}"
-    
-    return llm_response
+    # The model asks for tools with JSON tool calls; results are fed back for
+    # at most `budget.max_steps` rounds
+    budget = budget or TurnBudget(model=DEFAULT_MODEL)
+    dispatcher = ToolDispatcher(tools)
+    header = f"{system_message}\n{tool_instructions()}"
+    rounds: List[str] = []
+    with span("agent.turn", model=budget.model or DEFAULT_MODEL, history=len(history or [])) as turn:
+        while not budget.exhausted:
+            budget.steps += 1
+            with span("agent.step", step=budget.steps) as step:
+                with span("agent.prompt"):
+                    conversation = _build_prompt(header, history or [], prompt, rounds, budget.model or DEFAULT_MODEL)
+                budget.charge(conversation)
+                llm_response = ""
+                for chunk in client.stream(conversation):
+                    llm_response += chunk
+                    yield chunk
+                budget.charge(llm_response)
 
+                calls, errors = parse_tool_calls(llm_response)
+                step.set(tool_calls=len(calls), invalid_calls=len(errors))
+                if not calls and not errors:
+                    turn.set(steps=budget.steps, tool_calls=budget.tool_calls, tokens=budget.tokens)
+                    return
+                results = dispatcher.dispatch(calls, budget)
+                feedback = [f"Tool {r.call.name} returned:\n{r.output}" for r in results] + errors
+                for item in feedback:
+                    yield f"\n\nTool output:\n{item}"
+                rounds.append(f"Assistant: {llm_response}\n" + "\n".join(feedback))
+        turn.set(steps=budget.steps, tool_calls=budget.tool_calls, tokens=budget.tokens, exhausted=True)
+    yield "\n\n(Stopped: tool-call budget for this turn exhausted.)"
 
-def extract_query_from_prompt(prompt: str) -> str:
-    # Logic to extract a SQL query from the prompt
-    return "SELECT * FROM my_table LIMIT 10"  # Placeholder; add real extraction logic
 
-def extract_table_from_prompt(prompt: str) -> str:
-    # Logic to extract table name from the prompt
-    return "my_table"  # Placeholder; add real extraction logic
+def _build_prompt(header: str, history: List[Dict[str, str]], prompt: str, rounds: List[str], model: str) -> str:
+    # Priority: instructions, the current request, the newest tool rounds,
+    # then as much earlier chat as still fits.
+    context = PromptBudget(model)
+    header = context.take(header)
+    user = context.take(f"User input: {prompt}")
+    recent: List[str] = []
+    for i, r in enumerate(reversed(rounds)):
+        if i and context.count(r) > context.remaining:
+            break
+        recent.insert(0, context.take(r))
+    chat = trim_history(history, context.remaining, model)
+    lines = [header] + [f"{m['role'].capitalize()}: {m['content']}" for m in chat] + [user] + recent
+    return "\n".join(lines)
@@ -1,11 +1,15 @@
+import uuid
+
 import snowflake.connector
 import pandas as pd
 import streamlit as st
-from cortex_inference import cortex_inference
-from agent import run_agent
+from completion_cache import default_completion_cache
+from connection_manager import ConnectionManager, credential_key
+from cortex_client import CortexClient
+from agent import stream_agent
+from tracing import default_tracer, trace_frame
 
-@st.cache_resource(ttl='5h')
-def get_db(username, password, account, warehouse, role):
+def _connect(username, password, account, warehouse, role):
     database = "SNOWFLAKE"
     schema = "ACCOUNT_USAGE"
     con = snowflake.connector.connect(
@@ -19,6 +23,21 @@ def get_db(username, password, account, warehouse, role):
     )
     return con
 
+QUERY_TIMEOUT = 10 * 60  # seconds; enforced server-side on every leased connection
+
+@st.cache_resource
+def get_connection_manager() -> ConnectionManager:
+    # One manager for the whole server: a bounded pool per credential set, and
+    # each browser session leases its own connection instead of sharing one
+    manager = ConnectionManager(pool_size=8, lease_idle=300.0, statement_timeout=QUERY_TIMEOUT)
+    manager.start_reaper()
+    return manager
+
+@st.cache_resource(ttl='5h')
+def get_cortex_client(username, password, account, warehouse, role):
+    # Pooled Cortex sessions so each prompt doesn't pay for a fresh login
+    return CortexClient(lambda: _connect(username, password, account, warehouse, role), cache=default_completion_cache())
+
 
 st.set_page_config(page_title="Snow-Wise", page_icon="❄️")
 st.title("❄️ :blue[Snow-Wise]")
@@ -33,9 +52,12 @@ with st.sidebar:
     snowflake_password= st.text_input("Snowflake Password", key="snowflake_password", type="password")
     snowflake_warehouse= st.text_input("Snowflake Warehouse", key="snowflake_warehouse")
     snowflake_role= st.text_input("Snowflake Role", key="snowflake_role")
+    show_trace = st.checkbox("Show trace (debug)", key="show_trace")
 
     if snowflake_account and snowflake_username and snowflake_role and snowflake_password and snowflake_warehouse:
-        con = get_db(
+        db_key = credential_key(snowflake_account, snowflake_username, snowflake_password, snowflake_warehouse,
+                                snowflake_role)
+        cortex_client = get_cortex_client(
             username=snowflake_username,
             password=snowflake_password,
             account=snowflake_account,
@@ -61,7 +83,19 @@ if prompt := st.chat_input("I need help with finding the long running queries on
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        response = run_agent(con, prompt)
-        st.markdown(response)
+        # Render tokens and tool outputs as they arrive instead of after the whole turn
+        session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+        connect = lambda: _connect(snowflake_username, snowflake_password, snowflake_account, snowflake_warehouse,
+                                   snowflake_role)
+        with default_tracer.span("chat.turn") as turn, \
+                get_connection_manager().connection(session_id, db_key, connect) as con:
+            response = st.write_stream(stream_agent(con, prompt, cortex_client, history=st.session_state.messages[:-1]))
+        if cortex_client.last_time_to_first_token is not None:
+            st.caption(f"Time to first token: {cortex_client.last_time_to_first_token:.2f}s")
+        if show_trace:
+            with st.expander(f"Trace for this turn ({turn.duration_ms / 1000:.2f}s)"):
+                st.dataframe(trace_frame(default_tracer.spans(turn.trace_id)), hide_index=True)
+                st.caption("Per-stage latency across recent turns")
+                st.dataframe(default_tracer.summary())
 
     st.session_state.messages.append({"role": "assistant", "content": response})
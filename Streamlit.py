@@ -1,20 +1,19 @@
 import streamlit as st
 import pandas as pd
 import snowflake.connector
-import time
 from typing import Optional
-
-def cortex_inference(prompt: str) -> str:
-    query = f"SELECT SNOWFLAKE.CORTEX.COMPLETE('snowflake-arctic', '{prompt}');"
-    con = snowflake.connector.connect(
-        # Connection params
-    )
-    result = pd.read_sql(query, con)
-    con.close()
-    return result.iloc[0, 0]
-
-def check_query(query: str) -> str:
-    template = """
+import os
+import uuid
+
+from connection_manager import ConnectionManager
+from cortex_inference import routed_inference, routed_inference_stream
+from plan_cost import PlanComparison, PlanPrescreen
+from query_benchmark import BenchmarkStore, QueryBenchmark
+from query_jobs import SUCCEEDED, Job, JobManager
+from query_metrics import QueryMetricsProvider
+from sql_lint import lint
+
+CHECK_TEMPLATE = """
     {query}
     Double check the Snowflake SQL query above for common mistakes, including:
     - Using NOT IN with NULL values
@@ -28,12 +27,8 @@ def check_query(query: str) -> str:
     If there are any of the above mistakes, rewrite the query. If there are no mistakes, just reproduce the original query.
     Output the final SQL query only.
     SQL Query: """
-    
-    prompt = template.format(query=query.replace('"', '\\"').replace("'", "\\'"))
-    return cortex_inference(prompt)
 
-def optimize_query(query: str) -> str:
-    prompt = f"""
+OPTIMIZE_TEMPLATE = """
     You are a helpful assistant for analyzing and optimizing queries running on Snowflake to reduce resource consumption and improve performance.
     Please analyze and optimize the following SQL query:
 
@@ -46,69 +41,181 @@ def optimize_query(query: str) -> str:
 
     Output the optimized SQL query only.
     """
-    return cortex_inference(prompt)
 
-def run_query(query: str) -> tuple:
-    con = snowflake.connector.connect(
+def _check_prompt(query: str, report) -> str:
+    hints = f"Static analysis found:\n{report.summary()}\n" if report.findings else ""
+    return hints + CHECK_TEMPLATE.format(query=query)
+
+QUERY_TIMEOUT = 30 * 60  # seconds; longer validation runs are cancelled
+
+def check_query(query: str) -> str:
+    # Local rules first; Cortex only when they cannot decide
+    report = lint(query)
+    if not report.needs_llm:
+        return query
+    return routed_inference("check", _check_prompt(query, report), template=CHECK_TEMPLATE)
+
+def check_query_stream(query: str):
+    report = lint(query)
+    if not report.needs_llm:
+        return iter([query])
+    return routed_inference_stream("check", _check_prompt(query, report), template=CHECK_TEMPLATE)
+
+def optimize_query(query: str) -> str:
+    return routed_inference("rewrite", OPTIMIZE_TEMPLATE.format(query=query), template=OPTIMIZE_TEMPLATE)
+
+def optimize_query_stream(query: str):
+    return routed_inference_stream("rewrite", OPTIMIZE_TEMPLATE.format(query=query), template=OPTIMIZE_TEMPLATE)
+
+def stream_code(chunks) -> str:
+    """Show streamed SQL as it arrives; rendered as code, since markdown would mangle `*`, `_` and backticks."""
+    placeholder = st.empty()
+    text = ""
+    for chunk in chunks:
+        text += chunk
+        placeholder.code(text, language="sql")
+    return text
+
+def prescreen_rewrite(con, original_query: str, optimized_query: str) -> PlanComparison:
+    # EXPLAIN only compiles, so this costs no warehouse time; it runs on the session's leased connection
+    return PlanPrescreen(con).check(original_query, optimized_query)
+
+def _connect():
+    return snowflake.connector.connect(
         # Connection params
     )
-    cursor = con.cursor()
-    
-    # Execute the query and get the query ID
-    cursor.execute(query)
-    query_id = cursor.sfqid
-    
-    # Fetch the results
-    result = cursor.fetch_pandas_all()
-    
-    # Get the execution time from QUERY_HISTORY
-    execution_time_query = f"""
-    SELECT TOTAL_ELAPSED_TIME / 1000 as EXECUTION_TIME_SECONDS
-    FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
-    WHERE QUERY_ID = '{query_id}'
-    """
-    execution_time_result = pd.read_sql(execution_time_query, con)
-    execution_time = execution_time_result['EXECUTION_TIME_SECONDS'].iloc[0]
-    
-    cursor.close()
-    con.close()
-    
+
+# The connection params above are the only credential set, so one pool
+POOL_KEY = "default"
+
+@st.cache_resource
+def get_connection_manager() -> ConnectionManager:
+    # Each browser session leases its own connection; a shared one would interleave
+    # sessions' statements and let them see (and cancel) each other's queries
+    manager = ConnectionManager(pool_size=8, statement_timeout=QUERY_TIMEOUT)
+    manager.start_reaper()
+    return manager
+
+def get_job_manager(con) -> JobManager:
+    """This session's jobs on its leased connection; between reruns only `st.session_state.job_id` is kept."""
+    return JobManager(con, metrics=QueryMetricsProvider(con))
+
+@st.cache_resource
+def get_benchmark_store() -> BenchmarkStore:
+    return BenchmarkStore(os.path.expanduser("~/.cache/optima/benchmarks.sqlite"))
+
+def run_query(jobs: JobManager, query: str, label: str = "optimized") -> Job:
+    # Submit asynchronously so the script thread is not tied up for the whole query
+    job = jobs.submit(query, label=label, timeout=QUERY_TIMEOUT)
+    st.session_state.job_id = job.job_id
+    return job
+
+def watch_job(jobs: JobManager, job: Job) -> Optional[tuple]:
+    """Show progress (with a cancel button) until `job` finishes; return (result, execution_time) on success."""
+    if not job.done and st.button("Cancel query", key=f"cancel-{job.job_id}"):
+        jobs.cancel(job)
+    progress = st.empty()
+    jobs.wait([job], on_poll=lambda _: progress.info(
+        f"Query {job.job_id} {job.state.replace('_', ' ')} for {job.elapsed:.0f}s"))
+    progress.empty()
+    if job.state != SUCCEEDED:
+        st.error(f"Query {job.state.replace('_', ' ')}: {job.error}")
+        return None
+    result = jobs.result(job).to_pandas()
+    # Server-side elapsed time when INFORMATION_SCHEMA has it, else the time observed by the poller
+    execution_time = jobs.metrics.get([job.job_id])['TOTAL_ELAPSED_TIME'].iloc[0] / 1000
     return result, execution_time
 
+def show_results(result, optimized_execution_time: float):
+    st.subheader("Query Results")
+    st.dataframe(result)
+    st.write(f"Optimized execution time (first run): {optimized_execution_time:.2f} seconds")
+
+def benchmark_rewrite(original_query: str, optimized_query: str, runs: int):
+    """Time both queries `runs` times each with the result cache off and show the comparison."""
+    store = get_benchmark_store()
+    st.subheader("Performance Comparison")
+    progress = st.progress(0.0, text="Benchmarking...")
+    # A connection of its own: the benchmark turns the result cache off for its session
+    con = _connect()
+    try:
+        benchmark = QueryBenchmark(con, runs=runs, metrics=QueryMetricsProvider(con), store=store,
+                                   run_timeout=QUERY_TIMEOUT)
+        report = benchmark.compare(original_query, optimized_query,
+                                   on_progress=lambda done, total: progress.progress(
+                                       done / total, text=f"Benchmark run {done} of {total}"))
+    except Exception as e:
+        st.error(f"Benchmark failed: {e}")
+        return
+    finally:
+        progress.empty()
+        con.close()
+    st.dataframe(report.summary)
+    if report.speedup is not None:
+        low, high = report.speedup_ci
+        st.write(f"Speedup (median execution time): {report.speedup:.2f}x (95% CI {low:.2f}x - {high:.2f}x)")
+    regression = store.regression(report.fingerprint)
+    if regression and regression["regressed"]:
+        st.warning(f"Slower than earlier benchmarks of this query: {regression['latest_ms']:.0f} ms median "
+                   f"vs {regression['baseline_ms']:.0f} ms")
+    with st.expander("Individual runs"):
+        st.dataframe(report.runs)
+
 def main():
     st.title("SQL Query Optimizer")
 
     query = st.text_area("Enter your SQL query:", height=200)
-    original_execution_time = st.number_input("Original execution time (seconds):", min_value=0.0, step=0.1)
-
-    if st.button("Optimize Query"):
-        if query:
-            with st.spinner("Checking query..."):
-                checked_query = check_query(query)
-            
-            st.subheader("Checked Query")
-            st.code(checked_query, language="sql")
-
-            with st.spinner("Optimizing query..."):
-                optimized_query = optimize_query(checked_query)
-            
-            st.subheader("Optimized Query")
-            st.code(optimized_query, language="sql")
-
-            with st.spinner("Running optimized query..."):
-                result, optimized_execution_time = run_query(optimized_query)
-
-            st.subheader("Query Results")
-            st.dataframe(result)
-
-            st.subheader("Performance Comparison")
-            st.write(f"Original execution time: {original_execution_time:.2f} seconds")
-            st.write(f"Optimized execution time: {optimized_execution_time:.2f} seconds")
-            improvement = (original_execution_time - optimized_execution_time) / original_execution_time * 100
-            st.write(f"Improvement: {improvement:.2f}%")
-
-        else:
-            st.warning("Please enter a SQL query.")
+    benchmark_runs = st.number_input("Benchmark runs per query (0 to skip):", min_value=0, max_value=20, value=3)
+
+    session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+    with get_connection_manager().connection(session_id, POOL_KEY, _connect) as con:
+        jobs = get_job_manager(con)
+
+        # Reattach to a query this session submitted before this rerun (e.g. after pressing Cancel)
+        job = jobs.attach(st.session_state.job_id, timeout=QUERY_TIMEOUT) if "job_id" in st.session_state else None
+        if job is not None and not job.done:
+            st.subheader("Running Query")
+            finished = watch_job(jobs, job)
+            if finished is not None:
+                show_results(*finished)
+                if st.session_state.get("benchmark"):
+                    benchmark_rewrite(*st.session_state.pop("benchmark"))
+
+        if st.button("Optimize Query"):
+            if query:
+                findings = lint(query).findings
+                if findings:
+                    st.subheader("Static Analysis")
+                    st.dataframe(pd.DataFrame([f.__dict__ for f in findings]))
+
+                # Stream both completions so the user sees progress instead of a spinner
+                st.subheader("Checked Query")
+                checked_query = stream_code(check_query_stream(query))
+
+                st.subheader("Optimized Query")
+                optimized_query = stream_code(optimize_query_stream(checked_query))
+
+                plans = prescreen_rewrite(con, query, optimized_query)
+                if plans.original is not None and plans.optimized is not None:
+                    st.subheader("Estimated Plan Cost")
+                    st.dataframe(pd.DataFrame(
+                        [{"query": label, "bytes": p.bytes_assigned, "partitions": p.partitions_assigned,
+                          "partitions_total": p.partitions_total, "joins": p.joins, "join_order": " -> ".join(p.join_order)}
+                         for label, p in (("original", plans.original), ("optimized", plans.optimized))]))
+                if not plans.accepted:
+                    st.warning(f"Optimized query not run: {plans.reason}")
+                    st.stop()
+
+                # Benchmark after the first run returns, also if that happens on a later rerun
+                st.session_state.benchmark = (query, optimized_query, int(benchmark_runs)) if benchmark_runs else None
+                finished = watch_job(jobs, run_query(jobs, optimized_query))
+                if finished is not None:
+                    show_results(*finished)
+                    if st.session_state.get("benchmark"):
+                        benchmark_rewrite(*st.session_state.pop("benchmark"))
+
+            else:
+                st.warning("Please enter a SQL query.")
 
 if __name__ == "__main__":
     main()
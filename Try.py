@@ -5,23 +5,7 @@ from langchain.llms import BaseLLM
 from langchain.agents import ZeroShotAgent
 from langchain.prompts import PromptTemplate
 
-def cortex_inference(prompt: str) -> str:
-    # Use Snowflake Cortex for inference, calling the SNOWFLAKE.CORTEX.COMPLETE function
-    query = f"SELECT SNOWFLAKE.CORTEX.COMPLETE('snowflake-arctic', '{prompt}');"
-    
-    # Assuming you have a working Snowflake connection
-    con = snowflake.connector.connect(
-        user='your_user',
-        password='your_password',
-        account='your_account',
-        warehouse='your_warehouse',
-        database='your_database',
-        schema='your_schema'
-    )
-    
-    result = pd.read_sql(query, con)
-    con.close()
-    return result.iloc[0, 0]
+from cortex_inference import cortex_inference
 
 # Create LLM wrapper
 class SnowflakeCortexLLM(BaseLLM):
@@ -1,8 +1,40 @@
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta, timezone
 import pandas as pd
 from typing import List, Optional, Type, Sequence, Dict, Any, Union, Tuple
 from snowflake.connector import SnowflakeConnection
 from pydantic import BaseModel, Field
 
+from concurrency import bounded_map
+from completion_cache import default_completion_cache
+from analysis_ledger import AnalysisLedger, LedgerDecision
+from equivalence import ResultEquivalenceChecker
+from cortex_client import CortexClient
+from fingerprint import fingerprint, rank_fingerprints
+from history_store import HistoryStore
+from model_router import ModelRouter
+from operator_stats import OperatorStatsProvider, profile_text, rank_hotspots
+from plan_cost import PlanPrescreen
+from prompt_budget import PromptBudget, compact_schema
+from query_benchmark import BenchmarkStore, QueryBenchmark
+from query_jobs import SUCCEEDED, Job, JobManager
+from query_metrics import QueryMetricsProvider
+from query_stream import QueryStream, execute_stream
+from schema_cache import SchemaCache, default_schema_cache
+from sql_lint import lint
+from sql_parser import extract_tables
+from tracing import span
+
+# Shapes fetched per ranked slot, as several parameterized hashes can share one fingerprint
+SHAPE_OVERFETCH = 3
+
+SKIPPED_DETAIL = "query too long for the rewrite models' context window"
+
+
+def _query_section(query: str) -> str:
+    return f"Suggest optimizations for this query:\n{query}"
+
 class _InfoSQLDatabaseToolInput(BaseModel):
     table_names: str = Field(
         ...,
@@ -18,16 +50,18 @@ class InfoSnowflakeTableTool:
     name: str = "sql_db_schema"
     description: str = "Get the schema and sample rows for the specified SQL tables."
 
-    def __init__(self, conn_sf):
+    def __init__(self, conn_sf, cache: Optional[SchemaCache] = None):
         self.conn_sf = conn_sf
+        self.cache = cache or default_schema_cache
 
     def run(self, table_names: str) -> str:
         """Get the schema for tables in a comma-separated list."""
         output_schema = ""
         _table_names = table_names.split(",")
-        for t in _table_names:
-            schema = pd.read_sql(f"DESCRIBE TABLE {t}", self.conn_sf)
-            output_schema += f"Schema for table {t}:\n{schema.to_string()}\n\n"
+        with span("tool.schema", tables=len(_table_names)):
+            for t in _table_names:
+                schema = self.cache.describe(self.conn_sf, t)
+                output_schema += f"Schema for table {t}:\n{schema.to_string()}\n\n"
         return output_schema
 
 class _QuerySQLCheckerToolInput(BaseModel):
@@ -41,13 +75,8 @@ class QuerySQLCheckerTool:
     Use this tool to double check if your query is correct before executing it.
     Always use this tool before executing a query with sql_db_query!
     """
-
-    def __init__(self, conn_sf):
-        self.conn_sf = conn_sf
-
-    def run(self, query: str) -> str:
-        """Use Cortex to check the query."""
-        template = """
+    system_message: str = "You are a helpful AI assistant that checks and optimizes Snowflake SQL queries."
+    template: str = """
         {query}
         Double check the Snowflake SQL query above for common mistakes, including:
         - Using NOT IN with NULL values
@@ -64,26 +93,42 @@ class QuerySQLCheckerTool:
         Output the final SQL query only.
 
         SQL Query: """
-        escaped_query = query.replace("'", "''")
-        prompt = template.format(query=escaped_query)
-        cortex_query = f"""
-        SELECT SNOWFLAKE.CORTEX.COMPLETE(
-            'llama2-70b-chat',
-            [
-                {{
-                    'role': 'system', 
-                    'content': 'You are a helpful AI assistant that checks and optimizes Snowflake SQL queries.'
-                }},
-                {{
-                    'role': 'user',
-                    'content': '{prompt}'
-                }}
-            ],
-            {{}}
-        ) as response
-        """
-        result = pd.read_sql(cortex_query, self.conn_sf)
-        return result['RESPONSE'].iloc[0]
+
+    def __init__(self, conn_sf, client: Optional[CortexClient] = None, router: Optional[ModelRouter] = None,
+                 task: str = "check", precheck: bool = True):
+        self.conn_sf = conn_sf
+        self.client = client or CortexClient.for_connection(conn_sf, cache=default_completion_cache())
+        self.router = router or ModelRouter(self.client)
+        self.task = task
+        self.precheck = precheck
+
+    def run(self, query: str) -> str:
+        """Check the query locally and use Cortex only when the rules cannot decide."""
+        return self.run_batch([query])[0]
+
+    def run_batch(self, queries: List[str]) -> List[str]:
+        """Check several queries, sending the undecided ones to Cortex in one round trip per batch."""
+        results: List[Optional[str]] = list(queries)
+        prompts, positions = [], []
+        for i, query in enumerate(queries):
+            prompt = self.template.format(query=query)
+            if self.precheck:
+                report = lint(query)
+                if not report.needs_llm:
+                    continue  # the rules vouch for it; nothing to rewrite
+                if report.findings:
+                    prompt = f"Static analysis of the query found:\n{report.summary()}\n{prompt}"
+            prompts.append(prompt)
+            positions.append(i)
+        if len(prompts) == 1:
+            completions = [self.router.complete(self.task, prompts[0], system=self.system_message,
+                                                template=self.template)]
+        else:
+            completions = self.router.complete_batch(self.task, prompts, system=self.system_message,
+                                                     template=self.template)
+        for i, completion in zip(positions, completions):
+            results[i] = completion
+        return results
 
 class _QuerySQLDataBaseToolInput(BaseModel):
     query: str = Field(..., description="A detailed and correct SQL query.")
@@ -98,27 +143,125 @@ class QuerySQLDataBaseTool:
     If an error is returned, rewrite the query, check the query, and try again.
     """
 
-    def __init__(self, conn_sf):
+    def __init__(self, conn_sf, max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+                 metrics: Optional[QueryMetricsProvider] = None):
         self.conn_sf = conn_sf
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.metrics = metrics
+        self.jobs = JobManager(conn_sf, metrics=metrics)
+
+    def submit(self, query: str, label: str = "", timeout: Optional[float] = None) -> Job:
+        """Start the query asynchronously and return its job (query_id is `job.job_id`)."""
+        return self.jobs.submit(query, label, timeout)
 
-    def run(self, query: str) -> Tuple[Union[str, pd.DataFrame], Optional[str]]:
+    def run(self, query: str, max_rows: Optional[int] = None,
+            max_bytes: Optional[int] = None) -> Tuple[Union[str, pd.DataFrame], Optional[str]]:
         """Execute the query, return the results and query_id; or an error message."""
+        with span("warehouse.query") as s:
+            try:
+                start = time.perf_counter()
+                stream = self.stream(query, max_rows=max_rows, max_bytes=max_bytes)
+                s.set(query_id=stream.query_id)
+                results = stream.to_pandas()
+                if self.metrics is not None:
+                    self.metrics.record_client_timing(stream.query_id, time.perf_counter() - start)
+                s.set(rows=stream.rows_fetched, bytes=stream.bytes_fetched, truncated=stream.truncated)
+                return results, stream.query_id
+            except Exception as e:
+                s.error = str(e)
+                return f"Error: {e}", None
+
+    def stream(self, query: str, max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+               arrow: bool = False) -> QueryStream:
+        """Execute the query once and return a batch iterator that also carries the query_id."""
+        return execute_stream(
+            self.conn_sf,
+            query,
+            max_rows=max_rows if max_rows is not None else self.max_rows,
+            max_bytes=max_bytes if max_bytes is not None else self.max_bytes,
+            arrow=arrow,
+        )
+
+@dataclass
+class QueryOptimization:
+    """Outcome of optimizing one query.
+
+    `status` is one of verified (results match, timings measured), unchanged
+    (the model kept the query), rejected (not cheaper by EXPLAIN), mismatch
+    (different results), skipped (too long for the rewrite models) or failed. `original`/`optimized` hold the benchmark
+    summary per variant (or the single validation run's metrics).
+    """
+    original_query: str
+    optimized_query: Optional[str] = None
+    query_id: Optional[str] = None
+    fingerprint: str = ""
+    status: str = "failed"
+    detail: str = ""
+    original: Dict[str, float] = field(default_factory=dict)
+    optimized: Dict[str, float] = field(default_factory=dict)
+    speedup: Optional[float] = None
+    speedup_ci: Optional[Tuple[float, float]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _metrics(row: Dict[str, Any]) -> Dict[str, float]:
+    # Numeric columns only, as plain floats (JSON-friendly)
+    values = {}
+    for name, value in row.items():
         try:
-            cursor = self.conn_sf.cursor()
-            cursor.execute(query)
-            query_id = cursor.sfqid
-            results = pd.read_sql(query, self.conn_sf)
-            cursor.close()
-            return results, query_id
-        except Exception as e:
-            return f"Error: {e}", None
+            values[name] = float(value)
+        except (TypeError, ValueError):
+            continue
+    return values
+
 
 class SnowflakeSQLOptimizer:
-    def __init__(self, conn_sf):
+    def __init__(self, conn_sf, client: Optional[CortexClient] = None, max_concurrency: int = 4,
+                 call_timeout: Optional[float] = 300.0, history_rows: Optional[int] = 500000,
+                 equivalence_mode: str = "server_hash", history_store: Optional[HistoryStore] = None,
+                 router: Optional[ModelRouter] = None, batch_completions: bool = True,
+                 prescreen: bool = True, min_improvement: float = 0.0,
+                 validation_timeout: Optional[float] = 1800.0, benchmark_runs: int = 3,
+                 benchmark_store: Optional[BenchmarkStore] = None, operator_stats: bool = True,
+                 ledger: Optional[AnalysisLedger] = None, benchmark_conn=None, benchmark_lock=None):
         self.conn_sf = conn_sf
+        self.history_rows = history_rows
+        self.history_store = history_store
+        self.client = client or CortexClient.for_connection(conn_sf, pool_size=max_concurrency,
+                                                            cache=default_completion_cache())
+        self.max_concurrency = max_concurrency
+        self.call_timeout = call_timeout
         self.info_tool = InfoSnowflakeTableTool(conn_sf)
-        self.checker_tool = QuerySQLCheckerTool(conn_sf)
-        self.query_tool = QuerySQLDataBaseTool(conn_sf)
+        self.router = router or ModelRouter(self.client)
+        self.batch_completions = batch_completions
+        # The optimizer uses the checker for rewrites, so it gets the large-model policy
+        self.checker_tool = QuerySQLCheckerTool(conn_sf, self.client, self.router, task="rewrite", precheck=False)
+        self.metrics = QueryMetricsProvider(conn_sf)
+        self.query_tool = QuerySQLDataBaseTool(conn_sf, metrics=self.metrics)
+        self.equivalence = ResultEquivalenceChecker(conn_sf, mode=equivalence_mode)
+        self.prescreen = PlanPrescreen(conn_sf, min_improvement) if prescreen else None
+        self.validation_timeout = validation_timeout
+        self.operator_stats = OperatorStatsProvider(conn_sf) if operator_stats else None
+        # Repeated cache-free runs per verified rewrite; 0 keeps the single validation run. They
+        # turn the result cache off for their session, so give them `benchmark_conn` if conn_sf is shared,
+        # and `benchmark_lock` if other optimizers benchmark on the same warehouse.
+        if not benchmark_runs:
+            self.benchmark = None
+        elif benchmark_conn is None:
+            self.benchmark = QueryBenchmark(conn_sf, runs=benchmark_runs, metrics=self.metrics,
+                                            store=benchmark_store, run_timeout=validation_timeout,
+                                            jobs=self.query_tool.jobs, lock=benchmark_lock)
+        else:
+            self.benchmark = QueryBenchmark(benchmark_conn, runs=benchmark_runs, store=benchmark_store,
+                                            run_timeout=validation_timeout, lock=benchmark_lock)
+        # Earlier analyses of unchanged queries on unchanged tables are reused instead of redone
+        self.ledger = ledger
+        self._decisions: Dict[str, LedgerDecision] = {}
+        # Step 4 comparisons made from client-side timings: (original id, optimized id, result)
+        self._provisional: List[Tuple[str, str, Optional[QueryOptimization]]] = []
 
     def run(self, input_query: str) -> str:
         system_message = """
@@ -146,109 +289,335 @@ class SnowflakeSQLOptimizer:
                 - Any notable observations or recommendations for further action
         """
 
-        cortex_query = f"""
-        SELECT SNOWFLAKE.CORTEX.COMPLETE(
-            'llama2-70b-chat',
-            [
-                {{
-                    'role': 'system', 
-                    'content': '{system_message}'
-                }},
-                {{
-                    'role': 'user',
-                    'content': '{input_query}'
-                }}
-            ],
-            {{}}
-        ) as response
+        with span("optimizer.run"):
+            assistant_response = self.router.complete("plan", input_query, system=system_message)
+
+            # Process the assistant's response
+            schemas: Dict[str, pd.DataFrame] = {}
+            profiles: Dict[str, str] = {}
+            steps = assistant_response.split('\n')
+            for step in steps:
+                if step.startswith("1. Identify Expensive Queries"):
+                    with span("optimizer.identify"):
+                        expensive_queries = self.expensive_queries()
+                        print("Expensive queries identified.")
+                        if self.ledger is not None:
+                            expensive_queries = self._skip_analyzed(expensive_queries)
+
+                elif step.startswith("2. Analyze Query Structure"):
+                    with span("optimizer.analyze"):
+                        tables = []
+                        for _, row in expensive_queries.iterrows():
+                            tables.extend(self._extract_tables(row['QUERY_TEXT']))
+                        tables = list(dict.fromkeys(tables))
+                        results = bounded_map(self.info_tool.run, tables, self.max_concurrency, self.call_timeout)
+                        for table, schema in zip(tables, results):
+                            print(f"Schema for table {table}:")
+                            print(f"Error: {schema}" if isinstance(schema, Exception) else schema)
+                            # Keep the DataFrames (already cached) for compact prompt context in step 3
+                            if not isinstance(schema, Exception):
+                                schemas[table] = self.info_tool.cache.describe(self.conn_sf, table)
+                        profiles = self._operator_profiles(expensive_queries)
+
+                elif step.startswith("3. Suggest Optimizations"):
+                    with span("optimizer.suggest"):
+                        optimizations = self._suggest_optimizations(expensive_queries, schemas, profiles)
+                        print("Optimization suggestions:")
+                        print(optimizations)
+
+                elif step.startswith("4. Validate Improvements"):
+                    with span("optimizer.validate"):
+                        for original_query, optimized_query in optimizations:
+                            result = self._validate(QueryOptimization(original_query, optimized_query,
+                                                                      fingerprint=fingerprint(original_query)))
+                            self._remember(result)
+
+                elif step.startswith("5. Prepare Summary"):
+                    with span("optimizer.summary"):
+                        summary = self._prepare_summary()
+                        print("Summary:")
+                        print(summary)
+
+            return "Optimization process completed."
+
+    def expensive_queries(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                          top_n: Optional[int] = 20, min_elapsed_ms: Optional[float] = None) -> pd.DataFrame:
+        """Step 1: the most expensive SELECT shapes between `start` and `end` (default: the last 7 days).
+
+        Query shapes are ranked rather than raw texts, so one dashboard query
+        repeated with different literals takes a single slot, costed by the
+        sum over all its runs. `top_n=None` keeps every shape; `min_elapsed_ms`
+        drops shapes whose summed elapsed time is below it.
         """
-
-        result = pd.read_sql(cortex_query, self.conn_sf)
-        assistant_response = result['RESPONSE'].iloc[0]
-
-        # Process the assistant's response
-        steps = assistant_response.split('\n')
-        for step in steps:
-            if step.startswith("1. Identify Expensive Queries"):
-                query = """
-                SELECT query_text, execution_time, bytes_scanned
-                FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
-                WHERE start_time >= DATEADD(day, -7, CURRENT_TIMESTAMP())
-                  AND query_type = 'SELECT'
-                ORDER BY execution_time DESC
-                LIMIT 20
-                """
-                expensive_queries, _ = self.query_tool.run(query)
-                print("Expensive queries identified.")
-
-            elif step.startswith("2. Analyze Query Structure"):
-                for _, row in expensive_queries.iterrows():
-                    query_text = row['QUERY_TEXT']
-                    tables = self._extract_tables(query_text)
-                    for table in tables:
-                        schema = self.info_tool.run(table)
-                        print(f"Schema for table {table}:")
-                        print(schema)
-
-            elif step.startswith("3. Suggest Optimizations"):
-                optimizations = self._suggest_optimizations(expensive_queries)
-                print("Optimization suggestions:")
-                print(optimizations)
-
-            elif step.startswith("4. Validate Improvements"):
-                for original_query, optimized_query in optimizations:
-                    original_result, original_query_id = self.query_tool.run(original_query)
-                    optimized_result, optimized_query_id = self.query_tool.run(optimized_query)
-                    
-                    if original_result.equals(optimized_result):
-                        print("Results match. Comparing performance...")
-                        self._compare_performance(original_query_id, optimized_query_id)
-                    else:
-                        print("Results do not match. Optimization may be incorrect.")
-
-            elif step.startswith("5. Prepare Summary"):
-                summary = self._prepare_summary()
-                print("Summary:")
-                print(summary)
-
-        return "Optimization process completed."
+        if self.history_store is not None:
+            # Incremental pull into the local store, then rank offline
+            self.history_store.ingest(self.conn_sf)
+            since = start or datetime.now(timezone.utc) - timedelta(days=7)
+            ranked = self.history_store.rank(start=since, end=end, top_n=top_n or 10 ** 9)
+        else:
+            # Aggregated per shape in the warehouse, so frequent cheap runs count
+            # as much as one slow run; only the top shapes come back. Snowflake's
+            # parameterized hash splits a few shapes our fingerprint merges (e.g.
+            # IN lists of different lengths), so fetch some extra to merge below.
+            since = f"'{start.isoformat()}'::TIMESTAMP_LTZ" if start else "DATEADD(day, -7, CURRENT_TIMESTAMP())"
+            query = f"""
+                        SELECT MAX_BY(query_id, total_elapsed_time) AS query_id,
+                               MAX_BY(query_text, total_elapsed_time) AS query_text,
+                               MAX_BY(database_name, total_elapsed_time) AS database_name,
+                               MAX_BY(schema_name, total_elapsed_time) AS schema_name,
+                               SUM(total_elapsed_time) AS total_elapsed_time,
+                               SUM(execution_time) AS execution_time,
+                               SUM(bytes_scanned) AS bytes_scanned,
+                               COUNT(*) AS execution_count
+                        FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
+                        WHERE start_time >= {since}
+                          AND query_type = 'SELECT'
+                        """
+            if end:
+                query += f"  AND start_time < '{end.isoformat()}'::TIMESTAMP_LTZ\n"
+            query += "GROUP BY COALESCE(query_parameterized_hash, query_hash, MD5(query_text))\n"
+            if min_elapsed_ms is not None:
+                query += f"HAVING SUM(total_elapsed_time) >= {float(min_elapsed_ms)}\n"
+            query += "ORDER BY SUM(total_elapsed_time) DESC\n"
+            if top_n:
+                query += f"LIMIT {int(top_n) * SHAPE_OVERFETCH}\n"
+            history, _ = self.query_tool.run(query, max_rows=self.history_rows)
+            if isinstance(history, str):
+                raise RuntimeError(f"Could not read query history: {history}")
+            ranked = rank_fingerprints(history, top_n=top_n or 10 ** 9)
+        if min_elapsed_ms is not None:
+            ranked = ranked[ranked["TOTAL_ELAPSED_TIME"] >= min_elapsed_ms].reset_index(drop=True)
+        return ranked
+
+    def optimize_query(self, query_text: str, query_id: Optional[str] = None) -> QueryOptimization:
+        """Steps 2-4 for one query: schemas and operator profile, a Cortex rewrite, then validation."""
+        result = QueryOptimization(query_text, query_id=query_id, fingerprint=fingerprint(query_text))
+        if not self._fits(query_text):
+            result.status, result.detail = "skipped", SKIPPED_DETAIL
+            return result
+        with span("optimizer.query", fingerprint=result.fingerprint):
+            schemas = {}
+            for table in self._extract_tables(query_text):
+                try:
+                    schemas[table] = self.info_tool.cache.describe(self.conn_sf, table)
+                except Exception as e:
+                    print(f"Schema for table {table}:\nError: {e}")
+            profiles = {}
+            if query_id:
+                profiles = self._operator_profiles(pd.DataFrame({"QUERY_ID": [query_id], "QUERY_TEXT": [query_text]}))
+            prompt = self._optimization_prompt(query_text, schemas, profiles.get(query_text, ""))
+            result.optimized_query = self.checker_tool.run(prompt)
+            if fingerprint(result.optimized_query) == result.fingerprint:
+                result.status, result.detail = "unchanged", "the model kept the query as it is"
+                return result
+            return self._validate(result)
+
+    def _validate(self, result: QueryOptimization) -> QueryOptimization:
+        """Step 4 for one rewrite; prints the outcome and records it on `result`."""
+        original_query, optimized_query = result.original_query, result.optimized_query
+        # Compile-only cost check first: rewrites that are not cheaper
+        # on paper never spend warehouse time.
+        if self.prescreen is not None:
+            plans = self.prescreen.check(original_query, optimized_query)
+            if not plans.accepted:
+                print(f"Rewrite rejected before execution: {plans.reason}")
+                result.status, result.detail = "rejected", plans.reason
+                return result
+        # Run both at once, asynchronously, for their query ids/timings
+        # without downloading the rows; correctness is checked by the
+        # equivalence engine instead.
+        try:
+            original_job, optimized_job = self.query_tool.jobs.wait(
+                self.query_tool.jobs.submit_all([original_query, optimized_query],
+                                                ["original", "optimized"], self.validation_timeout))
+        except Exception as e:
+            print(f"Could not run queries: {e}")
+            result.status, result.detail = "failed", f"Could not run queries: {e}"
+            return result
+        if not (original_job.state == SUCCEEDED and optimized_job.state == SUCCEEDED):
+            result.status = "failed"
+            result.detail = (f"Could not run queries: original {original_job.state} {original_job.error}, "
+                             f"optimized {optimized_job.state} {optimized_job.error}")
+            print(result.detail)
+            return result
+
+        # Hash the results the validation runs just produced instead of running both again
+        try:
+            report = self.equivalence.check(original_query, optimized_query,
+                                            query_ids=(original_job.job_id, optimized_job.job_id))
+        except Exception as e:
+            print(f"Could not compare results: {e}")
+            result.status, result.detail = "failed", f"Could not compare results: {e}"
+            return result
+        if not report.equivalent:
+            print(f"Results do not match ({report.detail}). Optimization may be incorrect.")
+            result.status, result.detail = "mismatch", report.detail
+            return result
+        print(f"Results match ({report.mode}). Comparing performance...")
+        result.status, result.detail = "verified", f"results match ({report.mode})"
+        self._compare_performance(original_job.job_id, optimized_job.job_id, original_query, optimized_query,
+                                  result=result)
+        return result
+
+    def _skip_analyzed(self, expensive_queries: pd.DataFrame) -> pd.DataFrame:
+        """Drop queries the ledger already has a current analysis for, printing the stored outcome instead."""
+        fresh, self._decisions = self.ledger.partition(self.conn_sf, expensive_queries)
+        reused = [d for d in self._decisions.values() if d.reuse]
+        reasons: Dict[str, int] = {}
+        for d in self._decisions.values():
+            if not d.reuse:
+                reasons[d.reason] = reasons.get(d.reason, 0) + 1
+        print(f"Analyzing {len(fresh)} of {len(expensive_queries)} queries "
+              f"({', '.join(f'{n} {r}' for r, n in sorted(reasons.items())) or 'none changed'}).")
+        for d in reused:
+            result = d.entry.result
+            speedup = f", {result['speedup']:.2f}x faster" if result.get("speedup") else ""
+            analyzed = datetime.fromtimestamp(d.entry.analyzed_at, timezone.utc).strftime("%Y-%m-%d")
+            print(f"Unchanged since {analyzed}: {result['status']}{speedup} - {d.query_text[:80]}")
+        return fresh
+
+    def _remember(self, result: QueryOptimization):
+        decision = self._decisions.get(result.fingerprint)
+        if self.ledger is not None and decision is not None:
+            self.ledger.record(decision, result.to_dict())
 
     def _extract_tables(self, query):
-        # This is a simplified example. In a real scenario, you'd want to use a proper SQL parser.
-        words = query.split()
-        tables = []
-        for i, word in enumerate(words):
-            if word.upper() == "FROM" or word.upper() == "JOIN":
-                if i + 1 < len(words):
-                    tables.append(words[i + 1])
-        return list(set(tables))
-
-    def _suggest_optimizations(self, expensive_queries):
-        optimizations = []
+        # Base tables only: CTEs, subqueries, aliases and table functions are dropped
+        return extract_tables(query)
+
+    def _operator_profiles(self, expensive_queries) -> Dict[str, str]:
+        """Operator hotspot profile per query text, from the representative run's GET_QUERY_OPERATOR_STATS."""
+        if self.operator_stats is None or "QUERY_ID" not in expensive_queries.columns:
+            return {}
+        stats = self.operator_stats.get(expensive_queries["QUERY_ID"])
+        profiles = {}
         for _, row in expensive_queries.iterrows():
-            original_query = row['QUERY_TEXT']
-            optimization_prompt = f"Suggest optimizations for this query:\n{original_query}"
-            optimized_query = self.checker_tool.run(optimization_prompt)
+            profile = profile_text(rank_hotspots(stats.get(row["QUERY_ID"], [])))
+            if profile:
+                profiles[row["QUERY_TEXT"]] = profile
+        print(f"Operator profiles found for {len(profiles)} of {len(expensive_queries)} queries.")
+        return profiles
+
+    def _suggest_optimizations(self, expensive_queries, schemas: Optional[Dict[str, pd.DataFrame]] = None,
+                               profiles: Optional[Dict[str, str]] = None):
+        original_queries = []
+        for query in expensive_queries['QUERY_TEXT']:
+            if self._fits(query):
+                original_queries.append(query)
+            else:
+                print(f"Skipping query, {SKIPPED_DETAIL}: {query[:80]}")
+        if not original_queries:
+            return []
+        prompts = [self._optimization_prompt(q, schemas or {}, (profiles or {}).get(q, "")) for q in original_queries]
+        suggestions = None
+        if self.batch_completions:
+            # Whole top-N in one COMPLETE ... FROM VALUES round trip
+            try:
+                suggestions = self.checker_tool.run_batch(prompts)
+            except Exception as e:
+                print(f"Batched completion failed ({e}); falling back to one call per query.")
+        if suggestions is None:
+            suggestions = bounded_map(self.checker_tool.run, prompts, self.max_concurrency, self.call_timeout)
+        optimizations = []
+        for original_query, optimized_query in zip(original_queries, suggestions):
+            if isinstance(optimized_query, Exception):
+                print(f"Skipping query, optimization failed: {optimized_query}")
+                continue
             optimizations.append((original_query, optimized_query))
         return optimizations
 
-    def _compare_performance(self, original_query_id, optimized_query_id):
-        query = f"""
-        SELECT query_id, execution_time, bytes_scanned
-        FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
-        WHERE query_id IN ('{original_query_id}', '{optimized_query_id}')
-        """
-        performance_data, _ = self.query_tool.run(query)
+    def _prompt_budget(self) -> PromptBudget:
+        # Sized for the smallest model the rewrite can fall back to, so no fallback overflows.
+        # Reserve room for the checker template, system message and the rewritten query
+        return PromptBudget(self.router.smallest(self.checker_tool.task), reserve_for_output=1536)
+
+    def _fits(self, query: str) -> bool:
+        """Whether the whole query fits the rewrite prompt; a truncated query must never be rewritten."""
+        return bool(self._prompt_budget().fit_sections([_query_section(query)]))
+
+    def _optimization_prompt(self, query: str, schemas: Dict[str, pd.DataFrame], profile: str = "") -> str:
+        # The query always goes in whole (callers skip queries that do not `_fits`);
+        # table context is compacted to the referenced columns and added only while it fits.
+        context = self._prompt_budget()
+        prompt = context.fit_sections([_query_section(query)])
+        if profile:
+            # Where the time actually went, so the rewrite targets the dominant operator
+            prompt += "\n" + context.take(profile, max_tokens=300)
+        findings = lint(query).summary()
+        if findings:
+            prompt += "\n" + context.take(f"Static analysis found:\n{findings}", max_tokens=400)
+        tables = [compact_schema(t, schemas[t], query) for t in self._extract_tables(query) if t in schemas]
+        if tables:
+            prompt += "\nReferenced tables:\n" + context.fit_sections(tables)
+        return prompt
+
+    def _compare_performance(self, original_query_id, optimized_query_id, original_query=None, optimized_query=None,
+                             result: Optional[QueryOptimization] = None):
+        if self.benchmark is not None and original_query is not None and optimized_query is not None:
+            # One run each is mostly noise (result cache, warehouse warm-up),
+            # so time both variants repeatedly with the result cache off.
+            try:
+                report = self.benchmark.compare(original_query, optimized_query)
+            except Exception as e:
+                print(f"Benchmark failed ({e}); showing the validation run only.")
+            else:
+                print("Performance comparison (measured runs, result cache off):")
+                print(report.to_string())
+                if result is not None:
+                    summary = report.summary
+                    result.original = _metrics(summary.loc["original"].to_dict())
+                    result.optimized = _metrics(summary.loc["optimized"].to_dict())
+                    result.speedup, result.speedup_ci = report.speedup, report.speedup_ci
+                if self.benchmark.store is not None:
+                    regression = self.benchmark.store.regression(report.fingerprint)
+                    if regression and regression["regressed"]:
+                        print(f"Regression: optimized median {regression['latest_ms']:.0f} ms vs "
+                              f"best earlier {regression['baseline_ms']:.0f} ms")
+                return
+        # INFORMATION_SCHEMA first (seconds of lag) instead of ACCOUNT_USAGE (up to 45 minutes)
+        performance_data = self.metrics.get([original_query_id, optimized_query_id])
         print("Performance comparison:")
         print(performance_data)
+        if result is not None:
+            self._apply_metrics(result, original_query_id, optimized_query_id, performance_data)
+        if performance_data["SOURCE"].isin(("client", "missing")).any():
+            # Backfilled from ACCOUNT_USAGE in step 5
+            self._provisional.append((original_query_id, optimized_query_id, result))
+
+    def _apply_metrics(self, result: QueryOptimization, original_query_id: str, optimized_query_id: str,
+                       performance_data: pd.DataFrame):
+        by_id = performance_data.set_index("QUERY_ID")
+        for query_id, metrics in ((original_query_id, result.original), (optimized_query_id, result.optimized)):
+            if query_id in by_id.index:
+                metrics.update(_metrics(by_id.loc[query_id].to_dict()))
+        if result.original.get("TOTAL_ELAPSED_TIME") and result.optimized.get("TOTAL_ELAPSED_TIME"):
+            result.speedup = result.original["TOTAL_ELAPSED_TIME"] / result.optimized["TOTAL_ELAPSED_TIME"]
+
+    def _backfill_metrics(self):
+        """Replace client-side timings from step 4 with ACCOUNT_USAGE rows that have landed since."""
+        if not self.metrics.pending:
+            return
+        filled = self.metrics.backfill()
+        print(f"Server metrics backfilled for {filled} queries, {len(self.metrics.pending)} still pending.")
+        provisional, self._provisional = self._provisional, []
+        for original_query_id, optimized_query_id, result in provisional:
+            performance_data = self.metrics.get([original_query_id, optimized_query_id])
+            if result is not None:
+                self._apply_metrics(result, original_query_id, optimized_query_id, performance_data)
+            if performance_data["SOURCE"].isin(("client", "missing")).any():
+                self._provisional.append((original_query_id, optimized_query_id, result))
+            else:
+                print("Performance comparison (ACCOUNT_USAGE):")
+                print(performance_data)
 
     def _prepare_summary(self):
+        self._backfill_metrics()
         # In a real scenario, you'd want to aggregate the results from all previous steps
         return "Summary of optimization process..."
 
 # Example usage
-def create_snowflake_sql_optimizer(conn_sf):
-    return SnowflakeSQLOptimizer(conn_sf)
+def create_snowflake_sql_optimizer(conn_sf, client: Optional[CortexClient] = None, **kwargs):
+    return SnowflakeSQLOptimizer(conn_sf, client, **kwargs)
 
 # To use the optimizer:
 # 1. Set up your Snowflake connection
@@ -0,0 +1,252 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from schema_cache import qualified_name
+from sql_parser import extract_tables
+from tracing import span
+
+# Statuses worth keeping; failed analyses are always retried
+REUSABLE_STATUSES = ("verified", "unchanged", "rejected", "mismatch")
+
+
+@dataclass(frozen=True)
+class TableVersion:
+    """What a table looked like when a query was analyzed, from INFORMATION_SCHEMA.TABLES/COLUMNS."""
+    last_altered: Optional[str]
+    row_count: Optional[int]
+    column_hash: Optional[str]  # HASH_AGG over (column name, data type)
+
+
+def table_versions(conn_sf, tables: Iterable[str]) -> Dict[str, Optional[TableVersion]]:
+    """Current version of each table, keyed by qualified name; one metadata query per database.
+
+    Names must already be resolved (see `resolve_tables`); ones that are not
+    DATABASE.SCHEMA.TABLE, or are not found, map to None.
+    """
+    names = set(tables)
+    versions: Dict[str, Optional[TableVersion]] = {name: None for name in names}
+    by_database: Dict[str, Dict[str, List[str]]] = {}
+    for name in names:
+        parts = name.split(".")
+        if len(parts) == 3:
+            by_database.setdefault(parts[0], {}).setdefault(parts[1], []).append(parts[2])
+    for db, schemas in by_database.items():
+        query = f"""
+        SELECT t.table_schema, t.table_name, t.last_altered, t.row_count, c.column_hash
+        FROM {_identifier(db)}.INFORMATION_SCHEMA.TABLES t
+        LEFT JOIN (
+            SELECT table_schema, table_name, HASH_AGG(column_name, data_type) AS column_hash
+            FROM {_identifier(db)}.INFORMATION_SCHEMA.COLUMNS
+            WHERE {_table_filter(schemas)}
+            GROUP BY table_schema, table_name
+        ) c ON c.table_schema = t.table_schema AND c.table_name = t.table_name
+        WHERE {_table_filter(schemas, "t.")}
+        """
+        with span("snowflake.table_versions", database=db, tables=sum(len(ts) for ts in schemas.values())):
+            rows = pd.read_sql(query, conn_sf)
+        rows.columns = [c.upper() for c in rows.columns]
+        for row in rows.to_dict("records"):
+            versions[f"{db}.{row['TABLE_SCHEMA']}.{row['TABLE_NAME']}"] = TableVersion(
+                last_altered=None if pd.isna(row["LAST_ALTERED"]) else str(row["LAST_ALTERED"]),
+                row_count=None if pd.isna(row["ROW_COUNT"]) else int(row["ROW_COUNT"]),
+                column_hash=None if pd.isna(row["COLUMN_HASH"]) else str(row["COLUMN_HASH"]),
+            )
+    return versions
+
+
+def resolve_tables(query_text: str, database: Optional[str], schema: Optional[str]) -> List[str]:
+    """Qualified names of the tables `query_text` reads, resolved against the session context it ran in.
+
+    `database` and `schema` are QUERY_HISTORY's DATABASE_NAME and SCHEMA_NAME
+    for the query, not the current connection's, which may point elsewhere
+    (e.g. at SNOWFLAKE.ACCOUNT_USAGE).
+    """
+    # History reports the stored names; quoting keeps their case through qualified_name
+    database, schema = (_identifier(v) if isinstance(v, str) and v else None for v in (database, schema))
+    return [qualified_name(t, database, schema) for t in extract_tables(query_text)]
+
+
+def _table_filter(schemas: Dict[str, List[str]], alias: str = "") -> str:
+    return " OR ".join(
+        f"({alias}table_schema = {_literal(s)} AND {alias}table_name IN ({', '.join(_literal(t) for t in sorted(ts))}))"
+        for s, ts in sorted(schemas.items()))
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+def _identifier(value: str) -> str:
+    # Name parts are already case-resolved, so quoting keeps them exact
+    return '"' + value.replace('"', '""') + '"'
+
+
+@dataclass
+class LedgerEntry:
+    fingerprint: str
+    query_text: str
+    cost_ms: Optional[float]  # elapsed time per execution when analyzed
+    tables: Dict[str, Optional[TableVersion]]
+    result: Dict[str, Any]    # QueryOptimization.to_dict()
+    analyzed_at: float
+
+
+@dataclass
+class LedgerDecision:
+    """Whether a ranked query needs analysis; `reason` is empty when the ledger entry is reused."""
+    fingerprint: str
+    query_text: str
+    cost_ms: Optional[float]
+    tables: Dict[str, Optional[TableVersion]]
+    reason: str = ""
+    changed_tables: List[str] = field(default_factory=list)
+    entry: Optional[LedgerEntry] = None
+
+    @property
+    def reuse(self) -> bool:
+        return not self.reason
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-friendly form (without the ledger entry), e.g. for a batch checkpoint."""
+        return {"fingerprint": self.fingerprint, "query_text": self.query_text, "cost_ms": self.cost_ms,
+                "tables": {name: asdict(v) if v is not None else None for name, v in self.tables.items()},
+                "reason": self.reason, "changed_tables": self.changed_tables}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LedgerDecision":
+        tables = {name: TableVersion(**v) if v is not None else None for name, v in data["tables"].items()}
+        return cls(data["fingerprint"], data["query_text"], data["cost_ms"], tables, data.get("reason", ""),
+                   list(data.get("changed_tables", [])))
+
+
+class AnalysisLedger:
+    """SQLite record of finished analyses, keyed by query fingerprint, for incremental runs.
+
+    A ranked query is analyzed again only when it is new, its last analysis
+    failed or is older than `max_age` seconds, its per-execution cost moved by
+    more than `cost_tolerance` (relative), or a referenced table changed.
+    A table changed when its columns differ or, by default, LAST_ALTERED
+    moved; with `row_tolerance` set, a LAST_ALTERED change only counts if the
+    row count also moved by more than that fraction (for tables loaded
+    every night whose shape does not change). A table whose version is
+    unknown, then or now, counts as changed.
+    """
+
+    def __init__(self, path: Optional[str] = None, cost_tolerance: float = 0.5,
+                 row_tolerance: Optional[float] = None, max_age: Optional[float] = None):
+        path = path or os.path.expanduser("~/.cache/optima/analysis_ledger.sqlite")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.cost_tolerance = cost_tolerance
+        self.row_tolerance = row_tolerance
+        self.max_age = max_age
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analyses ("
+                " fingerprint TEXT PRIMARY KEY, query_text TEXT NOT NULL, cost_ms REAL, tables TEXT NOT NULL,"
+                " result TEXT NOT NULL, analyzed_at REAL NOT NULL)"
+            )
+
+    def get(self, fingerprint: str) -> Optional[LedgerEntry]:
+        with self._lock:
+            row = self._db.execute("SELECT fingerprint, query_text, cost_ms, tables, result, analyzed_at "
+                                   "FROM analyses WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        if row is None:
+            return None
+        tables = {name: TableVersion(**v) if v is not None else None for name, v in json.loads(row[3]).items()}
+        return LedgerEntry(row[0], row[1], row[2], tables, json.loads(row[4]), row[5])
+
+    def record(self, decision: LedgerDecision, result: Dict[str, Any]):
+        """Store `result` with the table versions and cost read when the decision was made.
+
+        Versions from before the analysis, so a table changed while it ran is
+        seen as changed next time. Failed results are not stored.
+        """
+        if result.get("status") not in REUSABLE_STATUSES:
+            return
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?, ?, ?)",
+                             (decision.fingerprint, decision.query_text, decision.cost_ms,
+                              json.dumps(decision.to_dict()["tables"]), json.dumps(result, default=str), time.time()))
+
+    def decide(self, fingerprint: str, query_text: str, cost_ms: Optional[float],
+               tables: Dict[str, Optional[TableVersion]], now: Optional[float] = None) -> LedgerDecision:
+        decision = LedgerDecision(fingerprint, query_text, cost_ms, tables)
+        entry = self.get(fingerprint)
+        if entry is None:
+            decision.reason = "new"
+            return decision
+        decision.entry = entry
+        decision.changed_tables = [name for name in sorted(set(tables) | set(entry.tables))
+                                   if self._table_changed(entry.tables.get(name), tables.get(name))]
+        if entry.result.get("status") not in REUSABLE_STATUSES:
+            decision.reason = "failed"
+        elif self.max_age is not None and (now or time.time()) - entry.analyzed_at > self.max_age:
+            decision.reason = "expired"
+        elif decision.changed_tables:
+            decision.reason = "tables_changed"
+        elif _relative_change(entry.cost_ms, cost_ms) > self.cost_tolerance:
+            decision.reason = "cost_changed"
+        return decision
+
+    def partition(self, conn_sf, ranked: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, LedgerDecision]]:
+        """Split ranked queries (rank_fingerprints output) into those to analyze and the rest.
+
+        Returns the rows still needing analysis and a decision per
+        fingerprint; the table versions for every query come from one
+        metadata query per database. Unqualified names are resolved against
+        each query's DATABASE_NAME/SCHEMA_NAME from the history.
+        """
+        tables_by_query = {row["FINGERPRINT"]: resolve_tables(row["QUERY_TEXT"], row.get("DATABASE_NAME"),
+                                                              row.get("SCHEMA_NAME"))
+                           for row in ranked.to_dict("records")}
+        versions = table_versions(conn_sf, {t for ts in tables_by_query.values() for t in ts})
+        decisions = {}
+        for row in ranked.to_dict("records"):
+            fp = row["FINGERPRINT"]
+            decisions[fp] = self.decide(fp, row["QUERY_TEXT"], _unit_cost(row),
+                                        {t: versions.get(t) for t in tables_by_query[fp]})
+        fresh = ranked[ranked["FINGERPRINT"].map(lambda fp: not decisions[fp].reuse).astype(bool)]
+        return fresh.reset_index(drop=True), decisions
+
+    def _table_changed(self, old: Optional[TableVersion], new: Optional[TableVersion]) -> bool:
+        # A table that could not be resolved or looked up may have changed in any way
+        if old is None or new is None:
+            return True
+        if old.column_hash != new.column_hash:
+            return True
+        if old.last_altered == new.last_altered:
+            return False
+        if self.row_tolerance is None:
+            return True
+        return _relative_change(old.row_count, new.row_count) > self.row_tolerance
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _unit_cost(row: Dict[str, Any]) -> Optional[float]:
+    # Summed elapsed time grows with how often a shape ran; compare the per-execution cost
+    total = row.get("TOTAL_ELAPSED_TIME")
+    if total is None or pd.isna(total):
+        return None
+    return float(total) / max(int(row.get("EXECUTION_COUNT") or 1), 1)
+
+
+def _relative_change(old: Optional[float], new: Optional[float]) -> float:
+    if old is None or new is None:
+        return 0.0 if old == new else float("inf")
+    if not old:
+        return 0.0 if not new else float("inf")
+    return abs(new - old) / abs(old)
@@ -0,0 +1,312 @@
+"""Headless optimization of a whole account's expensive queries, e.g. from a nightly job.
+
+    SNOWFLAKE_ACCOUNT=... SNOWFLAKE_USER=... SNOWFLAKE_PASSWORD=... SNOWFLAKE_WAREHOUSE=... \\
+        python batch_optimizer.py --top-n 50 --workers 4 --report report.json
+
+Every finished query is checkpointed to a state file, so rerunning the same
+command after a crash or timeout resumes with the queries still pending
+instead of paying for Cortex and warehouse time again.
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, time as dtime, timedelta, timezone
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+from analysis_ledger import AnalysisLedger, LedgerDecision
+
+STATE_VERSION = 1
+FINAL_STATUSES = ("verified", "unchanged", "rejected", "mismatch", "skipped")
+
+
+def snowflake_connect(**kwargs):
+    """Open a connection on the account-usage schema the optimizer reads."""
+    import snowflake.connector
+
+    return snowflake.connector.connect(database="SNOWFLAKE", schema="ACCOUNT_USAGE", **kwargs)
+
+
+def connect_from_env() -> Callable[[], Any]:
+    """Picklable `connect()` from SNOWFLAKE_ACCOUNT/USER/PASSWORD/WAREHOUSE/ROLE."""
+    names = ("account", "user", "password", "warehouse", "role")
+    kwargs = {name: os.environ.get(f"SNOWFLAKE_{name.upper()}") for name in names}
+    missing = [f"SNOWFLAKE_{name.upper()}" for name in ("account", "user", "password") if not kwargs[name]]
+    if missing:
+        raise SystemExit(f"Missing environment variable(s): {', '.join(missing)}")
+    return partial(snowflake_connect, **{k: v for k, v in kwargs.items() if v})
+
+
+class BatchState:
+    """Checkpoint of a batch run: the selected queries and every finished result.
+
+    Written to a JSON file after each query, through a temporary file and an
+    atomic rename, so a crash never leaves a torn checkpoint. A state file
+    belongs to one set of selection parameters; resuming with different ones
+    is refused.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.params: Dict[str, Any] = {}
+        self.candidates: List[Dict[str, Any]] = []
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                document = json.load(f)
+            if document.get("version") != STATE_VERSION:
+                raise ValueError(f"Unsupported state version {document.get('version')!r} in {path}")
+            self.params = document["params"]
+            self.candidates = document["candidates"]
+            self.results = document["results"]
+
+    @property
+    def started(self) -> bool:
+        return bool(self.params)
+
+    def start(self, params: Dict[str, Any], candidates: List[Dict[str, Any]]):
+        self.params, self.candidates, self.results = params, candidates, {}
+        self.save()
+
+    def pending(self, max_attempts: int) -> List[Dict[str, Any]]:
+        """Candidates without a final result that have attempts left."""
+        pending = []
+        for candidate in self.candidates:
+            result = self.results.get(candidate["fingerprint"])
+            if result is None or (result["status"] not in FINAL_STATUSES and result["attempts"] < max_attempts):
+                pending.append(candidate)
+        return pending
+
+    def record(self, result: Dict[str, Any]):
+        with self._lock:
+            previous = self.results.get(result["fingerprint"], {})
+            result["attempts"] = previous.get("attempts", 0) + 1
+            self.results[result["fingerprint"]] = result
+        self.save()
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            document = {"version": STATE_VERSION, "params": self.params, "candidates": self.candidates,
+                        "results": self.results}
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(document, f, indent=1, default=str)
+            os.replace(tmp, self.path)
+
+
+# One optimizer per worker process, built by the pool initializer
+_worker_optimizer = None
+
+
+def _init_worker(connect: Callable[[], Any], optimizer_kwargs: Dict[str, Any], benchmark_lock=None):
+    global _worker_optimizer
+    from Utility import SnowflakeSQLOptimizer
+
+    # Benchmarks change session parameters, so they get a connection of their own, and
+    # take turns on the warehouse so concurrent workers don't skew each other's timings
+    benchmark_conn = connect() if optimizer_kwargs.get("benchmark_runs", 3) else None
+    _worker_optimizer = SnowflakeSQLOptimizer(connect(), benchmark_conn=benchmark_conn, benchmark_lock=benchmark_lock,
+                                              **optimizer_kwargs)
+
+
+def _optimize(candidate: Dict[str, Any]) -> Dict[str, Any]:
+    """Run steps 2-4 for one candidate in this worker; failures come back as a result, not an exception."""
+    from Utility import QueryOptimization
+
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            result = _worker_optimizer.optimize_query(candidate["query_text"], candidate.get("query_id"))
+    except Exception as e:
+        result = QueryOptimization(candidate["query_text"], query_id=candidate.get("query_id"),
+                                   fingerprint=candidate["fingerprint"], detail=f"{type(e).__name__}: {e}")
+    result.fingerprint = candidate["fingerprint"]  # the state is keyed by the ranked fingerprint
+    return {**result.to_dict(), "cost": candidate.get("cost", {}), "log": log.getvalue()[-4000:]}
+
+
+def select_candidates(connect: Callable[[], Any], start: datetime, end: datetime, top_n: Optional[int],
+                      min_elapsed_ms: Optional[float], optimizer_kwargs: Dict[str, Any],
+                      ledger: Optional[AnalysisLedger] = None) -> List[Dict[str, Any]]:
+    """Step 1 once, in the parent: the ranked query shapes to optimize.
+
+    With a `ledger`, each candidate carries its ledger decision, and those
+    whose earlier analysis still holds carry that result under "reused".
+    """
+    from Utility import SnowflakeSQLOptimizer
+
+    con = connect()
+    try:
+        optimizer = SnowflakeSQLOptimizer(con, **optimizer_kwargs)
+        ranked = optimizer.expensive_queries(start, end, top_n=top_n, min_elapsed_ms=min_elapsed_ms)
+        decisions = ledger.partition(con, ranked)[1] if ledger is not None else {}
+    finally:
+        con.close()
+    cost_columns = [c for c in ("TOTAL_ELAPSED_TIME", "EXECUTION_TIME", "BYTES_SCANNED", "EXECUTION_COUNT")
+                    if c in ranked.columns]
+    candidates = []
+    for row in ranked.to_dict("records"):
+        candidate = {"fingerprint": row["FINGERPRINT"], "query_text": row["QUERY_TEXT"],
+                     "query_id": row["QUERY_ID"] if isinstance(row.get("QUERY_ID"), str) else None,
+                     "cost": {c: float(row[c]) for c in cost_columns}}
+        decision = decisions.get(row["FINGERPRINT"])
+        if decision is not None:
+            candidate["ledger"] = decision.to_dict()
+            if decision.reuse:
+                candidate["reused"] = {**decision.entry.result, "analyzed_at": decision.entry.analyzed_at}
+        candidates.append(candidate)
+    return candidates
+
+
+def run_batch(connect: Callable[[], Any], state_path: str, start: datetime, end: datetime,
+              top_n: Optional[int] = 20, min_elapsed_ms: Optional[float] = None, workers: int = 4,
+              limit: Optional[int] = None, max_attempts: int = 2,
+              optimizer_kwargs: Optional[Dict[str, Any]] = None, ledger: Optional[AnalysisLedger] = None,
+              on_result: Optional[Callable[[Dict[str, Any]], None]] = None) -> BatchState:
+    """Optimize the selected queries across `workers` processes, resuming from `state_path`.
+
+    `connect` must be picklable (a module-level function or a partial of
+    one); each worker opens its own connections with it. Workers analyze
+    and validate concurrently, but benchmark one at a time, so timings are
+    not skewed by each other's load on the warehouse. `workers <= 1` runs
+    in this process. `limit` caps how many pending queries this invocation
+    takes on; the rest stay pending for the next run. With a `ledger`,
+    queries whose earlier analysis still holds are reported from it without
+    any work, and every new result is added to it.
+    """
+    optimizer_kwargs = optimizer_kwargs or {}
+    params = {"start": start.isoformat(), "end": end.isoformat(), "top_n": top_n, "min_elapsed_ms": min_elapsed_ms}
+    state = BatchState(state_path)
+    if state.started and state.params != params:
+        raise ValueError(f"{state_path} belongs to a run with {state.params}; use another --state or --restart")
+    if not state.started:
+        state.start(params, select_candidates(connect, start, end, top_n, min_elapsed_ms, optimizer_kwargs, ledger))
+        for candidate in state.candidates:
+            if "reused" in candidate:
+                state.record({**candidate["reused"], "fingerprint": candidate["fingerprint"], "reused": True})
+    candidates = {c["fingerprint"]: c for c in state.candidates}
+
+    pending = state.pending(max_attempts)[:limit]
+
+    def finish(result: Dict[str, Any]):
+        state.record(result)
+        decision = candidates[result["fingerprint"]].get("ledger")
+        if ledger is not None and decision is not None:
+            ledger.record(LedgerDecision.from_dict(decision), result)
+        if on_result is not None:
+            on_result(result)
+
+    if workers <= 1:
+        _init_worker(connect, optimizer_kwargs)
+        for candidate in pending:
+            finish(_optimize(candidate))
+        return state
+
+    with ProcessPoolExecutor(max_workers=min(workers, max(len(pending), 1)), initializer=_init_worker,
+                             initargs=(connect, optimizer_kwargs, multiprocessing.Lock())) as pool:
+        running = {pool.submit(_optimize, candidate) for candidate in pending}
+        try:
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future.result())
+        except BaseException:
+            # Finished queries are already checkpointed; don't start the rest
+            for future in running:
+                future.cancel()
+            raise
+    return state
+
+
+def build_report(state: BatchState) -> Dict[str, Any]:
+    """Machine-readable summary: one entry per query with original vs. optimized metrics."""
+    queries = []
+    counts: Dict[str, int] = {}
+    for candidate in state.candidates:
+        result = state.results.get(candidate["fingerprint"])
+        status = result["status"] if result else "pending"
+        counts[status] = counts.get(status, 0) + 1
+        entry = {"fingerprint": candidate["fingerprint"], "query_id": candidate.get("query_id"), "status": status,
+                 "cost": candidate.get("cost", {}), "original_query": candidate["query_text"]}
+        if result:
+            entry.update({k: result.get(k) for k in ("optimized_query", "detail", "original", "optimized",
+                                                     "speedup", "speedup_ci", "attempts")})
+            entry["reused"] = bool(result.get("reused"))
+        queries.append(entry)
+    verified = [q for q in queries if q["status"] == "verified" and q.get("speedup")]
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "params": state.params,
+        "totals": {"queries": len(queries), **counts, "reused": sum(q.get("reused", False) for q in queries),
+                   "median_speedup": sorted(q["speedup"] for q in verified)[len(verified) // 2] if verified else None},
+        "queries": queries,
+    }
+
+
+def _date(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def default_state_path(params: Dict[str, Any]) -> str:
+    """State file for a set of selection parameters, so rerunning the same command resumes it."""
+    key = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+    return os.path.expanduser(f"~/.cache/optima/batch/run-{key}.json")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start", type=_date, help="start of the history window (default: 7 days before --end)")
+    parser.add_argument("--end", type=_date, help="end of the history window (default: today 00:00 UTC)")
+    parser.add_argument("--top-n", type=int, default=20, help="most expensive query shapes to optimize (0: all)")
+    parser.add_argument("--min-elapsed-s", type=float,
+                        help="only shapes whose summed elapsed time is at least this many seconds")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="worker processes")
+    parser.add_argument("--limit", type=int, help="optimize at most this many pending queries in this run")
+    parser.add_argument("--max-attempts", type=int, default=2, help="attempts per query across resumed runs")
+    parser.add_argument("--benchmark-runs", type=int, default=3, help="measured runs per verified rewrite")
+    parser.add_argument("--state", help="checkpoint file (default: derived from the selection parameters)")
+    parser.add_argument("--restart", action="store_true", help="discard the checkpoint and start over")
+    parser.add_argument("--report", default="-", help="JSON report path ('-' for stdout)")
+    parser.add_argument("--ledger", help="analysis ledger (default: ~/.cache/optima/analysis_ledger.sqlite)")
+    parser.add_argument("--no-ledger", action="store_true", help="analyze every query, ignoring earlier runs")
+    args = parser.parse_args(argv)
+
+    end = args.end or datetime.combine(datetime.now(timezone.utc).date(), dtime(), tzinfo=timezone.utc)
+    start = args.start or end - timedelta(days=7)
+    top_n = args.top_n or None
+    min_elapsed_ms = args.min_elapsed_s * 1000 if args.min_elapsed_s is not None else None
+    params = {"start": start.isoformat(), "end": end.isoformat(), "top_n": top_n, "min_elapsed_ms": min_elapsed_ms}
+    state_path = args.state or default_state_path(params)
+    if args.restart and os.path.exists(state_path):
+        os.remove(state_path)
+
+    def progress(result: Dict[str, Any]):
+        speedup = f" {result['speedup']:.2f}x" if result.get("speedup") else ""
+        print(f"{result['fingerprint']} {result['status']}{speedup}", file=sys.stderr)
+
+    connect = connect_from_env()
+    print(f"Checkpoint: {state_path}", file=sys.stderr)
+    state = run_batch(connect, state_path, start, end, top_n=top_n, min_elapsed_ms=min_elapsed_ms,
+                      workers=args.workers, limit=args.limit, max_attempts=args.max_attempts,
+                      optimizer_kwargs={"benchmark_runs": args.benchmark_runs},
+                      ledger=None if args.no_ledger else AnalysisLedger(args.ledger), on_result=progress)
+    report = json.dumps(build_report(state), indent=2, default=str)
+    if args.report == "-":
+        print(report)
+    else:
+        with open(args.report, "w") as f:
+            f.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
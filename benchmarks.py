@@ -0,0 +1,771 @@
+"""Latency benchmarks against the in-process fake connector.
+
+Run with `python benchmarks.py` (all benchmarks) or `python benchmarks.py cortex_pool`.
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
+
+from concurrency import bounded_map
+from cortex_client import CortexClient
+from fake_snowflake import FakeConnection, cortex_response, fake_connect
+
+
+def _timed(fn: Callable[[], None]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def bench_cortex_pool(calls: int = 50, workers: int = 4, connect_latency: float = 0.05,
+                      query_latency: float = 0.01) -> Dict[str, float]:
+    """Compare connect-per-call inference with the pooled `CortexClient`."""
+    connect = fake_connect(connect_latency=connect_latency, query_latency=query_latency)
+    prompt = "Check this query: SELECT * FROM t WHERE name = 'x'"
+
+    def connect_per_call(_):
+        client = CortexClient(connect, pool_size=1)
+        try:
+            client.complete(prompt)
+        finally:
+            client.close()
+
+    pooled = CortexClient(connect, pool_size=workers)
+
+    def run(fn):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(fn, range(calls)))
+
+    results = {
+        "connect_per_call_s": _timed(lambda: run(connect_per_call)),
+        "pooled_s": _timed(lambda: run(lambda _: pooled.complete(prompt))),
+    }
+    pooled.close()
+    results["speedup"] = results["connect_per_call_s"] / results["pooled_s"]
+    return results
+
+
+def _optimizer_responder(n_queries: int):
+    history = [(f"SELECT * FROM sales_{i} s JOIN customers c ON s.cid = c.id", 1000 - i, 900 - i, 10 ** 9, 1)
+               for i in range(n_queries)]
+
+    def respond(sql, params=None):
+        text = sql.upper()
+        if "CORTEX.COMPLETE" in text and "FOLLOW THIS PLAN" in str(params):
+            return cortex_response(sql, "1. Identify Expensive Queries\n2. Analyze Query Structure\n"
+                                        "3. Suggest Optimizations")
+        if "CORTEX.COMPLETE" in text:
+            return cortex_response(sql, "SELECT s.id FROM sales s", params)
+        if "QUERY_HISTORY" in text:
+            return ["QUERY_TEXT", "TOTAL_ELAPSED_TIME", "EXECUTION_TIME", "BYTES_SCANNED", "EXECUTION_COUNT"], history
+        if text.startswith("DESCRIBE TABLE"):
+            return ["name", "type"], [("ID", "NUMBER"), ("CID", "NUMBER")]
+        return ["1"], [(1,)]
+    return respond
+
+
+def bench_optimizer_fanout(n_queries: int = 20, query_latency: float = 0.02) -> Dict[str, float]:
+    """End-to-end `SnowflakeSQLOptimizer.run` time (steps 1-3) per concurrency limit."""
+    from schema_cache import default_schema_cache
+    from Utility import SnowflakeSQLOptimizer
+
+    results = {}
+    for limit in (1, 2, 4, 8):
+        default_schema_cache.invalidate()  # every run starts cold
+        con = FakeConnection(responder=_optimizer_responder(n_queries), query_latency=query_latency)
+        client = CortexClient.for_connection(con, pool_size=limit)  # uncached, so every run hits "Cortex"
+        optimizer = SnowflakeSQLOptimizer(con, client, max_concurrency=limit)
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[f"concurrency_{limit}_s"] = _timed(lambda: optimizer.run("Optimize my queries"))
+    return results
+
+
+_QUERY_SHAPES = [
+    "SELECT * FROM sales_{i} WHERE region = 'EU' AND amount > {i}",
+    "SELECT s.id, c.name FROM analytics.public.sales s JOIN customers c ON s.cid = c.id WHERE s.day >= '2024-01-{d:02d}'",
+    "WITH recent AS (SELECT * FROM raw.events WHERE ts > DATEADD(day, -{d}, CURRENT_DATE())) "
+    "SELECT r.user_id, COUNT(*) FROM recent r, dim_users u WHERE r.user_id = u.id GROUP BY 1 ORDER BY 2 DESC LIMIT 100",
+    "SELECT f.value::string AS tag FROM \"Docs\" d, LATERAL FLATTEN(input => d.tags) f -- tags for batch {i}",
+    "SELECT * FROM (SELECT a, b FROM t_{i} UNION ALL SELECT a, b FROM t_archive) x "
+    "WHERE a NOT IN (SELECT a FROM blocked) /* dashboard {i} */",
+]
+
+
+def bench_table_extraction(n_queries: int = 20000) -> Dict[str, float]:
+    """Throughput of `sql_parser.extract_tables` over a synthetic QUERY_HISTORY corpus."""
+    from sql_parser import extract_tables
+
+    corpus = [_QUERY_SHAPES[i % len(_QUERY_SHAPES)].format(i=i, d=i % 28 + 1) for i in range(n_queries)]
+    elapsed = _timed(lambda: [extract_tables(q) for q in corpus])
+    return {"queries": n_queries, "elapsed_s": elapsed, "queries_per_s": n_queries / elapsed}
+
+
+def bench_sql_lint(n_queries: int = 20000) -> Dict[str, float]:
+    """Throughput of the local `sql_lint.lint` rules, and how many queries would still go to Cortex."""
+    from sql_lint import lint
+
+    corpus = [_QUERY_SHAPES[i % len(_QUERY_SHAPES)].format(i=i, d=i % 28 + 1) for i in range(n_queries)]
+    reports = []
+    elapsed = _timed(lambda: reports.extend(lint(q) for q in corpus))
+    escalated = sum(r.needs_llm for r in reports)
+    # Only the NOT IN (subquery) shape should need Cortex; escalating everything would save no calls
+    assert escalated / n_queries < 0.5, f"{escalated} of {n_queries} queries escalated to Cortex"
+    return {"queries": n_queries, "elapsed_s": elapsed, "queries_per_s": n_queries / elapsed,
+            "findings": sum(len(r.findings) for r in reports), "escalated_to_cortex": escalated}
+
+
+def bench_fingerprinting(n_rows: int = 300000, n_shapes: int = 500) -> Dict[str, float]:
+    """Fingerprint and rank a week-sized QUERY_HISTORY frame."""
+    import numpy as np
+    import pandas as pd
+    from fingerprint import rank_fingerprints
+
+    rng = np.random.default_rng(0)
+    shape_ids = rng.integers(0, n_shapes, n_rows)
+    literals = rng.integers(0, 10000, n_rows)
+    texts = [_QUERY_SHAPES[s % len(_QUERY_SHAPES)].format(i=lit, d=s % 28 + 1).replace("sales_", f"sales{s}_")
+             for s, lit in zip(shape_ids, literals)]
+    history = pd.DataFrame({
+        "QUERY_TEXT": texts,
+        "TOTAL_ELAPSED_TIME": rng.integers(1, 10 ** 6, n_rows),
+        "BYTES_SCANNED": rng.integers(1, 10 ** 10, n_rows),
+    })
+    elapsed = _timed(lambda: rank_fingerprints(history, top_n=20))
+    return {"rows": n_rows, "distinct_texts": history["QUERY_TEXT"].nunique(), "elapsed_s": elapsed,
+            "rows_per_s": n_rows / elapsed}
+
+
+def bench_completion_cache(n_prompts: int = 50, reruns: int = 3, query_latency: float = 0.01) -> Dict[str, float]:
+    """Cortex calls and wall time for repeated check prompts, with and without the completion cache."""
+    from completion_cache import CompletionCache, MemoryBackend
+
+    prompts = [f"Check this query: SELECT * FROM t WHERE id = {i % (n_prompts // 2)}" for i in range(n_prompts)]
+    results = {}
+    for label, cache in (("uncached", None), ("cached", CompletionCache(MemoryBackend()))):
+        con = FakeConnection(query_latency=query_latency)
+        client = CortexClient.for_connection(con, cache=cache)
+        elapsed = _timed(lambda: [client.complete(p, template="check") for _ in range(reruns) for p in prompts])
+        results[f"{label}_cortex_calls"] = len(con.executed)
+        results[f"{label}_s"] = elapsed
+    results["hit_rate"] = cache.hit_rate
+    return results
+
+
+def bench_batched_completions(n_prompts: int = 20, query_latency: float = 0.05) -> Dict[str, float]:
+    """Top-N rewrite prompts: one COMPLETE per prompt (serial and 4-way) vs. one FROM VALUES batch."""
+    from model_router import ModelRouter
+
+    prompts = [f"Suggest optimizations for this query:\nSELECT * FROM t{i}" for i in range(n_prompts)]
+    results = {}
+    for label, concurrency in (("per_call_serial", 1), ("per_call_4", 4)):
+        con = FakeConnection(query_latency=query_latency)
+        router = ModelRouter(CortexClient.for_connection(con, pool_size=concurrency))
+        results[f"{label}_s"] = _timed(lambda: bounded_map(lambda p: router.complete("rewrite", p), prompts, concurrency))
+        results[f"{label}_round_trips"] = len(con.executed)
+    con = FakeConnection(query_latency=query_latency)
+    router = ModelRouter(CortexClient.for_connection(con))
+    results["batched_s"] = _timed(lambda: router.complete_batch("rewrite", prompts))
+    results["batched_round_trips"] = len(con.executed)
+    return results
+
+
+def bench_plan_prescreen(execution_latency: float = 1.0, explain_latency: float = 0.05) -> Dict[str, float]:
+    """Screen rewrites with EXPLAIN (recorded plans in fixtures/explain) vs. executing both versions."""
+    import os
+    from plan_cost import PlanPrescreen
+
+    fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "explain")
+    plans = {name[:-len(".json")]: open(os.path.join(fixtures, name)).read()
+             for name in os.listdir(fixtures) if name.endswith(".json")}
+    # Original is the full-scan plan; the worse rewrites are the full scan again and the cartesian join
+    rewrites = {"ORIGINAL": "sales_join_full_scan", "GOOD": "sales_join_pruned",
+                "SAME": "sales_join_full_scan", "CARTESIAN": "sales_cartesian"}
+
+    def respond(sql, params=None):
+        if sql.startswith("EXPLAIN"):
+            time.sleep(explain_latency)
+            return ["content"], [(plans[rewrites[sql.split("/*")[1].split("*/")[0].strip()]],)]
+        time.sleep(execution_latency)
+        return ["1"], [(1,)]
+
+    con = FakeConnection(responder=respond)
+    prescreen = PlanPrescreen(con)
+    decisions = {}
+    screened_s = _timed(lambda: decisions.update(
+        (label, prescreen.check("SELECT /* ORIGINAL */ 1", f"SELECT /* {label} */ 1").accepted)
+        for label in ("GOOD", "SAME", "CARTESIAN")))
+    executed = sum(decisions.values())
+    return {"rewrites": len(decisions), "accepted": executed,
+            "screen_s": screened_s, "warehouse_s_with_screen": 2 * executed * execution_latency,
+            "warehouse_s_without_screen": 2 * len(decisions) * execution_latency}
+
+
+def _operator_stats_fixtures():
+    import os
+
+    fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "operator_stats")
+    return {name[:-len(".json")]: json.load(open(os.path.join(fixtures, name)))
+            for name in sorted(os.listdir(fixtures)) if name.endswith(".json")}
+
+
+def bench_operator_stats(n_queries: int = 20, statement_latency: float = 0.1) -> Dict[str, float]:
+    """Batched+cached vs. per-query fetching of GET_QUERY_OPERATOR_STATS, answered from the recorded fixtures."""
+    import re
+    import uuid
+    from operator_stats import OperatorStatsCache, OperatorStatsProvider
+
+    fixtures = _operator_stats_fixtures()
+    profiles = list(fixtures.values())
+    query_ids = [str(uuid.UUID(int=i + 1)) for i in range(n_queries)]
+
+    def respond(sql, params=None):
+        time.sleep(statement_latency)
+        rows = []
+        for qid in re.findall(r"GET_QUERY_OPERATOR_STATS\('([^']+)'\)", sql):
+            doc = profiles[query_ids.index(qid) % len(profiles)]
+            rows.extend({**row, "QUERY_ID": qid} for row in doc["rows"])
+        columns = list(profiles[0]["rows"][0])
+        return columns, [tuple(r[c] for c in columns) for r in rows]
+
+    con = FakeConnection(responder=respond)
+    per_query = OperatorStatsProvider(con, batch_size=1, cache=OperatorStatsCache())
+    per_query_s = _timed(lambda: per_query.get(query_ids))
+    batched = OperatorStatsProvider(con, batch_size=10, cache=OperatorStatsCache())
+    batched_s = _timed(lambda: batched.get(query_ids))
+    cached_s = _timed(lambda: batched.get(query_ids))
+    return {"fixtures": len(fixtures), "queries": n_queries,
+            "per_query_s": per_query_s, "per_query_statements": per_query.statements,
+            "batched_s": batched_s, "batched_statements": batched.statements, "cached_rerun_s": cached_s}
+
+
+def bench_async_validation(n_pairs: int = 5, query_seconds: float = 0.3) -> Dict[str, float]:
+    """Step 4 validation runs: blocking execute of each query in turn vs. async submit-all-then-poll."""
+    from query_jobs import JobManager
+    from Utility import QuerySQLDataBaseTool
+
+    queries = [f"SELECT {i} /* {side} */" for i in range(n_pairs) for side in ("original", "optimized")]
+    blocking = QuerySQLDataBaseTool(FakeConnection(query_latency=query_seconds))
+    blocking_s = _timed(lambda: [blocking.run(q, max_rows=0) for q in queries])
+    jobs = JobManager(FakeConnection(async_duration=query_seconds), poll_interval=0.02)
+    async_s = _timed(lambda: jobs.wait(jobs.submit_all(queries)))
+    return {"queries": len(queries), "blocking_s": blocking_s, "async_s": async_s, "speedup": blocking_s / async_s}
+
+
+_SHOW_PARAMETER_COLUMNS = ["key", "value", "default", "level", "description", "type"]
+
+
+def bench_query_benchmark(runs: int = 5, true_speedup: float = 2.0, base_seconds: float = 0.04,
+                          noise: float = 0.25, seed: int = 0) -> Dict[str, float]:
+    """Speedup estimated from one validation run vs. the repeated cache-free harness.
+
+    The fake warehouse is noisy, slow on its first (cold) query and serves
+    repeats from the result cache unless USE_CACHED_RESULT is off.
+    """
+    import re
+    import tempfile
+    import numpy as np
+    from query_benchmark import BenchmarkStore, QueryBenchmark
+    from query_metrics import QueryMetricsProvider
+
+    rng = np.random.default_rng(seed)
+    state = {"cache": True, "seen": set(), "cold": True}
+
+    def duration(sql: str) -> float:
+        seconds = base_seconds / true_speedup if "optimized" in sql else base_seconds
+        if state["cache"] and sql in state["seen"]:
+            return 0.001
+        state["seen"].add(sql)
+        if state["cold"]:
+            state["cold"] = False
+            seconds *= 3
+        return seconds * rng.lognormal(0, noise)
+
+    def responder(sql: str, params=None):
+        if sql.startswith("SHOW PARAMETERS"):
+            value = "true" if state["cache"] else "false"
+            return _SHOW_PARAMETER_COLUMNS, [("USE_CACHED_RESULT", value, "true", "SESSION", "", "BOOLEAN")]
+        if sql.startswith("ALTER SESSION"):
+            state["cache"] = "UNSET" in sql or sql.endswith("TRUE")
+        elif "QUERY_HISTORY" in sql:
+            rows = []
+            for qid in re.findall(r"'([0-9a-f-]{36})'", sql):
+                job = con._async[qid]
+                ms = (job["done_at"] - job["submitted"]) * 1000
+                rows.append((qid, ms, ms, 10 ** 9, 100, 1000, 1, "X-Small", 0.0))
+            return (["QUERY_ID", "TOTAL_ELAPSED_TIME", "EXECUTION_TIME", "BYTES_SCANNED", "PARTITIONS_SCANNED",
+                     "PARTITIONS_TOTAL", "ROWS_PRODUCED", "WAREHOUSE_SIZE", "CREDITS_USED_CLOUD_SERVICES"], rows)
+        return ["1"], [(1,)]
+
+    con = FakeConnection(responder=responder, async_duration=duration)
+    original, optimized = "SELECT * FROM sales /* original */", "SELECT * FROM sales /* optimized */"
+    metrics = QueryMetricsProvider(con)
+    # Old flow: one run each, cold warehouse first, result cache on
+    single = QueryBenchmark(con, runs=1, warmup=0, metrics=metrics).jobs
+    single.poll_interval = 0.005
+    first, second = single.wait(single.submit_all([original, optimized]))
+    single_times = metrics.get([first.job_id, second.job_id]).set_index("QUERY_ID")["TOTAL_ELAPSED_TIME"]
+    single_speedup = single_times[first.job_id] / single_times[second.job_id]
+
+    with tempfile.TemporaryDirectory() as root:
+        harness = QueryBenchmark(con, runs=runs, warmup=1, metrics=metrics, store=BenchmarkStore(f"{root}/b.sqlite"))
+        harness.jobs.poll_interval = 0.005
+        report = harness.compare(original, optimized)
+        stored = len(harness.store.history(report.fingerprint, "optimized"))
+    return {"true_speedup": true_speedup, "single_run_speedup": float(single_speedup),
+            "harness_speedup": report.speedup, "ci_low": report.speedup_ci[0], "ci_high": report.speedup_ci[1],
+            "stored_benchmarks": stored}
+
+
+def bench_tracing(n_spans: int = 20000, n_workers: int = 4) -> Dict[str, float]:
+    """Per-span cost of the tracer, and that spans opened in `bounded_map` workers nest under the caller's."""
+    from concurrency import bounded_map
+    from tracing import Tracer, to_otlp
+
+    tracer = Tracer(max_spans=n_spans + 10)
+
+    def nested():
+        with tracer.span("outer", rows=1):
+            with tracer.span("inner") as s:
+                s.set(query_id="q")
+
+    per_span_us = _timed(lambda: [nested() for _ in range(n_spans // 2)]) / n_spans * 1e6
+    def worker(i: int):
+        with tracer.span(f"worker.{i % 2}"):
+            pass
+
+    with tracer.span("fanout") as root:
+        bounded_map(worker, range(n_workers * 4), n_workers)
+    trace = tracer.spans(root.trace_id)
+    nested_ok = all(s.parent_id == root.span_id for s in trace if s is not root)
+    otlp_spans = len(to_otlp(trace)["resourceSpans"][0]["scopeSpans"][0]["spans"])
+    return {"spans": n_spans, "per_span_us": per_span_us, "worker_spans_nested": nested_ok, "otlp_spans": otlp_spans}
+
+
+def bench_session_leasing(turns: int = 3, query_latency: float = 0.05) -> Dict[str, float]:
+    """Concurrent chat sessions on one shared connection vs. per-session leases from a pool.
+
+    Each simulated session runs agent turns whose tool call queries a tag
+    unique to the turn; attribution checks that the query id reported back
+    to the session belongs to the statement that session ran.
+    """
+    import re
+    from Agent import run_agent
+    from connection_manager import ConnectionManager
+
+    def cortex(sql, params=None):
+        text = str(params)
+        tag = re.search(r"User input: run (\S+?)[\"'\\]", text).group(1)
+        if "Tool query_sql_database_tool returned" in text:
+            return cortex_response(sql, f"Done with {tag}.", params)
+        call = {"tool_calls": [{"name": "query_sql_database_tool", "arguments": {"query": f"SELECT '{tag}' AS tag"}}]}
+        return cortex_response(sql, "```json\n" + json.dumps(call) + "\n```", params)
+
+    client = CortexClient(lambda: FakeConnection(responder=cortex), pool_size=16)
+
+    def run_sessions(n_sessions: int, connection_for) -> tuple:
+        reported = []
+
+        def session(i: int):
+            for t in range(turns):
+                tag = f"s{i}t{t}"
+                with connection_for(f"session-{i}") as con:
+                    output = run_agent(con, f"run {tag}", client)
+                reported.append((tag, re.search(r"query_id: ([0-9a-f-]{36})", output).group(1)))
+
+        elapsed = _timed(lambda: bounded_map(session, range(n_sessions), max_concurrency=n_sessions))
+        return elapsed, reported
+
+    def attributed(reported, connections) -> bool:
+        queries = {qid: sql for con in connections for qid, sql in con.queries.items()}
+        return all(f"'{tag}'" in queries.get(qid, "") for tag, qid in reported)
+
+    results = {}
+    for n_sessions in (1, 4, 8):
+        shared = FakeConnection(query_latency=query_latency, exclusive=True)
+        shared_s, reported = run_sessions(n_sessions, lambda sid: contextlib.nullcontext(shared))
+        results[f"shared_{n_sessions}_turns_per_s"] = n_sessions * turns / shared_s
+
+        opened = []
+
+        def connect():
+            opened.append(FakeConnection(query_latency=query_latency, exclusive=True))
+            return opened[-1]
+
+        manager = ConnectionManager(pool_size=n_sessions, statement_timeout=60)
+        leased_s, reported = run_sessions(n_sessions, lambda sid: manager.connection(sid, "bench", connect))
+        results[f"leased_{n_sessions}_turns_per_s"] = n_sessions * turns / leased_s
+        results[f"leased_{n_sessions}_attribution_ok"] = attributed(reported, opened)
+        results[f"leased_{n_sessions}_connections"] = len(opened)
+        manager.close()
+    return results
+
+
+# The recorded plan run: (original, rewrite, operator stats fixture, results match).
+# One rewrite is pruned and faster, one is no cheaper on paper (rejected by the
+# prescreen) and one changes the results (caught by the equivalence check).
+_PLAN_QUERIES = [
+    ("SELECT s.id, c.name, s.amount FROM sales s JOIN customers c ON s.cid = c.id WHERE s.day >= '2024-01-01'",
+     "SELECT s.id, c.name, s.amount FROM sales s JOIN (SELECT DISTINCT id, name FROM customers) c ON s.cid = c.id "
+     "WHERE s.day >= '2024-01-01'", "sales_join_explosion", True),
+    ("SELECT * FROM sales WHERE TO_CHAR(day, 'YYYY-MM') = '2024-01'",
+     "SELECT id, cid, amount, day FROM sales WHERE day >= '2024-01-01' AND day < '2024-02-01'",
+     "sales_scan_unpruned", True),
+    ("SELECT cid, COUNT(DISTINCT id), SUM(amount) FROM sales GROUP BY cid ORDER BY 3 DESC",
+     "SELECT cid, APPROX_COUNT_DISTINCT(id), SUM(amount) FROM sales GROUP BY cid ORDER BY 3 DESC",
+     "sales_aggregate_spill", False),
+    ("SELECT e.user_id, COUNT(*) FROM events e, dim_users u WHERE e.user_id = u.id GROUP BY 1",
+     "SELECT e.user_id, COUNT(*) FROM events e JOIN dim_users u ON e.user_id = u.id GROUP BY 1", None, True),
+]
+_PLAN_PROMPT = "Optimize the most expensive SELECT queries of the last 7 days"
+_AGENT_PROMPT = "Which columns does the sales table have, and how many rows does it hold?"
+
+
+def _plan_cassette_path() -> str:
+    import os
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "cassettes", "optimizer_plan.json")
+
+
+def _synthetic_warehouse() -> FakeConnection:
+    """A fake account that answers every statement of the plan run, with per-kind latency."""
+    import os
+    import re
+
+    fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "explain")
+    plans = {name[:-len(".json")]: open(os.path.join(fixtures, name)).read()
+             for name in os.listdir(fixtures) if name.endswith(".json")}
+    profiles = _operator_stats_fixtures()
+    history, hashes, durations, explain = [], {}, {}, {}
+    for i, (original, rewrite, profile, matches) in enumerate(_PLAN_QUERIES):
+        query_id = profiles[profile]["query_id"] if profile else f"01b2c3d4-0000-4a5b-8c00-0000000001{i:02d}"
+        history.append((query_id, original, "ANALYTICS", "PUBLIC", 900000 - 100000 * i, 850000 - 100000 * i,
+                        10 ** 10 // (i + 1), 12 - i))
+        hashes[original], hashes[rewrite] = (10 ** 6, 7000 + i), (10 ** 6, 7000 + i if matches else 9000 + i)
+        durations[original], durations[rewrite] = 0.08, 0.08 if profile is None else 0.03
+        explain[original] = "sales_join_full_scan"
+        explain[rewrite] = "sales_join_full_scan" if profile is None else "sales_join_pruned"
+    operator_rows = [row for fixture in profiles.values() for row in fixture["rows"]]
+    operator_columns = list(operator_rows[0])
+
+    def known(sql: str) -> str:
+        return max((q for q in hashes if q in sql), key=len)
+
+    def completion(prompt: str) -> str:
+        if "User input:" in prompt:
+            if "returned:" in prompt:
+                return "The sales table has ID, CID, AMOUNT and DAY columns and holds 48,000,000 rows."
+            calls = [{"name": "info_snowflake_table_tool", "arguments": {"table_names": "sales"}},
+                     {"name": "query_sql_database_tool", "arguments": {"query": "SELECT COUNT(*) AS n FROM sales"}}]
+            return "```json\n" + json.dumps({"tool_calls": calls}) + "\n```"
+        if "FOLLOW THIS PLAN" in prompt:
+            return ("1. Identify Expensive Queries\n2. Analyze Query Structure\n3. Suggest Optimizations\n"
+                    "4. Validate Improvements\n5. Prepare Summary")
+        return next(rewrite for original, rewrite, _, _ in _PLAN_QUERIES if original in prompt)
+
+    def respond(sql, params=None):
+        text = sql.upper()
+        if "CORTEX.COMPLETE" in text:
+            time.sleep(0.1 * (len(params) // 2 if "FROM VALUES" in text else 1))
+            if "FROM VALUES" in text:
+                pairs = list(zip(params[::2], params[1::2]))
+                return ["IDX", "RESPONSE"], [row for idx, prompt in pairs
+                                             for row in cortex_response(sql, completion(prompt), [idx, prompt])[1]]
+            return cortex_response(sql, completion(params[0]), params)
+        if text.startswith("DESCRIBE TABLE"):
+            time.sleep(0.03)
+            return ["name", "type", "kind", "null?"], [(c, t, "COLUMN", "Y") for c, t in
+                                                       (("ID", "NUMBER(38,0)"), ("CID", "NUMBER(38,0)"),
+                                                        ("AMOUNT", "NUMBER(12,2)"), ("DAY", "DATE"))]
+        if text.startswith("EXPLAIN"):
+            time.sleep(0.04)
+            return ["content"], [(plans[explain[known(sql)]],)]
+        if "GET_QUERY_OPERATOR_STATS" in text:
+            time.sleep(0.08)
+            ids = set(re.findall(r"'([0-9a-f-]{36})'", sql))
+            return operator_columns, [tuple(row[c] for c in operator_columns) for row in operator_rows
+                                      if row["QUERY_ID"] in ids]
+        if "ACCOUNT_USAGE.QUERY_HISTORY" in text:
+            time.sleep(0.2)
+            return (["QUERY_ID", "QUERY_TEXT", "DATABASE_NAME", "SCHEMA_NAME", "TOTAL_ELAPSED_TIME",
+                     "EXECUTION_TIME", "BYTES_SCANNED", "EXECUTION_COUNT"], history)
+        if "QUERY_HISTORY" in text:
+            time.sleep(0.03)
+            rows = []
+            for qid in re.findall(r"'([0-9a-f-]{36})'", sql):
+                job = con._async[qid]
+                ms = round((job["done_at"] - job["submitted"]) * 1000, 1)
+                rows.append((qid, ms, ms, 10 ** 9, 120, 1000, 10 ** 6, "X-Small", 0.0))
+            return (["QUERY_ID", "TOTAL_ELAPSED_TIME", "EXECUTION_TIME", "BYTES_SCANNED", "PARTITIONS_SCANNED",
+                     "PARTITIONS_TOTAL", "ROWS_PRODUCED", "WAREHOUSE_SIZE", "CREDITS_USED_CLOUD_SERVICES"], rows)
+        if "INFORMATION_SCHEMA.TABLES" in text:
+            time.sleep(0.03)
+            return (["TABLE_SCHEMA", "TABLE_NAME", "LAST_ALTERED", "ROW_COUNT", "COLUMN_HASH"],
+                    [("PUBLIC", name, *version) for name, version in con.tables.items() if f"'{name}'" in sql])
+        if "HASH_AGG" in text:
+            time.sleep(0.05)
+            scanned = re.search(r"RESULT_SCAN\('([0-9a-f-]{36})'\)", sql)
+            return ["COUNT(*)", "HASH_AGG(*)"], [hashes[known(con.queries[scanned.group(1)] if scanned else sql)]]
+        if text.startswith("ALTER SESSION"):
+            return ["status"], [("Statement executed successfully.",)]
+        if text.startswith("SHOW PARAMETERS"):
+            return _SHOW_PARAMETER_COLUMNS, [("USE_CACHED_RESULT", "true", "true", "", "", "BOOLEAN")]
+        time.sleep(0.02)
+        return ["N"], [(48000000,)]
+
+    def duration(sql: str) -> float:
+        return durations[known(sql)] if any(q in sql for q in hashes) else 0.01
+
+    con = FakeConnection(responder=respond, async_duration=duration)
+    # Session context and INFORMATION_SCHEMA.TABLES metadata, for the analysis ledger
+    con.database, con.schema = "ANALYTICS", "PUBLIC"
+    con.tables = {name: (datetime(2024, 1, 31, 2, tzinfo=timezone.utc), rows, 1000 + i) for i, (name, rows) in
+                  enumerate((("SALES", 48000000), ("CUSTOMERS", 200000), ("EVENTS", 9000000), ("DIM_USERS", 50000)))}
+    return con
+
+
+def _plan_run(con) -> Dict[str, str]:
+    """The full 5-step plan and one agent turn on `con`, every cache cold; returns their printed output."""
+    from Agent import run_agent
+    from operator_stats import OperatorStatsCache
+    from schema_cache import default_schema_cache
+    from Utility import SnowflakeSQLOptimizer
+
+    default_schema_cache.invalidate()
+    client = CortexClient.for_connection(con)  # uncached: every completion goes to the backend
+    optimizer = SnowflakeSQLOptimizer(con, client, benchmark_runs=2)
+    optimizer.operator_stats.cache = OperatorStatsCache()
+    optimizer.query_tool.jobs.poll_interval = 0.005
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        optimizer.run(_PLAN_PROMPT)
+    default_schema_cache.invalidate()
+    return {"optimizer": out.getvalue(), "agent": run_agent(con, _AGENT_PROMPT, client)}
+
+
+def record_plan_cassette(con=None, path: Optional[str] = None) -> Dict[str, int]:
+    """Record the plan run (see `_plan_run`) into the cassette `bench_plan_replay` replays.
+
+    `con` defaults to the synthetic warehouse; pass a live connection to
+    record a real account instead.
+    """
+    import os
+    from cassette import Cassette
+
+    path = path or _plan_cassette_path()
+    cassette = Cassette()
+    _plan_run(cassette.record(con if con is not None else _synthetic_warehouse()))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cassette.save(path)
+    return cassette.kinds()
+
+
+_PLAN_STAGES = ("optimizer.run", "optimizer.identify", "optimizer.analyze", "optimizer.suggest",
+                "optimizer.validate", "optimizer.summary", "agent.turn", "cortex.complete", "cortex.complete_batch",
+                "cortex.stream", "snowflake.describe", "snowflake.operator_stats", "warehouse.submit",
+                "warehouse.wait")
+
+
+def bench_plan_replay(repeats: int = 3, speed: float = 1.0) -> Dict[str, float]:
+    """End-to-end and per-stage latency of the 5-step plan (and an agent turn), replayed from the recorded cassette.
+
+    With the recorded latencies the stage times track the recorded account;
+    the speed-0 replay leaves only client-side time, so a regression in the
+    code itself shows up there without any noise from the backend.
+    """
+    import re
+    import numpy as np
+    from cassette import Cassette
+    from tracing import default_tracer
+
+    cassette = Cassette.load(_plan_cassette_path())
+    ids = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+    recorded = None
+    results: Dict[str, float] = {"statements": len(cassette.interactions)}
+    for label, replay_speed in (("replay", speed), ("client_only", 0.0)):
+        totals: Dict[str, list] = {stage: [] for stage in _PLAN_STAGES}
+        wall = []
+        for _ in range(repeats):
+            default_tracer.clear()
+            con = cassette.replay(speed=replay_speed)
+            outputs = {}
+            wall.append(_timed(lambda: outputs.update(_plan_run(con))))
+            for stage in _PLAN_STAGES:
+                totals[stage].append(sum(s.duration_ms for s in default_tracer.spans() if s.name == stage))
+            output = ids.sub("<id>", outputs["optimizer"] + outputs["agent"])
+            recorded = recorded or output
+            results["deterministic"] = results.get("deterministic", True) and output == recorded
+        results[f"{label}_end_to_end_ms"] = float(np.median(wall)) * 1000
+        if label == "replay":
+            results.update({f"{stage}_ms": float(np.median(ms)) for stage, ms in totals.items()})
+    results["misses"] = len(cassette.misses)
+    return results
+
+
+def bench_batch_runner(workers: int = 4) -> Dict[str, float]:
+    """Headless batch over the synthetic warehouse: serial vs. a process pool, and a crashed run resumed.
+
+    The "crash" is a run capped with `limit`; the rerun must only do the
+    queries still pending, and a third run must find nothing left to do.
+    """
+    import tempfile
+    from batch_optimizer import build_report, run_batch
+
+    end = datetime(2024, 2, 1, tzinfo=timezone.utc)
+    start = end - timedelta(days=7)
+    kwargs = {"benchmark_runs": 2}
+    results: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as root:
+        for label, n in (("serial", 1), (f"pool_{workers}", workers)):
+            results[f"{label}_s"] = _timed(lambda: run_batch(_synthetic_warehouse, f"{root}/{label}.json", start, end,
+                                                             top_n=len(_PLAN_QUERIES), workers=n,
+                                                             optimizer_kwargs=kwargs))
+        path = f"{root}/resumed.json"
+        done = []
+        results["crashed_run_s"] = _timed(lambda: run_batch(_synthetic_warehouse, path, start, end, workers=workers,
+                                                            limit=2, optimizer_kwargs=kwargs, on_result=done.append))
+        results["resume_s"] = _timed(lambda: run_batch(_synthetic_warehouse, path, start, end, workers=workers,
+                                                       optimizer_kwargs=kwargs, on_result=done.append))
+        state = None
+
+        def rerun():
+            nonlocal state
+            state = run_batch(_synthetic_warehouse, path, start, end, workers=workers, optimizer_kwargs=kwargs,
+                              on_result=done.append)
+
+        results["finished_rerun_s"] = _timed(rerun)
+        report = build_report(state)
+    results["queries_optimized"] = len(done)
+    results["repeated_work"] = sum(r["attempts"] > 1 for r in state.results.values())
+    results.update({f"status_{k}": v for k, v in report["totals"].items() if k not in ("queries", "median_speedup")})
+    return results
+
+
+def bench_incremental_analysis() -> Dict[str, float]:
+    """Nightly reruns with the analysis ledger: cold, unchanged, and after a load into one table.
+
+    Counts the statements (warehouse and Cortex) each run sends; only
+    queries that are new or whose tables changed should cost anything.
+    """
+    import tempfile
+    from analysis_ledger import AnalysisLedger
+    from schema_cache import default_schema_cache
+    from Utility import SnowflakeSQLOptimizer
+
+    con = _synthetic_warehouse()
+    results: Dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as root:
+        ledger = AnalysisLedger(f"{root}/ledger.sqlite")
+        for label in ("cold", "unchanged", "sales_loaded"):
+            if label == "sales_loaded":
+                altered, rows, columns = con.tables["SALES"]
+                con.tables["SALES"] = (altered + timedelta(days=1), rows + 2000000, columns)
+            default_schema_cache.invalidate()
+            optimizer = SnowflakeSQLOptimizer(con, CortexClient.for_connection(con), benchmark_runs=2, ledger=ledger)
+            optimizer.query_tool.jobs.poll_interval = 0.005
+            before = len(con.executed)
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                results[f"{label}_s"] = _timed(lambda: optimizer.run(_PLAN_PROMPT))
+            executed = con.executed[before:]
+            results[f"{label}_statements"] = len(executed)
+            results[f"{label}_cortex_calls"] = sum("CORTEX.COMPLETE" in sql for sql in executed)
+            results[f"{label}_analyzed"] = sum(not d.reuse for d in optimizer._decisions.values())
+        ledger.close()
+    return results
+
+
+def _synthetic_history(n_rows: int, n_shapes: int = 500, n_literals: int = 100):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    shape_ids = rng.integers(0, n_shapes, n_rows)
+    literals = rng.integers(0, n_literals, n_rows)
+    texts = [_QUERY_SHAPES[s % len(_QUERY_SHAPES)].format(i=lit, d=s % 28 + 1).replace("sales_", f"sales{s}_")
+             for s, lit in zip(shape_ids, literals)]
+    end = pd.Timestamp.now(tz="UTC") - pd.to_timedelta(rng.integers(0, 7 * 86400, n_rows), unit="s")
+    return pd.DataFrame({
+        "QUERY_ID": [f"q{i}" for i in range(n_rows)],
+        "QUERY_TEXT": texts,
+        "QUERY_TYPE": "SELECT",
+        "DATABASE_NAME": "ANALYTICS",
+        "SCHEMA_NAME": "PUBLIC",
+        "START_TIME": end - pd.Timedelta(seconds=1),
+        "END_TIME": end,
+        "TOTAL_ELAPSED_TIME": rng.integers(1, 10 ** 6, n_rows),
+        "EXECUTION_TIME": rng.integers(1, 10 ** 6, n_rows),
+        "BYTES_SCANNED": rng.integers(1, 10 ** 10, n_rows),
+    })
+
+
+def bench_history_store(n_rows: int = 1000000, query_latency: float = 0.5) -> Dict[str, float]:
+    """Rank a week of history from the local Parquet store vs. fetching it live and ranking."""
+    import tempfile
+    from fingerprint import rank_fingerprints
+    from history_store import HistoryStore
+
+    history = _synthetic_history(n_rows)
+    with tempfile.TemporaryDirectory() as root:
+        store = HistoryStore(root)
+        ingest_s = _timed(lambda: [store._write(history.iloc[i:i + 100000], datetime.now(timezone.utc))
+                                   for i in range(0, n_rows, 100000)])
+        local_s = _timed(lambda: store.rank(top_n=20))
+
+    rows = list(history.itertuples(index=False, name=None))
+    con = FakeConnection(responder=lambda sql, params=None: (list(history.columns), rows), query_latency=query_latency)
+
+    def live():
+        from query_stream import execute_stream
+        rank_fingerprints(execute_stream(con, "SELECT ... FROM QUERY_HISTORY").to_pandas(), top_n=20)
+
+    live_s = _timed(live)
+    return {"rows": n_rows, "one_time_ingest_s": ingest_s, "local_rank_s": local_s, "live_rank_s": live_s,
+            "speedup": live_s / local_s}
+
+
+BENCHMARKS = {
+    "cortex_pool": bench_cortex_pool,
+    "optimizer_fanout": bench_optimizer_fanout,
+    "table_extraction": bench_table_extraction,
+    "sql_lint": bench_sql_lint,
+    "fingerprinting": bench_fingerprinting,
+    "completion_cache": bench_completion_cache,
+    "history_store": bench_history_store,
+    "batched_completions": bench_batched_completions,
+    "plan_prescreen": bench_plan_prescreen,
+    "async_validation": bench_async_validation,
+    "query_benchmark": bench_query_benchmark,
+    "operator_stats": bench_operator_stats,
+    "session_leasing": bench_session_leasing,
+    "tracing": bench_tracing,
+    "plan_replay": bench_plan_replay,
+    "batch_runner": bench_batch_runner,
+    "incremental_analysis": bench_incremental_analysis,
+}
+
+
+def main():
+    # pd.read_sql warns about non-SQLAlchemy DBAPI connections, real or fake
+    warnings.filterwarnings("ignore", message="pandas only supports SQLAlchemy")
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument("--record-plan", action="store_true",
+                        help="re-record the plan_replay cassette from the synthetic warehouse first")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+    if args.record_plan:
+        print(f"recorded: {record_plan_cassette()}")
+    for name in args.names or BENCHMARKS:
+        results = BENCHMARKS[name]()
+        print(f"{name}: " + ", ".join(f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}" for k, v in results.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+import base64
+import json
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime, time as dtime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from fake_snowflake import FakeConnection
+from fingerprint import normalize_query
+
+CASSETTE_VERSION = 1
+
+_UUID_RE = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+# Statement kinds, used for latency overrides and reporting
+KINDS = ("cortex", "describe", "explain", "query_history", "operator_stats", "session", "query")
+
+
+def classify(sql: str) -> str:
+    """Kind of statement, for per-kind latency overrides."""
+    text = sql.lstrip().upper()
+    if "CORTEX.COMPLETE" in text:
+        return "cortex"
+    if text.startswith(("DESCRIBE", "DESC ")):
+        return "describe"
+    if text.startswith("EXPLAIN"):
+        return "explain"
+    if "GET_QUERY_OPERATOR_STATS" in text:
+        return "operator_stats"
+    if "QUERY_HISTORY" in text:
+        return "query_history"
+    if text.startswith(("ALTER SESSION", "SHOW PARAMETERS", "USE ", "SELECT SYSTEM$CANCEL_QUERY")):
+        return "session"
+    return "query"
+
+
+@dataclass
+class Interaction:
+    """One statement and the rows it returned; `elapsed` is seconds until the result was available."""
+    sql: str
+    params: Any = None  # bind parameters: a list, or a dict for named binds
+    columns: List[str] = field(default_factory=list)
+    rows: List[tuple] = field(default_factory=list)
+    elapsed: float = 0.0
+    mode: str = "sync"  # "async" for execute_async submissions
+    error: Optional[str] = None
+
+    @property
+    def kind(self) -> str:
+        return classify(self.sql)
+
+
+class CassetteMiss(LookupError):
+    """A replayed statement that the cassette has no recording for."""
+
+
+class Cassette:
+    """Recorded Snowflake and Cortex traffic, replayable through the fake connector.
+
+    Record by wrapping a live connection::
+
+        cassette = Cassette()
+        con = cassette.record(snowflake.connector.connect(...))
+        SnowflakeSQLOptimizer(con).run("Optimize my queries")
+        cassette.save("fixtures/cassettes/my_run.json")
+
+    and replay offline with `Cassette.load(path).replay()`, which returns a
+    `FakeConnection` answering the same statements with the recorded rows
+    after the recorded (or overridden) latency.
+    """
+
+    def __init__(self, interactions: Optional[List[Interaction]] = None):
+        self.interactions: List[Interaction] = list(interactions or [])
+        self.misses: List[str] = []  # statements replays had no recording for
+        self._lock = threading.Lock()
+
+    def add(self, interaction: Interaction) -> Interaction:
+        with self._lock:
+            self.interactions.append(interaction)
+        return interaction
+
+    def record(self, connection) -> "RecordingConnection":
+        return RecordingConnection(connection, self)
+
+    def replay(self, latency: Union[None, float, Dict[str, float]] = None, speed: float = 1.0,
+               exclusive: bool = False) -> FakeConnection:
+        """A fake connection serving this cassette.
+
+        `latency` overrides the recorded timings: one value in seconds for
+        every statement, or a dict by kind (see `KINDS`) where missing kinds
+        keep their recorded time. Recorded timings are scaled by `speed`.
+        """
+        replayer = _Replayer(self, latency, speed)  # own cursor positions, so replays are independent
+        return FakeConnection(responder=replayer.respond, async_duration=replayer.duration, exclusive=exclusive)
+
+    def kinds(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for i in self.interactions:
+            counts[i.kind] = counts.get(i.kind, 0) + 1
+        return counts
+
+    @classmethod
+    def load(cls, path: str) -> "Cassette":
+        with open(path) as f:
+            document = json.load(f)
+        if document.get("version") != CASSETTE_VERSION:
+            raise ValueError(f"Unsupported cassette version {document.get('version')!r} in {path}")
+        interactions = []
+        for item in document["interactions"]:
+            item = dict(item)
+            item["params"] = _decode(item.get("params"))
+            item["rows"] = [tuple(_decode(v) for v in row) for row in item.get("rows", [])]
+            item.pop("kind", None)
+            interactions.append(Interaction(**item))
+        return cls(interactions)
+
+    def save(self, path: str):
+        with self._lock:
+            interactions = list(self.interactions)
+        items = []
+        for i in interactions:
+            item = {"kind": i.kind, **asdict(i)}
+            item["params"] = _encode(i.params)
+            item["rows"] = [[_encode(v) for v in row] for row in i.rows]
+            items.append(item)
+        with open(path, "w") as f:
+            json.dump({"version": CASSETTE_VERSION, "interactions": items}, f, indent=1)
+            f.write("\n")
+
+
+class _Replayer:
+    """Matches statements to recordings: exact SQL and params first, then the normalized shape.
+
+    Several recordings under one key are served in recorded order, cycling.
+    Query ids that differ from the recording (ids of queries run during the
+    replay) are mapped positionally onto the recorded ones in the result rows.
+    """
+
+    def __init__(self, cassette: Cassette, latency: Union[None, float, Dict[str, float]], speed: float):
+        self.cassette = cassette
+        self.latency = latency
+        self.speed = speed
+        self._exact: Dict[Tuple[str, str], List[Interaction]] = {}
+        self._shape: Dict[Tuple[str, str], List[Interaction]] = {}
+        for i in cassette.interactions:
+            self._exact.setdefault(_exact_key(i.sql, i.params), []).append(i)
+            self._shape.setdefault(_shape_key(i.sql), []).append(i)
+        self._next: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def respond(self, sql: str, params: Optional[Sequence[Any]] = None) -> Tuple[List[str], List[tuple]]:
+        interaction = self._match(sql, params)
+        if interaction.mode == "sync":
+            delay = self._delay(interaction)
+            if delay:
+                time.sleep(delay)
+        if interaction.error:
+            raise RuntimeError(interaction.error)
+        return interaction.columns, _remap_rows(interaction, sql)
+
+    def duration(self, sql: str) -> float:
+        candidates = [i for i in self._shape.get(_shape_key(sql), []) if i.mode == "async"]
+        if not candidates:
+            return 0.0
+        return sum(self._delay(i) for i in candidates) / len(candidates)
+
+    def _match(self, sql: str, params: Optional[Sequence[Any]]) -> Interaction:
+        for key, table in ((_exact_key(sql, params), self._exact), (_shape_key(sql), self._shape)):
+            candidates = table.get(key)
+            if candidates:
+                with self._lock:
+                    n = self._next.get(key, 0)
+                    self._next[key] = n + 1
+                return candidates[n % len(candidates)]
+        miss = f"No recording for {classify(sql)} statement: {' '.join(sql.split())[:200]}"
+        with self.cassette._lock:
+            self.cassette.misses.append(miss)
+        raise CassetteMiss(miss)
+
+    def _delay(self, interaction: Interaction) -> float:
+        if isinstance(self.latency, dict) and interaction.kind in self.latency:
+            return self.latency[interaction.kind]
+        if isinstance(self.latency, (int, float)):
+            return float(self.latency)
+        return interaction.elapsed * self.speed
+
+
+def _params(params):
+    # Positional binds as a list (JSON has no tuples); named binds stay a dict
+    if params is None or isinstance(params, dict):
+        return params
+    return list(params)
+
+
+def _exact_key(sql: str, params) -> Tuple[str, str]:
+    return sql, json.dumps(_encode(_params(params)), sort_keys=True)
+
+
+def _shape_key(sql: str) -> Tuple[str, str]:
+    # Literals, comments and bound parameters ignored: a Cortex call falls back to any recorded completion
+    return normalize_query(sql), ""
+
+
+def _remap_rows(interaction: Interaction, sql: str) -> List[tuple]:
+    recorded = list(dict.fromkeys(_UUID_RE.findall(interaction.sql)))
+    current = list(dict.fromkeys(_UUID_RE.findall(sql)))
+    mapping = {r: c for r, c in zip(recorded, current) if r != c}
+    if not mapping or len(recorded) != len(current):
+        return list(interaction.rows)
+    pattern = re.compile("|".join(map(re.escape, mapping)))
+    return [tuple(pattern.sub(lambda m: mapping[m.group(0)], v) if isinstance(v, str) else v for v in row)
+            for row in interaction.rows]
+
+
+def _encode(value):
+    # JSON with type tags for the values the connector returns that JSON has no type for
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    if isinstance(value, dtime):
+        return {"$time": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {"$bytes": base64.b64encode(bytes(value)).decode()}
+    if isinstance(value, float) and value != value:
+        return {"$float": "nan"}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    if isinstance(value, dict) and len(value) == 1:
+        (tag, raw), = value.items()
+        if tag == "$datetime":
+            return datetime.fromisoformat(raw)
+        if tag == "$date":
+            return date.fromisoformat(raw)
+        if tag == "$time":
+            return dtime.fromisoformat(raw)
+        if tag == "$decimal":
+            return Decimal(raw)
+        if tag == "$bytes":
+            return base64.b64decode(raw)
+        if tag == "$float":
+            return float(raw)
+    return value
+
+
+class RecordingCursor:
+    """Cursor proxy that records every statement's rows and timing into a cassette."""
+
+    def __init__(self, connection: "RecordingConnection"):
+        self.connection = connection
+        self._cursor = connection.connection.cursor()
+        self.description = None
+        self.rowcount = -1
+        self._rows: List[tuple] = []
+        self._pos = 0
+
+    @property
+    def sfqid(self) -> Optional[str]:
+        return self._cursor.sfqid
+
+    def execute(self, command: str, params: Optional[Sequence[Any]] = None, **kwargs):
+        start = time.monotonic()
+        interaction = Interaction(command, _params(params))
+        try:
+            if params is not None:
+                self._cursor.execute(command, params, **kwargs)
+            else:
+                self._cursor.execute(command, **kwargs)
+            rows = [tuple(r) for r in self._cursor.fetchall()] if self._cursor.description else []
+        except Exception as e:
+            interaction.error = str(e)
+            interaction.elapsed = time.monotonic() - start
+            self.connection.cassette.add(interaction)
+            raise
+        interaction.elapsed = time.monotonic() - start
+        interaction.columns = [d[0] for d in self._cursor.description or []]
+        interaction.rows = rows
+        self.connection.cassette.add(interaction)
+        self._set_result(self._cursor.description, rows)
+        return self
+
+    def execute_async(self, command: str, params: Optional[Sequence[Any]] = None, **kwargs):
+        result = self._cursor.execute_async(command, params, **kwargs)
+        interaction = Interaction(command, _params(params), mode="async")
+        self.connection._submitted(self._cursor.sfqid, interaction)
+        return result
+
+    def get_results_from_sfqid(self, sfqid: str):
+        self._cursor.get_results_from_sfqid(sfqid)
+        rows = [tuple(r) for r in self._cursor.fetchall()] if self._cursor.description else []
+        interaction = self.connection._finished(sfqid)
+        if interaction is not None:
+            interaction.columns = [d[0] for d in self._cursor.description or []]
+            interaction.rows = rows
+        self._set_result(self._cursor.description, rows)
+
+    def _set_result(self, description, rows: List[tuple]):
+        self.description = description
+        self._rows = rows
+        self._pos = 0
+        self.rowcount = len(rows)
+
+    def fetchone(self):
+        if self._pos >= len(self._rows):
+            return None
+        row = self._rows[self._pos]
+        self._pos += 1
+        return row
+
+    def fetchmany(self, size: int = 1):
+        rows = self._rows[self._pos:self._pos + size]
+        self._pos += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._rows[self._pos:]
+        self._pos = len(self._rows)
+        return rows
+
+    def close(self):
+        self._rows = []
+        self._cursor.close()
+
+
+class RecordingConnection:
+    """Connection proxy for record mode; everything but cursors is delegated.
+
+    `rest` is hidden so Cortex streaming falls back to SQL COMPLETE, which
+    is recorded, instead of the REST endpoint, which is not.
+    """
+
+    rest = None
+
+    def __init__(self, connection, cassette: Cassette):
+        self.connection = connection
+        self.cassette = cassette
+        self._async: Dict[str, Interaction] = {}
+        self._started: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def cursor(self) -> RecordingCursor:
+        return RecordingCursor(self)
+
+    def get_query_status(self, sfqid: str):
+        status = self.connection.get_query_status(sfqid)
+        if not self.connection.is_still_running(status):
+            self._finished(sfqid)
+        return status
+
+    def _submitted(self, sfqid: str, interaction: Interaction):
+        self.cassette.add(interaction)  # in submission order; timing is filled in when it finishes
+        with self._lock:
+            self._async[sfqid] = interaction
+            self._started[sfqid] = time.monotonic()
+
+    def _finished(self, sfqid: str) -> Optional[Interaction]:
+        # First call after the query stops running fixes its elapsed time
+        with self._lock:
+            start = self._started.pop(sfqid, None)
+            interaction = self._async.get(sfqid)
+        if start is not None:
+            interaction.elapsed = time.monotonic() - start
+        return interaction
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+
+def template_id(template: Optional[str]) -> str:
+    """Short hash of a prompt template, so editing the template retires its entries."""
+    return hashlib.sha256((template or "").encode()).hexdigest()[:16]
+
+
+def cache_key(model: str, prompt: str, system: Optional[str] = None, template: Optional[str] = None) -> str:
+    # Only the ends are trimmed: inner whitespace can sit inside SQL literals or quoted identifiers
+    payload = [model, (system or "").strip(), prompt.strip(), template_id(template)]
+    return hashlib.sha256(json.dumps(payload).encode()).hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU backend, mainly for tests and short-lived scripts."""
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, Tuple[str, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], entry[2]
+
+    def set(self, key: str, value: str, template: str):
+        with self._lock:
+            self._entries[key] = (value, template, time.time())
+            self._entries.move_to_end(key)
+
+    def delete_template(self, template: str) -> int:
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if e[1] == template]
+            for k in keys:
+                del self._entries[k]
+            return len(keys)
+
+    def evict(self, max_entries: int, oldest_allowed: float) -> int:
+        with self._lock:
+            expired = [k for k, e in self._entries.items() if e[2] < oldest_allowed]
+            for k in expired:
+                del self._entries[k]
+            evicted = len(expired)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """Persistent backend in a local SQLite file, shared across app restarts."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, template TEXT NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS completions_template ON completions (template)")
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock, self._db:
+            row = self._db.execute("SELECT value, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return row
+
+    def set(self, key: str, value: str, template: str):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)", (key, value, template, now, now)
+            )
+
+    def delete_template(self, template: str) -> int:
+        with self._lock, self._db:
+            return self._db.execute("DELETE FROM completions WHERE template = ?", (template,)).rowcount
+
+    def evict(self, max_entries: int, oldest_allowed: float) -> int:
+        with self._lock, self._db:
+            evicted = self._db.execute("DELETE FROM completions WHERE created_at < ?", (oldest_allowed,)).rowcount
+            evicted += self._db.execute(
+                "DELETE FROM completions WHERE key IN ("
+                " SELECT key FROM completions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (max_entries,),
+            ).rowcount
+            return evicted
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM completions")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+
+class CompletionCache:
+    """Content-addressed cache of Cortex completions.
+
+    Entries are keyed by a hash of (model, system prompt, whitespace-normalized
+    prompt, template id). They expire after `ttl` seconds and the backend is
+    trimmed to `max_entries` (least recently read first) every
+    `evict_every` writes. Hits and misses are counted; every hit is a Cortex
+    call avoided.
+    """
+
+    def __init__(self, backend=None, ttl: float = 7 * 24 * 3600.0, max_entries: int = 10000,
+                 evict_every: int = 100):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+    def get(self, model: str, prompt: str, system: Optional[str] = None,
+            template: Optional[str] = None) -> Optional[str]:
+        entry = self.backend.get(cache_key(model, prompt, system, template))
+        if entry is None or entry[1] < time.time() - self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def set(self, model: str, prompt: str, value: str, system: Optional[str] = None,
+            template: Optional[str] = None):
+        self.backend.set(cache_key(model, prompt, system, template), value, template_id(template))
+        self._writes += 1
+        if self._writes % self.evict_every == 0:
+            self.evict()
+
+    def get_or_complete(self, model: str, prompt: str, complete: Callable[[], str],
+                        system: Optional[str] = None, template: Optional[str] = None) -> str:
+        value = self.get(model, prompt, system, template)
+        if value is None:
+            value = complete()
+            self.set(model, prompt, value, system, template)
+        return value
+
+    def invalidate_template(self, template: Optional[str]) -> int:
+        """Drop every completion produced from `template` (call after editing it)."""
+        return self.backend.delete_template(template_id(template))
+
+    def evict(self) -> int:
+        return self.backend.evict(self.max_entries, time.time() - self.ttl)
+
+    def clear(self):
+        self.backend.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate,
+                "calls_avoided": self.hits, "entries": len(self.backend)}
+
+
+def default_cache_path() -> str:
+    return os.environ.get("OPTIMA_COMPLETION_CACHE", os.path.expanduser("~/.cache/optima/completions.sqlite"))
+
+
+_default_cache: Optional[CompletionCache] = None
+_default_lock = threading.Lock()
+
+
+def default_completion_cache() -> CompletionCache:
+    """Process-wide cache persisted at `default_cache_path()`."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = CompletionCache(SQLiteBackend(default_cache_path()))
+        return _default_cache
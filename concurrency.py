@@ -0,0 +1,65 @@
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class CallTimeout(TimeoutError):
+    """Raised (or returned) for a call that exceeded its per-call timeout."""
+
+
+def bounded_map(fn: Callable[[Any], Any], items: Iterable[Any], max_concurrency: int = 4,
+                timeout: Optional[float] = None) -> List[Any]:
+    """Apply `fn` to every item on at most `max_concurrency` threads.
+
+    Results come back in input order. A call that raises, or runs longer than
+    `timeout` seconds from the moment it started, yields its exception
+    (`CallTimeout` for timeouts) in place of a result so one slow or failing
+    item never sinks the whole batch. Timed-out calls are abandoned, not
+    interrupted: their thread keeps running until the blocking call returns.
+    """
+    items = list(items)
+    results: List[Any] = [None] * len(items)
+    if not items:
+        return results
+    if max_concurrency <= 1 and timeout is None:
+        for i, item in enumerate(items):
+            try:
+                results[i] = fn(item)
+            except Exception as e:
+                results[i] = e
+        return results
+
+    started: Dict[int, float] = {}
+
+    def call(i: int, item: Any) -> Any:
+        started[i] = time.monotonic()
+        return fn(item)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+    # Each call runs in a copy of the caller's context, so tracing spans nest under the caller's
+    pending: Dict[Future, int] = {executor.submit(contextvars.copy_context().run, call, i, item): i
+                                  for i, item in enumerate(items)}
+    try:
+        while pending:
+            wait_for = None
+            if timeout is not None:
+                now = time.monotonic()
+                deadlines = [started[i] + timeout for i in pending.values() if i in started]
+                wait_for = max(0.0, min(deadlines) - now) if deadlines else timeout
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = pending.pop(future)
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    results[i] = e
+            if timeout is not None:
+                now = time.monotonic()
+                for future, i in list(pending.items()):
+                    if i in started and now - started[i] >= timeout:
+                        pending.pop(future)
+                        results[i] = CallTimeout(f"Call {i} exceeded {timeout}s")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results
@@ -0,0 +1,240 @@
+import hashlib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, Optional
+
+from tracing import span
+
+
+def credential_key(*parts: Optional[str]) -> str:
+    """Pool key for a credential set; a hash, so passwords are never kept as dict keys or logged."""
+    return hashlib.sha256("\x00".join(p or "" for p in parts).encode()).hexdigest()[:16]
+
+
+class _PooledConnection:
+    __slots__ = ("connection", "created_at", "last_used")
+
+    def __init__(self, connection: Any):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+@dataclass
+class _Lease:
+    key: str
+    pooled: _PooledConnection
+    last_used: float = field(default_factory=time.monotonic)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class _Pool:
+    def __init__(self, connect: Callable[[], Any]):
+        self.connect = connect
+        self.idle: Deque[_PooledConnection] = deque()
+        self.open = 0
+
+
+class ConnectionManager:
+    """Bounded connection pools per credential set, leased to one browser session at a time.
+
+    A session keeps its lease across reruns (so session state such as USE
+    WAREHOUSE sticks) and uses it one statement block at a time; no two
+    sessions ever share a connection, so cursors and query ids cannot
+    interleave. When a pool is full, the lease idle longest past `lease_idle`
+    seconds is reclaimed, otherwise the caller waits up to `acquire_timeout`.
+    New connections get STATEMENT_TIMEOUT_IN_SECONDS so a runaway query is
+    cancelled server-side. Idle connections past `max_idle`, or older than
+    `max_age`, are closed by `evict_idle` (run on every lease, and
+    periodically by `start_reaper`).
+    """
+
+    def __init__(self, pool_size: int = 4, lease_idle: float = 300.0, max_idle: float = 600.0,
+                 max_age: float = 4 * 3600.0, acquire_timeout: float = 60.0,
+                 statement_timeout: Optional[int] = 600):
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        self.pool_size = pool_size
+        self.lease_idle = lease_idle
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self.acquire_timeout = acquire_timeout
+        self.statement_timeout = statement_timeout
+        self._pools: Dict[str, _Pool] = {}
+        self._leases: Dict[str, _Lease] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._reaper: Optional[threading.Thread] = None
+
+    @contextmanager
+    def connection(self, session_id: str, key: str, connect: Callable[[], Any]) -> Iterator[Any]:
+        """Use the session's leased connection (leasing one from the `key` pool if needed) for the block."""
+        if self._closed:
+            raise RuntimeError("ConnectionManager is closed")
+        self.evict_idle()
+        lease = self._lease(session_id, key, connect)
+        with lease.lock:
+            lease.last_used = float("inf")  # in use: never reclaimed mid-block
+            try:
+                yield lease.pooled.connection
+            finally:
+                with self._cond:
+                    lease.last_used = lease.pooled.last_used = time.monotonic()
+                    self._cond.notify_all()  # waiters may now reclaim it once it idles past `lease_idle`
+
+    def release(self, session_id: str):
+        """Return the session's connection to its pool (e.g. when the browser session ends)."""
+        with self._cond:
+            lease = self._leases.pop(session_id, None)
+            if lease is not None:
+                self._checkin(lease)
+
+    def evict_idle(self) -> int:
+        """Release leases idle past `lease_idle` and close pooled connections past their limits."""
+        now = time.monotonic()
+        stale = []
+        with self._cond:
+            for session_id, lease in list(self._leases.items()):
+                if now - lease.last_used > self.lease_idle:
+                    del self._leases[session_id]
+                    self._checkin(lease)
+            for pool in self._pools.values():
+                for pooled in [p for p in pool.idle if self._expired(pooled=p, now=now)]:
+                    pool.idle.remove(pooled)
+                    pool.open -= 1
+                    stale.append(pooled)
+            if stale:
+                self._cond.notify_all()
+        for pooled in stale:
+            _close(pooled.connection)
+        return len(stale)
+
+    def start_reaper(self, interval: float = 60.0):
+        """Run `evict_idle` every `interval` seconds on a daemon thread until `close`."""
+        if self._reaper is not None:
+            return
+
+        def reap():
+            while not self._closed:
+                time.sleep(interval)
+                self.evict_idle()
+
+        self._reaper = threading.Thread(target=reap, name="connection-reaper", daemon=True)
+        self._reaper.start()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._cond:
+            return {key: {"open": pool.open, "idle": len(pool.idle),
+                          "leased": sum(1 for lease in self._leases.values() if lease.key == key)}
+                    for key, pool in self._pools.items()}
+
+    def close(self):
+        self._closed = True
+        with self._cond:
+            connections = [lease.pooled for lease in self._leases.values()]
+            for pool in self._pools.values():
+                connections.extend(pool.idle)
+                pool.idle.clear()
+                pool.open = 0
+            self._leases.clear()
+            self._cond.notify_all()
+        for pooled in connections:
+            _close(pooled.connection)
+
+    def _lease(self, session_id: str, key: str, connect: Callable[[], Any]) -> _Lease:
+        with self._cond:
+            lease = self._leases.get(session_id)
+            if lease is not None and lease.key == key and not _is_closed(lease.pooled.connection):
+                lease.last_used = time.monotonic()  # so it is not reclaimed before the caller locks it
+                return lease
+            if lease is not None:
+                # Credentials changed or the connection died: give the old one back first
+                del self._leases[session_id]
+                self._checkin(lease)
+        pooled = self._acquire(key, connect)
+        lease = _Lease(key, pooled)
+        with self._cond:
+            self._leases[session_id] = lease
+        return lease
+
+    def _acquire(self, key: str, connect: Callable[[], Any]) -> _PooledConnection:
+        deadline = time.monotonic() + self.acquire_timeout
+        with span("connection.acquire", pool=key) as s:
+            with self._cond:
+                pool = self._pools.setdefault(key, _Pool(connect))
+                while True:
+                    while pool.idle:
+                        pooled = pool.idle.pop()
+                        if not _is_closed(pooled.connection):
+                            s.set(reused=True)
+                            return pooled
+                        pool.open -= 1
+                    if pool.open < self.pool_size:
+                        pool.open += 1
+                        break
+                    if self._reclaim(key):
+                        continue
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"No connection available for pool {key} after {self.acquire_timeout}s "
+                                           f"({self.pool_size} leased)")
+                    self._cond.wait(remaining)
+            s.set(reused=False)
+            try:
+                return _PooledConnection(self._open(pool.connect))
+            except Exception:
+                with self._cond:
+                    pool.open -= 1
+                    self._cond.notify()
+                raise
+
+    def _open(self, connect: Callable[[], Any]) -> Any:
+        with span("connection.connect"):
+            connection = connect()
+        if self.statement_timeout:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(f"ALTER SESSION SET STATEMENT_TIMEOUT_IN_SECONDS = {int(self.statement_timeout)}")
+            finally:
+                cursor.close()
+        return connection
+
+    def _reclaim(self, key: str) -> bool:
+        # Caller holds the condition. Takes back the longest-idle lease past `lease_idle`.
+        now = time.monotonic()
+        candidates = [(lease.last_used, session_id) for session_id, lease in self._leases.items()
+                      if lease.key == key and now - lease.last_used > self.lease_idle]
+        if not candidates:
+            return False
+        _, session_id = min(candidates)
+        self._checkin(self._leases.pop(session_id))
+        return True
+
+    def _checkin(self, lease: _Lease):
+        # Caller holds the condition
+        pool = self._pools[lease.key]
+        if self._closed or _is_closed(lease.pooled.connection):
+            pool.open -= 1
+            _close(lease.pooled.connection)
+        else:
+            lease.pooled.last_used = time.monotonic()
+            pool.idle.append(lease.pooled)
+        self._cond.notify()
+
+    def _expired(self, pooled: _PooledConnection, now: float) -> bool:
+        return now - pooled.last_used > self.max_idle or now - pooled.created_at > self.max_age
+
+
+def _is_closed(connection) -> bool:
+    is_closed = getattr(connection, "is_closed", None)
+    return bool(is_closed()) if callable(is_closed) else False
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
@@ -0,0 +1,391 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from completion_cache import CompletionCache
+from concurrency import CallTimeout
+from cortex_request import build_batch_completion, build_completion, connection_paramstyle, parse_completion
+from prompt_budget import count_tokens
+from tracing import annotate, default_tracer, span
+
+DEFAULT_MODEL = "snowflake-arctic"
+
+
+class _PooledSession:
+    __slots__ = ("connection", "created_at", "last_used")
+
+    def __init__(self, connection: Any):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class CortexClient:
+    """Runs SNOWFLAKE.CORTEX.COMPLETE over a bounded pool of authenticated sessions.
+
+    Sessions are created lazily with `connect`, handed out one per call and
+    returned afterwards. Sessions older than `max_age` or idle for longer than
+    `max_idle` seconds are evicted; sessions idle for longer than
+    `health_check_after` seconds are pinged with `SELECT 1` before reuse.
+    Calls given a `timeout` run asynchronously and are cancelled server-side
+    (SYSTEM$CANCEL_QUERY) when it passes, so no abandoned COMPLETE keeps
+    running and billing after the caller gave up.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        pool_size: int = 4,
+        max_idle: float = 600.0,
+        max_age: float = 4 * 3600.0,
+        health_check_after: float = 60.0,
+        acquire_timeout: float = 60.0,
+        owns_connections: bool = True,
+        cache: Optional[CompletionCache] = None,
+        poll_interval: float = 0.05,
+        max_poll_interval: float = 1.0,
+    ):
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        self._connect = connect
+        self.pool_size = pool_size
+        self.max_idle = max_idle
+        self.max_age = max_age
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+        self.owns_connections = owns_connections
+        self.cache = cache
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.last_time_to_first_token: Optional[float] = None
+        self.time_to_first_token: Deque[float] = deque(maxlen=1000)
+        self._idle: Deque[_PooledSession] = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._closed = False
+
+    @classmethod
+    def for_connection(cls, conn_sf, pool_size: int = 4, cache: Optional[CompletionCache] = None) -> "CortexClient":
+        """Share an existing connection (one cursor per call) without ever closing it."""
+        return cls(lambda: conn_sf, pool_size=pool_size, owns_connections=False, cache=cache)
+
+    @contextmanager
+    def session(self) -> Iterator[Any]:
+        """Lease a healthy connection from the pool for the duration of the block."""
+        if self._closed:
+            raise RuntimeError("CortexClient is closed")
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f"No Cortex session available after {self.acquire_timeout}s")
+        pooled = None
+        try:
+            pooled = self._checkout()
+            yield pooled.connection
+        finally:
+            if pooled is not None:
+                self._checkin(pooled)
+            self._slots.release()
+
+    def complete(self, prompt: str, model: str = DEFAULT_MODEL, system: Optional[str] = None,
+                 template: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        """Return the completion for `prompt`, optionally preceded by a system message.
+
+        With a `cache`, identical (model, system, prompt, template) requests are
+        answered locally; pass the prompt `template` so editing it retires old entries.
+        A statement running past `timeout` seconds is cancelled and raises `CallTimeout`.
+        """
+        with span("cortex.complete", model=model, prompt_tokens=count_tokens(prompt, model)) as s:
+            if self.cache is None:
+                completion = self._complete(prompt, model, system, timeout)
+            else:
+                completion = self.cache.get_or_complete(model, prompt,
+                                                        lambda: self._complete(prompt, model, system, timeout),
+                                                        system=system, template=template)
+            s.attributes.setdefault("cache_hit", True)  # _complete marks calls that reached Cortex
+            s.set(completion_tokens=count_tokens(completion, model))
+            return completion
+
+    def complete_batch(self, prompts: List[str], model: str = DEFAULT_MODEL, system: Optional[str] = None,
+                       template: Optional[str] = None, batch_size: int = 20,
+                       timeout: Optional[float] = None) -> List[str]:
+        """Complete several prompts with one COMPLETE ... FROM VALUES statement per `batch_size` prompts.
+
+        Results are in input order. Cached prompts are answered locally and
+        only the misses are sent. `timeout` applies to each statement.
+        """
+        results: List[Optional[str]] = [None] * len(prompts)
+        missing = []
+        for i, prompt in enumerate(prompts):
+            if self.cache is not None:
+                results[i] = self.cache.get(model, prompt, system, template)
+            if results[i] is None:
+                missing.append(i)
+        with span("cortex.complete_batch", model=model, prompts=len(prompts), cache_hits=len(prompts) - len(missing),
+                  prompt_tokens=sum(count_tokens(p, model) for p in prompts)) as s:
+            query_ids = []
+            for start in range(0, len(missing), batch_size):
+                chunk = missing[start:start + batch_size]
+                with self.session() as con:
+                    completions = self._run_batch(con, [prompts[i] for i in chunk], model, system, query_ids,
+                                                  timeout)
+                for i, completion in zip(chunk, completions):
+                    results[i] = completion
+                    if self.cache is not None:
+                        self.cache.set(model, prompts[i], completion, system, template)
+            s.set(statements=len(query_ids), query_id=",".join(query_ids) or None,
+                  completion_tokens=sum(count_tokens(r or "", model) for r in results))
+        return results
+
+    def stream(self, prompt: str, model: str = DEFAULT_MODEL, system: Optional[str] = None,
+               template: Optional[str] = None, timeout: Optional[float] = None) -> Iterator[str]:
+        """Yield the completion for `prompt` as it is generated.
+
+        Uses the Cortex REST endpoint with server-sent events when the session
+        exposes a REST token, and otherwise yields the SQL completion as one
+        chunk. Time to first token is recorded in `time_to_first_token`.
+        With a `timeout`, waiting longer than that for a chunk closes the HTTP
+        response (or cancels the statement) and raises `CallTimeout`; either
+        way the session goes back to the pool before the error reaches the caller.
+        """
+        start = time.monotonic()
+        # Not made current: the span stays open across yields to the consumer
+        s = default_tracer.start_span("cortex.stream", model=model, prompt_tokens=count_tokens(prompt, model))
+        chunks = []
+        error: Optional[Exception] = None
+        try:
+            if self.cache is not None:
+                cached = self.cache.get(model, prompt, system, template)
+                if cached is not None:
+                    self._record_ttft(time.monotonic() - start)
+                    s.set(cache_hit=True, ttft_ms=self.last_time_to_first_token * 1000)
+                    chunks.append(cached)
+                    yield cached
+                    return
+            s.set(cache_hit=False)
+            for chunk in self._stream_chunks(prompt, model, system, timeout):
+                if not chunks:
+                    self._record_ttft(time.monotonic() - start)
+                    s.set(ttft_ms=self.last_time_to_first_token * 1000)
+                chunks.append(chunk)
+                yield chunk
+            if self.cache is not None:
+                self.cache.set(model, prompt, "".join(chunks), system, template)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            s.set(completion_tokens=count_tokens("".join(chunks), model))
+            s.end(error)
+
+    def _stream_chunks(self, prompt: str, model: str, system: Optional[str],
+                       timeout: Optional[float] = None) -> Iterator[str]:
+        with self.session() as con:
+            token = getattr(getattr(con, "rest", None), "token", None)
+            host = getattr(con, "host", None)
+            if token and host:
+                messages = [{"role": "user", "content": prompt}]
+                if system is not None:
+                    messages.insert(0, {"role": "system", "content": system})
+                started = False
+                try:
+                    for chunk in _stream_rest(host, token, model, messages, timeout or 300.0):
+                        started = True
+                        yield chunk
+                    return
+                except Exception as e:
+                    if _is_read_timeout(e):
+                        raise CallTimeout(f"Cortex stream from {model} exceeded {timeout}s") from e
+                    # Nothing shown yet: fall back to the SQL function; otherwise surface the error
+                    if started:
+                        raise
+            yield self._run_completion(con, prompt, model, system, timeout=timeout)
+
+    def _record_ttft(self, seconds: float):
+        self.last_time_to_first_token = seconds
+        self.time_to_first_token.append(seconds)
+
+    def _complete(self, prompt: str, model: str, system: Optional[str], timeout: Optional[float] = None) -> str:
+        query_ids: List[str] = []
+        with self.session() as con:
+            completion = self._run_completion(con, prompt, model, system, query_ids, timeout)
+        annotate(cache_hit=False, query_id=query_ids[0] if query_ids else None)
+        return completion
+
+    def _run_completion(self, con, prompt: str, model: str, system: Optional[str],
+                        query_ids: Optional[List[str]] = None, timeout: Optional[float] = None) -> str:
+        # Prompts are bind parameters, so no escaping pass and no quoting bugs
+        query, params = build_completion(model, prompt, system, connection_paramstyle(con))
+        cursor = self._execute(con, query, params, timeout)
+        try:
+            row = cursor.fetchone()
+            if query_ids is not None and cursor.sfqid:
+                query_ids.append(cursor.sfqid)
+        finally:
+            cursor.close()
+        return parse_completion(row[0], system is not None)
+
+    def _run_batch(self, con, prompts: List[str], model: str, system: Optional[str],
+                   query_ids: Optional[List[str]] = None, timeout: Optional[float] = None) -> List[str]:
+        query, params = build_batch_completion(model, prompts, system, connection_paramstyle(con))
+        cursor = self._execute(con, query, params, timeout)
+        try:
+            rows = cursor.fetchall()
+            if query_ids is not None and cursor.sfqid:
+                query_ids.append(cursor.sfqid)
+        finally:
+            cursor.close()
+        by_index = {int(idx): parse_completion(value, system is not None) for idx, value in rows}
+        return [by_index[i] for i in range(len(prompts))]
+
+    def _execute(self, con, query: str, params: Any, timeout: Optional[float]):
+        """Run the statement on a new cursor; with a `timeout`, asynchronously, cancelling it once exceeded."""
+        cursor = con.cursor()
+        try:
+            if timeout is None:
+                cursor.execute(query, params)
+                return cursor
+            cursor.execute_async(query, params)
+            sfqid = cursor.sfqid
+            deadline = time.monotonic() + timeout
+            interval = self.poll_interval
+            while con.is_still_running(con.get_query_status(sfqid)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    _cancel(con, sfqid)
+                    annotate(cancelled_query_id=sfqid)
+                    raise CallTimeout(f"COMPLETE {sfqid} exceeded {timeout}s and was cancelled")
+                time.sleep(min(interval, remaining))
+                interval = min(interval * 1.5, self.max_poll_interval)
+            cursor.get_results_from_sfqid(sfqid)
+            return cursor
+        except Exception:
+            cursor.close()
+            raise
+
+    def evict_stale(self) -> int:
+        """Close idle sessions past their idle or age limit; return how many were evicted."""
+        now = time.monotonic()
+        with self._lock:
+            stale = [p for p in self._idle if self._expired(p, now)]
+            for p in stale:
+                self._idle.remove(p)
+        for p in stale:
+            self._discard(p)
+        return len(stale)
+
+    def close(self):
+        """Close every idle session and refuse further calls."""
+        self._closed = True
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for p in idle:
+            self._discard(p)
+
+    def _checkout(self) -> _PooledSession:
+        while True:
+            with self._lock:
+                pooled = self._idle.pop() if self._idle else None
+            if pooled is None:
+                with span("cortex.connect"):
+                    return _PooledSession(self._connect())
+            now = time.monotonic()
+            if self._expired(pooled, now) or not self._healthy(pooled, now):
+                self._discard(pooled)
+                continue
+            return pooled
+
+    def _checkin(self, pooled: _PooledSession):
+        if self._closed or _is_closed(pooled.connection):
+            self._discard(pooled)
+            return
+        pooled.last_used = time.monotonic()
+        with self._lock:
+            self._idle.append(pooled)
+
+    def _expired(self, pooled: _PooledSession, now: float) -> bool:
+        return now - pooled.created_at > self.max_age or now - pooled.last_used > self.max_idle
+
+    def _healthy(self, pooled: _PooledSession, now: float) -> bool:
+        if _is_closed(pooled.connection):
+            return False
+        if now - pooled.last_used < self.health_check_after:
+            return True
+        try:
+            cursor = pooled.connection.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, pooled: _PooledSession):
+        if not self.owns_connections:
+            return
+        try:
+            pooled.connection.close()
+        except Exception:
+            pass
+
+
+def _stream_rest(host: str, token: str, model: str, messages: List[Dict[str, str]],
+                 timeout: float = 300.0) -> Iterator[str]:
+    """Stream a completion from the Cortex REST API as text deltas.
+
+    `timeout` bounds connecting and each wait for data; the response is
+    closed when the generator finishes, fails or is closed.
+    """
+    import requests
+
+    response = requests.post(
+        f"https://{host}/api/v2/cortex/inference:complete",
+        json={"model": model, "messages": messages, "stream": True},
+        headers={
+            "Authorization": f'Snowflake Token="{token}"',
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream",
+        },
+        stream=True,
+        timeout=timeout,
+    )
+    with response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            for choice in json.loads(data).get("choices", []):
+                text = (choice.get("delta") or {}).get("content")
+                if text:
+                    yield text
+
+
+def _is_read_timeout(error: Exception) -> bool:
+    import requests
+    from urllib3.exceptions import ReadTimeoutError
+
+    # A timeout while reading the body surfaces as ConnectionError(ReadTimeoutError)
+    return isinstance(error, requests.exceptions.Timeout) or (
+        isinstance(error, requests.exceptions.ConnectionError) and bool(error.args)
+        and isinstance(error.args[0], ReadTimeoutError))
+
+
+def _cancel(con, sfqid: str):
+    cursor = con.cursor()
+    try:
+        cursor.execute(f"SELECT SYSTEM$CANCEL_QUERY('{sfqid}')")
+    except Exception:
+        pass  # best effort: the statement may have finished in the meantime
+    finally:
+        cursor.close()
+
+
+def _is_closed(connection) -> bool:
+    is_closed = getattr(connection, "is_closed", None)
+    return bool(is_closed()) if callable(is_closed) else False
@@ -1,16 +1,59 @@
 import snowflake.connector
-import pandas as pd
-from typing import Dict, Any
+from typing import Iterator, Optional
 
-def cortex_inference(prompt: str) -> str:
-    # Use Snowflake Cortex for inference, calling the SNOWFLAKE.CORTEX.COMPLETE function
-    query = f"SELECT SNOWFLAKE.CORTEX.COMPLETE('snowflake-arctic', '{prompt}');"
-    
-    # Assuming you have a working Snowflake connection
-    con = snowflake.connector.connect(
+from completion_cache import default_completion_cache
+from cortex_client import CortexClient, DEFAULT_MODEL
+from model_router import ModelRouter
+
+_client: Optional[CortexClient] = None
+_router: Optional[ModelRouter] = None
+
+
+def _connect():
+    return snowflake.connector.connect(
         # Connection params
     )
-    
-    result = pd.read_sql(query, con)
-    con.close()
-    return result.iloc[0, 0]
+
+
+def get_cortex_client() -> CortexClient:
+    """Return the process-wide pooled Cortex client, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = CortexClient(_connect, cache=default_completion_cache())
+    return _client
+
+
+def set_cortex_client(client: CortexClient):
+    """Replace the process-wide Cortex client (e.g. with one bound to user credentials)."""
+    global _client, _router
+    _client = client
+    _router = None
+
+
+def get_model_router() -> ModelRouter:
+    """Return the process-wide model router over `get_cortex_client()`."""
+    global _router
+    if _router is None or _router.client is not get_cortex_client():
+        _router = ModelRouter(get_cortex_client())
+    return _router
+
+
+def cortex_inference(prompt: str, model: str = DEFAULT_MODEL, template: Optional[str] = None) -> str:
+    # Use Snowflake Cortex for inference, calling the SNOWFLAKE.CORTEX.COMPLETE function
+    # on a pooled session instead of logging in for every prompt. Repeated prompts are
+    # served from the completion cache.
+    return get_cortex_client().complete(prompt, model=model, template=template)
+
+
+def cortex_inference_stream(prompt: str, model: str = DEFAULT_MODEL, template: Optional[str] = None) -> Iterator[str]:
+    # Same as cortex_inference, but yields partial text as Cortex generates it
+    return get_cortex_client().stream(prompt, model=model, template=template)
+
+
+def routed_inference(task: str, prompt: str, template: Optional[str] = None) -> str:
+    # Model chosen by task policy (e.g. "check", "rewrite"), with fallback on error/timeout
+    return get_model_router().complete(task, prompt, template=template)
+
+
+def routed_inference_stream(task: str, prompt: str, template: Optional[str] = None) -> Iterator[str]:
+    return get_model_router().stream(task, prompt, template=template)
@@ -0,0 +1,89 @@
+import json
+import re
+from functools import lru_cache
+from typing import Any, List, Optional, Sequence, Tuple
+
+_MODEL_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+# Placeholder for the n-th (1-based) bind parameter in each connector paramstyle
+_PLACEHOLDERS = {
+    "pyformat": lambda n: "%s",
+    "format": lambda n: "%s",
+    "qmark": lambda n: "?",
+    "numeric": lambda n: f":{n}",
+}
+
+
+def connection_paramstyle(conn_sf) -> str:
+    """Paramstyle the connection was opened with (the connector's default is pyformat)."""
+    return getattr(conn_sf, "_paramstyle", None) or "pyformat"
+
+
+@lru_cache(maxsize=128)
+def completion_statement(model: str, messages: bool, paramstyle: str = "pyformat") -> str:
+    """SQL text of a COMPLETE call with the prompt (or message array) as a bind parameter.
+
+    The text depends only on (model, form, paramstyle), so it is built once and
+    reused; prompt content never touches it. The model name is validated, not
+    escaped, since it cannot be bound.
+    """
+    if not _MODEL_RE.match(model):
+        raise ValueError(f"Invalid Cortex model name: {model!r}")
+    if paramstyle not in _PLACEHOLDERS:
+        raise ValueError(f"Unsupported paramstyle: {paramstyle!r}")
+    placeholder = _PLACEHOLDERS[paramstyle](1)
+    if messages:
+        return (f"SELECT SNOWFLAKE.CORTEX.COMPLETE('{model}', PARSE_JSON({placeholder}), "
+                f"OBJECT_CONSTRUCT()) AS response")
+    return f"SELECT SNOWFLAKE.CORTEX.COMPLETE('{model}', {placeholder}) AS response"
+
+
+def build_completion(model: str, prompt: str, system: Optional[str] = None,
+                     paramstyle: str = "pyformat") -> Tuple[str, Tuple[Any, ...]]:
+    """Return `(sql, params)` for `cursor.execute`.
+
+    Without `system` the prompt is bound as a plain string. With it, the
+    system and user messages are bound as one JSON array and turned back into
+    an array server-side with PARSE_JSON.
+    """
+    if system is None:
+        return completion_statement(model, False, paramstyle), (prompt,)
+    messages = [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
+    return completion_statement(model, True, paramstyle), (json.dumps(messages),)
+
+
+@lru_cache(maxsize=128)
+def batch_completion_statement(model: str, messages: bool, n: int, paramstyle: str = "pyformat") -> str:
+    """One statement completing `n` bound prompts: COMPLETE over a VALUES list of (index, prompt)."""
+    completion_statement(model, messages, paramstyle)  # validates model and paramstyle
+    placeholder = _PLACEHOLDERS[paramstyle]
+    rows = ", ".join(f"({placeholder(2 * i + 1)}, {placeholder(2 * i + 2)})" for i in range(n))
+    if messages:
+        call = f"SNOWFLAKE.CORTEX.COMPLETE('{model}', PARSE_JSON(prompt), OBJECT_CONSTRUCT())"
+    else:
+        call = f"SNOWFLAKE.CORTEX.COMPLETE('{model}', prompt)"
+    return (f"SELECT idx, {call} AS response "
+            f"FROM (SELECT column1 AS idx, column2 AS prompt FROM VALUES {rows}) ORDER BY idx")
+
+
+def build_batch_completion(model: str, prompts: Sequence[str], system: Optional[str] = None,
+                           paramstyle: str = "pyformat") -> Tuple[str, Tuple[Any, ...]]:
+    """Return `(sql, params)` completing every prompt in one round trip; rows come back as (index, response)."""
+    params: List[Any] = []
+    for i, prompt in enumerate(prompts):
+        if system is not None:
+            prompt = json.dumps([{"role": "system", "content": system}, {"role": "user", "content": prompt}])
+        params.extend((i, prompt))
+    return batch_completion_statement(model, system is not None, len(prompts), paramstyle), tuple(params)
+
+
+def parse_completion(value: Any, messages: bool) -> str:
+    """Completion text from the RESPONSE column.
+
+    The message-array form (called with an options object) returns a JSON
+    document with the text under choices[0].messages.
+    """
+    if not messages or value is None:
+        return value
+    document = json.loads(value) if isinstance(value, str) else value
+    return document["choices"][0]["messages"]
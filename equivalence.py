@@ -0,0 +1,183 @@
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from query_stream import execute_stream
+
+MODES = ("server_hash", "streaming_hash", "sample")
+
+
+@dataclass
+class EquivalenceReport:
+    equivalent: bool
+    mode: str
+    original_rows: Optional[int] = None
+    optimized_rows: Optional[int] = None
+    detail: str = ""
+    # For "sample": fraction of rows compared and, at `confidence`, the largest
+    # number of differing rows that could have escaped the sample.
+    sample_rate: Optional[float] = None
+    confidence: Optional[float] = None
+    max_undetected_rows: Optional[int] = None
+
+
+_QUERY_ID_RE = re.compile(r"^[0-9a-fA-F-]{36}$")
+
+
+def _subquery(query: str) -> str:
+    # Closing paren on its own line, so a trailing `--` comment cannot swallow it
+    return f"(\n{query.strip().rstrip(';').strip()}\n)"
+
+
+def _source(query: str, query_id: Optional[str] = None) -> str:
+    """FROM-clause source for a query's rows: its persisted result when it already ran, else the query."""
+    if query_id and _QUERY_ID_RE.match(query_id):
+        return f"TABLE(RESULT_SCAN('{query_id}'))"
+    return _subquery(query)
+
+
+class ResultEquivalenceChecker:
+    """Compare the results of two queries without materializing them on the client.
+
+    Modes:
+    - server_hash: COUNT(*) and the order-insensitive HASH_AGG(*) computed in
+      the warehouse; two single-row queries.
+    - streaming_hash: results streamed batch by batch; each row is hashed and
+      the hashes are summed (mod 2**64) under two keys, so row order does not
+      matter and memory stays at one batch.
+    - sample: both sides keep the same deterministic subset of rows, chosen by
+      row hash, and the subsets are compared as multisets. Reports how many
+      differing rows could have gone unnoticed at the requested confidence.
+
+    With `query_ids` of runs that already finished (e.g. the validation
+    runs), server_hash and sample read those results with RESULT_SCAN
+    instead of executing the queries again.
+    """
+
+    def __init__(self, conn_sf, mode: str = "server_hash", sample_size: int = 10000, confidence: float = 0.95):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        self.conn_sf = conn_sf
+        self.mode = mode
+        self.sample_size = sample_size
+        self.confidence = confidence
+
+    def check(self, original_query: str, optimized_query: str, mode: Optional[str] = None,
+              query_ids: Optional[Tuple[Optional[str], Optional[str]]] = None) -> EquivalenceReport:
+        mode = mode or self.mode
+        if mode == "server_hash":
+            return self.server_hash(original_query, optimized_query, query_ids)
+        if mode == "streaming_hash":
+            return self.streaming_hash(original_query, optimized_query)
+        if mode == "sample":
+            return self.sample(original_query, optimized_query, query_ids)
+        raise ValueError(f"mode must be one of {MODES}")
+
+    def server_hash(self, original_query: str, optimized_query: str,
+                    query_ids: Optional[Tuple[Optional[str], Optional[str]]] = None) -> EquivalenceReport:
+        original_id, optimized_id = query_ids or (None, None)
+        original = self._count_and_hash(_source(original_query, original_id))
+        optimized = self._count_and_hash(_source(optimized_query, optimized_id))
+        return EquivalenceReport(
+            equivalent=original == optimized,
+            mode="server_hash",
+            original_rows=original[0],
+            optimized_rows=optimized[0],
+            detail="" if original == optimized else f"HASH_AGG {original[1]} != {optimized[1]}",
+        )
+
+    def streaming_hash(self, original_query: str, optimized_query: str) -> EquivalenceReport:
+        original = self._stream_digest(original_query)
+        optimized = self._stream_digest(optimized_query)
+        return EquivalenceReport(
+            equivalent=original == optimized,
+            mode="streaming_hash",
+            original_rows=original[0],
+            optimized_rows=optimized[0],
+            detail="" if original == optimized else "row multiset digests differ",
+        )
+
+    def sample(self, original_query: str, optimized_query: str,
+               query_ids: Optional[Tuple[Optional[str], Optional[str]]] = None) -> EquivalenceReport:
+        original_id, optimized_id = query_ids or (None, None)
+        original_source, optimized_source = _source(original_query, original_id), _source(optimized_query, optimized_id)
+        original_rows = self._count_and_hash(original_source)[0]
+        optimized_rows = self._count_and_hash(optimized_source)[0]
+        if original_rows != optimized_rows:
+            return EquivalenceReport(False, "sample", original_rows, optimized_rows, detail="row counts differ")
+        rate = min(1.0, self.sample_size / original_rows) if original_rows else 1.0
+        buckets = 1000000
+        threshold = int(rate * buckets)
+        original_sample = self._sampled_hashes(original_source, buckets, threshold)
+        optimized_sample = self._sampled_hashes(optimized_source, buckets, threshold)
+        equivalent = original_sample == optimized_sample
+        # Each differing row lands in the sample with probability `rate`, so D
+        # differing rows all escape with probability (1 - rate) ** D.
+        if rate >= 1.0:
+            max_undetected = 0
+        else:
+            max_undetected = math.ceil(math.log(1 - self.confidence) / math.log(1 - rate)) - 1
+        return EquivalenceReport(
+            equivalent=equivalent,
+            mode="sample",
+            original_rows=original_rows,
+            optimized_rows=optimized_rows,
+            detail=f"compared {sum(original_sample.values())} sampled rows",
+            sample_rate=rate,
+            confidence=self.confidence,
+            max_undetected_rows=max_undetected if equivalent else None,
+        )
+
+    def _count_and_hash(self, source: str) -> Tuple[int, Optional[int]]:
+        cursor = self.conn_sf.cursor()
+        try:
+            cursor.execute(f"SELECT COUNT(*), HASH_AGG(*) FROM {source}")
+            row_count, result_hash = cursor.fetchone()
+        finally:
+            cursor.close()
+        return int(row_count), result_hash
+
+    def _sampled_hashes(self, source: str, buckets: int, threshold: int) -> Counter:
+        cursor = self.conn_sf.cursor()
+        try:
+            cursor.execute(f"""
+            SELECT h FROM (SELECT HASH(*) AS h FROM {source})
+            WHERE MOD(ABS(h), {buckets}) < {threshold}
+            """)
+            sample: Counter = Counter()
+            while True:
+                rows = cursor.fetchmany(10000)
+                if not rows:
+                    return sample
+                sample.update(r[0] for r in rows)
+        finally:
+            cursor.close()
+
+    def _stream_digest(self, query: str) -> Tuple[int, int, int]:
+        rows = 0
+        digest_a = np.uint64(0)
+        digest_b = np.uint64(0)
+        for batch in execute_stream(self.conn_sf, query):
+            batch = _canonical(batch)
+            rows += len(batch)
+            with np.errstate(over="ignore"):
+                digest_a += pd.util.hash_pandas_object(batch, index=False).to_numpy().sum(dtype=np.uint64)
+                digest_b += pd.util.hash_pandas_object(batch, index=False, hash_key="optima-equiv-key").to_numpy().sum(dtype=np.uint64)
+        return rows, int(digest_a), int(digest_b)
+
+
+def _canonical(batch: pd.DataFrame) -> pd.DataFrame:
+    # Batches of the same column can arrive with different numeric dtypes
+    # (e.g. int8 vs int16 for NUMBER), so hash numbers as float64 and
+    # ignore column names, which rewrites often alias differently.
+    batch = batch.copy()
+    batch.columns = range(batch.shape[1])
+    for column in batch.columns:
+        if pd.api.types.is_numeric_dtype(batch[column]) and not pd.api.types.is_bool_dtype(batch[column]):
+            batch[column] = batch[column].astype("float64")
+    return batch
@@ -0,0 +1,195 @@
+import contextlib
+import json
+import re
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+_CANCEL_RE = re.compile(r"\s*SELECT\s+SYSTEM\$CANCEL_QUERY\('([^']+)'\)", re.IGNORECASE)
+
+# A responder maps (sql, params) to (column_names, rows).
+Responder = Callable[[str, Optional[Sequence[Any]]], Tuple[List[str], List[tuple]]]
+
+
+def cortex_response(sql: str, completion: str, params: Optional[Sequence[Any]] = None) -> Tuple[List[str], List[tuple]]:
+    """RESPONSE row(s) for a COMPLETE call.
+
+    The message-array form (with options) returns a JSON document, and a
+    batched `FROM VALUES` call returns one (IDX, RESPONSE) row per bound prompt.
+    """
+    if "OBJECT_CONSTRUCT(" in sql.upper():
+        completion = json.dumps({"choices": [{"messages": completion}], "model": "fake", "usage": {}})
+    if "FROM VALUES" in sql.upper():
+        return ["IDX", "RESPONSE"], [(idx, completion) for idx in list(params or [])[::2]]
+    return ["RESPONSE"], [(completion,)]
+
+
+def default_responder(sql: str, params: Optional[Sequence[Any]] = None) -> Tuple[List[str], List[tuple]]:
+    """Answer the handful of statements the app issues with canned rows."""
+    text = sql.upper()
+    if "CORTEX.COMPLETE" in text:
+        return cortex_response(sql, "SELECT 1", params)
+    return ["1"], [(1,)]
+
+
+class FakeCursor:
+    """Minimal stand-in for `snowflake.connector.cursor.SnowflakeCursor`."""
+
+    def __init__(self, connection: "FakeConnection"):
+        self.connection = connection
+        self.description = None
+        self.sfqid: Optional[str] = None
+        self.rowcount = -1
+        self._rows: List[tuple] = []
+        self._pos = 0
+
+    def execute(self, command: str, params: Optional[Sequence[Any]] = None, **kwargs):
+        if self.connection.is_closed():
+            raise RuntimeError("Connection is closed")
+        with self.connection._statement_lock:
+            if self.connection.query_latency:
+                time.sleep(self.connection.query_latency)
+            cancel = _CANCEL_RE.match(command)
+            if cancel:
+                self.connection._cancel(cancel.group(1))
+                columns, rows = ["STATUS"], [("query cancelled",)]
+            else:
+                columns, rows = self.connection.responder(command, params)
+            self.connection.executed.append(command)
+            self.sfqid = str(uuid.uuid4())
+            self.connection.queries[self.sfqid] = command
+        self._set_result(columns, rows)
+        return self
+
+    def execute_async(self, command: str, params: Optional[Sequence[Any]] = None, **kwargs):
+        """Start `command` in the background; it "runs" for `connection.duration(command)` seconds."""
+        if self.connection.is_closed():
+            raise RuntimeError("Connection is closed")
+        self.sfqid = str(uuid.uuid4())
+        self.connection._submit(self.sfqid, command, params)
+        return {"queryId": self.sfqid}
+
+    def get_results_from_sfqid(self, sfqid: str):
+        """Block until the async query finishes, then expose its rows on this cursor."""
+        job = self.connection._async[sfqid]
+        while self.connection.is_still_running(self.connection.get_query_status(sfqid)):
+            time.sleep(min(0.01, max(0.0, job["done_at"] - time.monotonic())))
+        if job["error"] is not None:
+            raise job["error"]
+        if job["cancelled"]:
+            raise RuntimeError(f"Query {sfqid} was cancelled")
+        self.sfqid = sfqid
+        self._set_result(*job["result"])
+
+    def _set_result(self, columns: List[str], rows: List[tuple]):
+        self.description = [(c, None, None, None, None, None, True) for c in columns]
+        self._rows = list(rows)
+        self._pos = 0
+        self.rowcount = len(self._rows)
+
+    def fetchone(self):
+        if self._pos >= len(self._rows):
+            return None
+        row = self._rows[self._pos]
+        self._pos += 1
+        return row
+
+    def fetchmany(self, size: int = 1):
+        rows = self._rows[self._pos:self._pos + size]
+        self._pos += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._rows[self._pos:]
+        self._pos = len(self._rows)
+        return rows
+
+    def close(self):
+        self._rows = []
+
+
+class FakeConnection:
+    """In-process connection with configurable per-query latency.
+
+    Async queries (`execute_async`) run for `async_duration` seconds, a
+    constant or a function of the SQL text, plus `query_latency`, and report
+    the connector's status names through `get_query_status`. With
+    `exclusive`, blocking statements run one at a time, like one session
+    shared between threads.
+    `queries` maps each query id to its SQL text.
+    """
+
+    def __init__(self, responder: Optional[Responder] = None, query_latency: float = 0.0,
+                 async_duration: Union[float, Callable[[str], float]] = 0.0, exclusive: bool = False):
+        self.responder = responder or default_responder
+        self.query_latency = query_latency
+        self.async_duration = async_duration
+        self.executed: List[str] = []
+        self.queries: Dict[str, str] = {}
+        self._statement_lock = threading.Lock() if exclusive else contextlib.nullcontext()
+        self._closed = False
+        self._async: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def duration(self, command: str) -> float:
+        # Async queries take `query_latency` too, like every other statement
+        base = self.async_duration(command) if callable(self.async_duration) else self.async_duration
+        return base + self.query_latency
+
+    def get_query_status(self, sfqid: str) -> str:
+        with self._lock:
+            job = self._async.get(sfqid)
+        if job is None:
+            return "NO_DATA"
+        if job["cancelled"]:
+            return "ABORTED"
+        if time.monotonic() < job["done_at"]:
+            return "RUNNING"
+        return "FAILED_WITH_ERROR" if job["error"] is not None else "SUCCESS"
+
+    def is_still_running(self, status: str) -> bool:
+        return status in ("RUNNING", "QUEUED", "RESUMING_WAREHOUSE", "QUEUED_REPARING_WAREHOUSE", "NO_DATA")
+
+    def is_an_error(self, status: str) -> bool:
+        return status in ("ABORTING", "FAILED_WITH_ERROR", "ABORTED", "FAILED_WITH_INCIDENT", "DISCONNECTED",
+                          "BLOCKED")
+
+    def _submit(self, sfqid: str, command: str, params: Optional[Sequence[Any]]):
+        # Answered once, at submission; responder errors surface as a failed query
+        result, error = None, None
+        try:
+            result = self.responder(command, params)
+        except Exception as e:
+            error = e
+        with self._lock:
+            self.executed.append(command)
+            self.queries[sfqid] = command
+            now = time.monotonic()
+            self._async[sfqid] = {"command": command, "params": params, "result": result, "error": error,
+                                  "cancelled": False, "submitted": now, "done_at": now + self.duration(command)}
+
+    def _cancel(self, sfqid: str):
+        with self._lock:
+            job = self._async.get(sfqid)
+            if job is not None and time.monotonic() < job["done_at"]:
+                job["cancelled"] = True
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def is_closed(self) -> bool:
+        return self._closed
+
+    def close(self):
+        self._closed = True
+
+
+def fake_connect(connect_latency: float = 0.0, query_latency: float = 0.0,
+                 responder: Optional[Responder] = None) -> Callable[[], FakeConnection]:
+    """Return a `connect()` replacement that simulates the login handshake."""
+    def connect(**kwargs) -> FakeConnection:
+        if connect_latency:
+            time.sleep(connect_latency)
+        return FakeConnection(responder=responder, query_latency=query_latency)
+    return connect
@@ -0,0 +1,79 @@
+import hashlib
+import re
+
+import pandas as pd
+
+# Strings/comments are matched together so quotes inside comments (and
+# comment markers inside strings) are handled correctly.
+_STRING_OR_COMMENT_RE = re.compile(
+    r"('(?:[^'\\]|\\.|'')*'|\$\$.*?\$\$)|--[^\n]*|//[^\n]*|/\*.*?\*/", re.DOTALL
+)
+_NUMBER_RE = re.compile(r"(?<![\w.$])[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?\b")
+_WHITESPACE_RE = re.compile(r"\s+")
+_PUNCT_SPACE_RE = re.compile(r" ?([(),=<>]) ?")
+_IN_LIST_RE = re.compile(r"\((?:\?,)+\?\)")
+_VALUES_LIST_RE = re.compile(r"(?:\(\?\),)+\(\?\)")
+
+
+def _literal(m: "re.Match") -> str:
+    return "?" if m.group(1) else " "
+
+
+def normalize_query(sql: str) -> str:
+    """Reduce a query to its shape: literals become `?`, comments and
+    formatting are dropped, and `IN (?, ?, ...)` lists collapse to `IN (?)`."""
+    text = _STRING_OR_COMMENT_RE.sub(_literal, sql)
+    text = _NUMBER_RE.sub("?", text)
+    text = _WHITESPACE_RE.sub(" ", text).strip().rstrip(";").strip().upper()
+    text = _PUNCT_SPACE_RE.sub(r"\1", text)
+    text = _IN_LIST_RE.sub("(?)", text)
+    return _VALUES_LIST_RE.sub("(?)", text)
+
+
+def fingerprint(sql: str) -> str:
+    """Stable 16-hex-digit hash of the normalized query shape."""
+    return hashlib.blake2b(normalize_query(sql).encode(), digest_size=8).hexdigest()
+
+
+def fingerprint_series(texts: pd.Series) -> pd.Series:
+    """Fingerprint a column of query texts, hashing each distinct text only once."""
+    codes, uniques = pd.factorize(texts, use_na_sentinel=False)
+    hashes = [fingerprint(t) if isinstance(t, str) else "" for t in uniques]
+    return pd.Series(pd.Index(hashes).take(codes), index=texts.index, name="FINGERPRINT")
+
+
+def rank_fingerprints(history: pd.DataFrame, top_n: int = 20, by: str = "TOTAL_ELAPSED_TIME") -> pd.DataFrame:
+    """Aggregate query history per fingerprint and return the `top_n` most expensive shapes.
+
+    `history` needs a QUERY_TEXT column plus the cost columns present among
+    TOTAL_ELAPSED_TIME, EXECUTION_TIME and BYTES_SCANNED; a precomputed
+    FINGERPRINT column is reused. Rows may already be aggregated (one per
+    server-side shape, with an EXECUTION_COUNT column), in which case the
+    counts are summed. The result has one row per fingerprint with
+    summed costs, EXECUTION_COUNT, and as QUERY_TEXT the single most expensive
+    instance of that shape (its representative), with that instance's QUERY_ID,
+    DATABASE_NAME and SCHEMA_NAME when the history has them.
+    """
+    history = history.copy()
+    history.columns = [c.upper() for c in history.columns]
+    by = by.upper()
+    if "FINGERPRINT" not in history.columns:
+        history["FINGERPRINT"] = fingerprint_series(history["QUERY_TEXT"])
+    cost_columns = [c for c in ("TOTAL_ELAPSED_TIME", "EXECUTION_TIME", "BYTES_SCANNED") if c in history.columns]
+    representatives = (
+        history.sort_values(by, ascending=False, kind="stable")
+        .drop_duplicates("FINGERPRINT")
+        .set_index("FINGERPRINT")
+    )
+    grouped = history.groupby("FINGERPRINT", sort=False)
+    ranked = grouped[cost_columns].sum()
+    if "EXECUTION_COUNT" in history.columns:
+        ranked["EXECUTION_COUNT"] = grouped["EXECUTION_COUNT"].sum()
+    else:
+        ranked["EXECUTION_COUNT"] = grouped.size()
+    ranked["QUERY_TEXT"] = representatives["QUERY_TEXT"]
+    for column in ("QUERY_ID", "DATABASE_NAME", "SCHEMA_NAME"):
+        if column in history.columns:
+            ranked[column] = representatives[column]
+    ranked = ranked.sort_values(by, ascending=False, kind="stable").head(top_n)
+    return ranked.reset_index()
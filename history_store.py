@@ -0,0 +1,146 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import pandas as pd
+
+from fingerprint import fingerprint_series, rank_fingerprints
+from query_stream import execute_stream
+
+HISTORY_COLUMNS = [
+    "QUERY_ID", "QUERY_TEXT", "QUERY_TYPE", "DATABASE_NAME", "SCHEMA_NAME", "USER_NAME", "WAREHOUSE_NAME",
+    "START_TIME", "END_TIME",
+    "TOTAL_ELAPSED_TIME", "EXECUTION_TIME", "BYTES_SCANNED", "PARTITIONS_SCANNED", "PARTITIONS_TOTAL",
+]
+
+# ACCOUNT_USAGE.QUERY_HISTORY can lag by up to 45 minutes; never advance the
+# high-water mark past rows that may still be arriving.
+ACCOUNT_USAGE_LATENCY = timedelta(minutes=45)
+
+
+def _stamp(window_start: datetime) -> str:
+    return window_start.strftime("%Y%m%dT%H%M%S")
+
+
+class HistoryStore:
+    """Local copy of ACCOUNT_USAGE.QUERY_HISTORY as Parquet files partitioned by day.
+
+    `ingest` pulls only rows newer than the stored high-water mark, in
+    time-windowed chunks, and advances the mark after every chunk so an
+    interrupted run resumes where it stopped. Parts are named after their
+    window, and a window's parts are cleared before it is written, so a
+    window interrupted before its mark moved is replaced rather than
+    duplicated on resume. Ranking and trend analysis then
+    run locally with pandas instead of rescanning the view each session.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.path.expanduser("~/.cache/optima/query_history")
+        os.makedirs(self.root, exist_ok=True)
+        self._state_path = os.path.join(self.root, "_state.json")
+
+    @property
+    def high_water_mark(self) -> Optional[datetime]:
+        if not os.path.exists(self._state_path):
+            return None
+        with open(self._state_path) as f:
+            return datetime.fromisoformat(json.load(f)["high_water_mark"])
+
+    def _set_high_water_mark(self, mark: datetime):
+        tmp = self._state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"high_water_mark": mark.isoformat()}, f)
+        os.replace(tmp, self._state_path)
+
+    def ingest(self, conn_sf, window: timedelta = timedelta(hours=6), lookback: timedelta = timedelta(days=7),
+               now: Optional[datetime] = None) -> int:
+        """Pull history newer than the high-water mark; return the number of rows written."""
+        now = now or datetime.now(timezone.utc)
+        until = now - ACCOUNT_USAGE_LATENCY
+        start = self.high_water_mark or (now - lookback)
+        written = 0
+        while start < until:
+            end = min(start + window, until)
+            query = f"""
+            SELECT {", ".join(HISTORY_COLUMNS)}
+            FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY
+            WHERE end_time >= '{start.isoformat()}'::TIMESTAMP_LTZ
+              AND end_time < '{end.isoformat()}'::TIMESTAMP_LTZ
+            """
+            self._clear_window(start)  # leftovers of an interrupted attempt at this window
+            for batch in execute_stream(conn_sf, query):
+                written += self._write(batch, start)
+            self._set_high_water_mark(end)
+            start = end
+        return written
+
+    def _clear_window(self, window_start: datetime):
+        prefix = f"part-{_stamp(window_start)}-"
+        for day in self.days():
+            directory = os.path.join(self.root, f"day={day}")
+            for name in os.listdir(directory):
+                if name.startswith(prefix):
+                    os.remove(os.path.join(directory, name))
+
+    def _write(self, batch: pd.DataFrame, window_start: datetime) -> int:
+        if batch.empty:
+            return 0
+        batch = batch.copy()
+        batch.columns = [c.upper() for c in batch.columns]
+        batch["END_TIME"] = pd.to_datetime(batch["END_TIME"], utc=True)
+        batch["START_TIME"] = pd.to_datetime(batch["START_TIME"], utc=True)
+        # Fingerprint once at ingest so every later ranking is a pure group-by
+        batch["FINGERPRINT"] = fingerprint_series(batch["QUERY_TEXT"])
+        stamp = _stamp(window_start)
+        for day, part in batch.groupby(batch["END_TIME"].dt.strftime("%Y-%m-%d")):
+            directory = os.path.join(self.root, f"day={day}")
+            os.makedirs(directory, exist_ok=True)
+            index = len(os.listdir(directory))
+            path = os.path.join(directory, f"part-{stamp}-{index:04d}.parquet")
+            # Written aside and renamed, so readers never see a torn file
+            part.to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+        return len(batch)
+
+    def days(self) -> List[str]:
+        return sorted(d[len("day="):] for d in os.listdir(self.root) if d.startswith("day="))
+
+    def load(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+             columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Read the partitions overlapping [start, end) and filter to that range."""
+        first = start.strftime("%Y-%m-%d") if start else None
+        last = end.strftime("%Y-%m-%d") if end else None
+        frames = []
+        for day in self.days():
+            if (first and day < first) or (last and day > last):
+                continue
+            directory = os.path.join(self.root, f"day={day}")
+            for name in sorted(n for n in os.listdir(directory) if n.endswith(".parquet")):
+                frames.append(pd.read_parquet(os.path.join(directory, name), columns=columns))
+        if not frames:
+            return pd.DataFrame(columns=columns or HISTORY_COLUMNS + ["FINGERPRINT"])
+        history = pd.concat(frames, ignore_index=True)
+        if "END_TIME" in history.columns:
+            if start is not None:
+                history = history[history["END_TIME"] >= pd.Timestamp(start)]
+            if end is not None:
+                history = history[history["END_TIME"] < pd.Timestamp(end)]
+        return history
+
+    def rank(self, start: Optional[datetime] = None, end: Optional[datetime] = None, top_n: int = 20,
+             by: str = "TOTAL_ELAPSED_TIME", query_type: Optional[str] = "SELECT") -> pd.DataFrame:
+        """Top query shapes by aggregated cost, computed entirely from the local store."""
+        history = self.load(start, end)
+        if query_type is not None:
+            history = history[history["QUERY_TYPE"] == query_type]
+        return rank_fingerprints(history, top_n=top_n, by=by)
+
+    def daily_trend(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    by: str = "TOTAL_ELAPSED_TIME") -> pd.DataFrame:
+        """Per-day cost and execution count for each fingerprint (fingerprints as columns)."""
+        history = self.load(start, end, columns=["FINGERPRINT", "END_TIME", by])
+        if history.empty:
+            return pd.DataFrame(index=pd.DatetimeIndex([], tz="UTC", name="DAY"))
+        history["DAY"] = history["END_TIME"].dt.floor("D")
+        return history.pivot_table(index="DAY", columns="FINGERPRINT", values=by, aggfunc="sum", fill_value=0)
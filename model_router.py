@@ -0,0 +1,123 @@
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from concurrency import CallTimeout
+from cortex_client import CortexClient
+from prompt_budget import context_window
+from tracing import span
+
+
+@dataclass
+class ModelPolicy:
+    """Models to try for a task, in order, and how long to wait on each before falling back."""
+    models: List[str]
+    timeout: Optional[float] = None
+
+
+# Small, fast models for linting and classification; large ones for rewrites.
+DEFAULT_POLICIES: Dict[str, ModelPolicy] = {
+    "check": ModelPolicy(["mistral-7b", "llama3-8b", "snowflake-arctic"], timeout=30.0),
+    "classify": ModelPolicy(["mistral-7b", "llama3-8b"], timeout=15.0),
+    "chat": ModelPolicy(["snowflake-arctic", "mixtral-8x7b"], timeout=60.0),
+    "plan": ModelPolicy(["llama3-70b", "llama2-70b-chat"], timeout=120.0),
+    "rewrite": ModelPolicy(["mistral-large", "llama3-70b", "llama2-70b-chat"], timeout=180.0),
+}
+
+
+class ModelRouter:
+    """Pick a Cortex model per task and fall back to the next one on error or timeout.
+
+    A timed-out COMPLETE statement is cancelled server-side (a timed-out
+    stream's response closed) and its session returned before the next model
+    is tried, so a slow call is never paid for twice. Batched calls get the
+    policy timeout once per prompt in the statement. `calls` counts
+    completions per model and `fallbacks` how often a task moved past its
+    first choice.
+    """
+
+    def __init__(self, client: CortexClient, policies: Optional[Dict[str, ModelPolicy]] = None):
+        self.client = client
+        self.policies = dict(DEFAULT_POLICIES)
+        self.policies.update(policies or {})
+        self.calls: Counter = Counter()
+        self.fallbacks: Counter = Counter()
+        self.last_model: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def policy(self, task: str) -> ModelPolicy:
+        if task not in self.policies:
+            raise KeyError(f"No model policy for task {task!r}; known tasks: {sorted(self.policies)}")
+        return self.policies[task]
+
+    def primary(self, task: str) -> str:
+        return self.policy(task).models[0]
+
+    def smallest(self, task: str) -> str:
+        """The task's model with the smallest context window; prompts sized for it fit every fallback."""
+        return min(self.policy(task).models, key=context_window)
+
+    def complete(self, task: str, prompt: str, system: Optional[str] = None,
+                 template: Optional[str] = None) -> str:
+        return self._with_fallback(
+            task, lambda model, timeout: self.client.complete(prompt, model=model, system=system, template=template,
+                                                              timeout=timeout))
+
+    def complete_batch(self, task: str, prompts: List[str], system: Optional[str] = None,
+                       template: Optional[str] = None, batch_size: int = 20) -> List[str]:
+        """Complete `prompts` in as few statements as possible; a failed batch is retried on the next model."""
+        if not prompts:
+            return []
+        return self._with_fallback(
+            task, lambda model, timeout: self.client.complete_batch(prompts, model=model, system=system,
+                                                                    template=template, batch_size=batch_size,
+                                                                    timeout=timeout),
+            prompts_per_statement=min(batch_size, len(prompts)))
+
+    def stream(self, task: str, prompt: str, system: Optional[str] = None,
+               template: Optional[str] = None) -> Iterator[str]:
+        """Stream from the first model that produces a chunk; once text is shown there is no fallback."""
+        policy = self.policy(task)
+        error: Optional[Exception] = None
+        for position, model in enumerate(policy.models):
+            # The client enforces the timeout itself, closing the response or cancelling the statement
+            chunks = self.client.stream(prompt, model=model, system=system, template=template,
+                                        timeout=policy.timeout)
+            try:
+                first = next(chunks, "")
+            except Exception as e:
+                chunks.close()  # returns the session to the pool before the next model starts
+                error = e
+                continue
+            self._record(task, model, position)
+            yield first
+            yield from chunks
+            return
+        raise RuntimeError(f"All models failed for task {task!r}") from error
+
+    def _with_fallback(self, task: str, call: Callable[[str, Optional[float]], Any], prompts_per_statement: int = 1):
+        policy = self.policy(task)
+        # The client cancels a statement that outlives this, so fallbacks never run alongside it
+        timeout = policy.timeout * prompts_per_statement if policy.timeout is not None else None
+        error: Optional[Exception] = None
+        with span(f"llm.{task}", task=task) as s:
+            for position, model in enumerate(policy.models):
+                try:
+                    result = call(model, timeout)
+                except Exception as e:
+                    error = e
+                    continue
+                self._record(task, model, position)
+                s.set(model=model, fallbacks=position)
+                return result
+        if isinstance(error, CallTimeout):
+            raise CallTimeout(f"All models timed out for task {task!r}") from error
+        raise RuntimeError(f"All models failed for task {task!r}") from error
+
+    def _record(self, task: str, model: str, position: int):
+        with self._lock:
+            self.calls[model] += 1
+            if position:
+                self.fallbacks[task] += 1
+            self.last_model = model
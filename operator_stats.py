@@ -0,0 +1,261 @@
+import json
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from tracing import span
+
+_QUERY_ID_RE = re.compile(r"^[0-9a-fA-F-]{36}$")
+
+# Thresholds for flagging an operator in the profile
+SPILL_BYTES = 1 << 20          # any real spill (>= 1 MiB) is worth mentioning
+POOR_PRUNING = 0.5             # scans that skip less than half the partitions...
+MIN_PRUNABLE_PARTITIONS = 100  # ...of a table with at least this many
+ROW_EXPLOSION = 2.0            # joins/flattens emitting more than twice their input rows
+
+
+@dataclass
+class OperatorStat:
+    """One row of GET_QUERY_OPERATOR_STATS, with the nested statistics flattened."""
+    query_id: str
+    step_id: int
+    operator_id: int
+    operator_type: str
+    parents: List[int] = field(default_factory=list)
+    time_share: float = 0.0  # fraction of the query's execution time
+    input_rows: int = 0
+    output_rows: int = 0
+    bytes_scanned: int = 0
+    bytes_spilled_local: int = 0
+    bytes_spilled_remote: int = 0
+    partitions_scanned: int = 0
+    partitions_total: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def bytes_spilled(self) -> int:
+        return self.bytes_spilled_local + self.bytes_spilled_remote
+
+    @property
+    def pruning_ratio(self) -> Optional[float]:
+        """Fraction of partitions skipped (None for operators that do not scan)."""
+        if not self.partitions_total:
+            return None
+        return 1 - self.partitions_scanned / self.partitions_total
+
+    @property
+    def row_explosion(self) -> Optional[float]:
+        """Output rows per input row (None without input rows)."""
+        if not self.input_rows:
+            return None
+        return self.output_rows / self.input_rows
+
+    @property
+    def label(self) -> str:
+        target = self.attributes.get("table_name") or self.attributes.get("equality_join_condition") \
+            or self.attributes.get("join_condition") or self.attributes.get("grouping_keys")
+        if isinstance(target, list):
+            target = ", ".join(map(str, target))
+        return f"{self.operator_type} #{self.operator_id}" + (f" [{target}]" if target else "")
+
+
+@dataclass
+class Hotspot:
+    operator: OperatorStat
+    issues: List[str]
+    score: float
+
+
+def _variant(value) -> Dict[str, Any]:
+    # VARIANT columns arrive as JSON text from the connector, or already decoded from fixtures
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return {}
+    if isinstance(value, str):
+        value = json.loads(value) if value.strip() else {}
+    return value if isinstance(value, (dict, list)) else {}
+
+
+def _int(value) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_operator_stats(rows: pd.DataFrame) -> List[OperatorStat]:
+    """Flatten GET_QUERY_OPERATOR_STATS rows (one query or several) into OperatorStats."""
+    rows = rows.copy()
+    rows.columns = [c.upper() for c in rows.columns]
+    operators = []
+    for row in rows.to_dict("records"):
+        stats = _variant(row.get("OPERATOR_STATISTICS"))
+        timing = _variant(row.get("EXECUTION_TIME_BREAKDOWN"))
+        pruning = stats.get("pruning", {})
+        spilling = stats.get("spilling", {})
+        io = stats.get("io", {})
+        parents = _variant(row.get("PARENT_OPERATORS")) or []
+        operators.append(OperatorStat(
+            query_id=str(row.get("QUERY_ID", "")),
+            step_id=_int(row.get("STEP_ID")),
+            operator_id=_int(row.get("OPERATOR_ID")),
+            operator_type=str(row.get("OPERATOR_TYPE", "")),
+            parents=[_int(p) for p in parents] if isinstance(parents, list) else [],
+            time_share=float(timing.get("overall_percentage", 0) or 0) / 100,
+            input_rows=_int(stats.get("input_rows")),
+            output_rows=_int(stats.get("output_rows")),
+            bytes_scanned=_int(io.get("bytes_scanned")),
+            bytes_spilled_local=_int(spilling.get("bytes_spilled_local_storage")),
+            bytes_spilled_remote=_int(spilling.get("bytes_spilled_remote_storage")),
+            partitions_scanned=_int(pruning.get("partitions_scanned")),
+            partitions_total=_int(pruning.get("partitions_total")),
+            attributes=_variant(row.get("OPERATOR_ATTRIBUTES")),
+        ))
+    return operators
+
+
+def operator_issues(op: OperatorStat) -> List[str]:
+    issues = []
+    if op.bytes_spilled >= SPILL_BYTES:
+        where = "remote storage" if op.bytes_spilled_remote else "local disk"
+        issues.append(f"spilled {_size(op.bytes_spilled)} to {where}")
+    ratio = op.pruning_ratio
+    if ratio is not None and ratio < POOR_PRUNING and op.partitions_total >= MIN_PRUNABLE_PARTITIONS:
+        issues.append(f"scanned {op.partitions_scanned}/{op.partitions_total} partitions ({ratio:.0%} pruned)")
+    explosion = op.row_explosion
+    if explosion is not None and explosion > ROW_EXPLOSION and op.operator_type in ("Join", "CartesianJoin", "Flatten"):
+        issues.append(f"rows {_count(op.input_rows)} -> {_count(op.output_rows)} ({explosion:.0f}x)")
+    return issues
+
+
+def rank_hotspots(operators: List[OperatorStat], top_n: int = 3, min_share: float = 0.05) -> List[Hotspot]:
+    """Operators worth a rewrite, most important first.
+
+    Time share dominates the score; spilling, poor pruning and row explosion
+    add to it, so an operator with a problem outranks an equally slow clean
+    one. Operators under `min_share` of the time are kept only if they have
+    an issue.
+    """
+    hotspots = []
+    for op in operators:
+        issues = operator_issues(op)
+        if op.time_share < min_share and not issues:
+            continue
+        score = op.time_share + 0.1 * len(issues)
+        hotspots.append(Hotspot(op, issues, score))
+    hotspots.sort(key=lambda h: (h.score, h.operator.time_share, h.operator.bytes_spilled), reverse=True)
+    return hotspots[:top_n]
+
+
+def profile_text(hotspots: List[Hotspot]) -> str:
+    """Compact operator profile for the optimization prompt."""
+    if not hotspots:
+        return ""
+    lines = ["Operator profile (share of execution time):"]
+    for i, h in enumerate(hotspots, 1):
+        op = h.operator
+        detail = "; ".join(h.issues) if h.issues else f"{_count(op.output_rows)} rows out"
+        lines.append(f"{i}. {op.label}: {op.time_share:.0%} - {detail}")
+    lines.append(f"Target the rewrite at {hotspots[0].operator.label} first.")
+    return "\n".join(lines)
+
+
+def _size(n: int) -> str:
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if n < 1024 or unit == "TB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def _count(n: int) -> str:
+    for unit, size in (("B", 10 ** 9), ("M", 10 ** 6), ("K", 10 ** 3)):
+        if n >= size:
+            return f"{n / size:.1f}{unit}"
+    return str(n)
+
+
+class OperatorStatsCache:
+    """LRU of parsed operator stats by query id; a finished query's profile never changes, so no TTL."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, List[OperatorStat]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query_id: str) -> Optional[List[OperatorStat]]:
+        with self._lock:
+            entry = self._entries.get(query_id)
+            if entry is not None:
+                self._entries.move_to_end(query_id)
+            return entry
+
+    def put(self, query_id: str, operators: List[OperatorStat]):
+        with self._lock:
+            self._entries[query_id] = operators
+            self._entries.move_to_end(query_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class OperatorStatsProvider:
+    """Fetch GET_QUERY_OPERATOR_STATS for many query ids, `batch_size` per statement.
+
+    Each batch is one UNION ALL over the table function. If a batch fails
+    (e.g. one id is older than 14 days or owned by another user) its ids are
+    retried one by one, and ids that still fail get an empty profile (not
+    cached, so a transient failure is retried next time).
+    """
+
+    def __init__(self, conn_sf, batch_size: int = 10, cache: Optional[OperatorStatsCache] = None):
+        self.conn_sf = conn_sf
+        self.batch_size = batch_size
+        self.cache = cache if cache is not None else default_operator_stats_cache
+        self.statements = 0
+
+    def get(self, query_ids: Iterable[str]) -> Dict[str, List[OperatorStat]]:
+        query_ids = [q for q in dict.fromkeys(query_ids) if q and _QUERY_ID_RE.match(q)]
+        found = {}
+        missing = []
+        for q in query_ids:
+            cached = self.cache.get(q)
+            if cached is not None:
+                found[q] = cached
+            else:
+                missing.append(q)
+        with span("snowflake.operator_stats", queries=len(query_ids), cache_hits=len(found)):
+            for start in range(0, len(missing), self.batch_size):
+                batch = missing[start:start + self.batch_size]
+                try:
+                    fetched = self._fetch(batch)
+                except Exception:
+                    fetched = {}
+                    for q in batch:
+                        try:
+                            fetched.update(self._fetch([q]))
+                        except Exception:
+                            fetched[q] = []
+                for q in batch:
+                    found[q] = fetched.get(q, [])
+                    if found[q]:
+                        self.cache.put(q, found[q])
+        return {q: found[q] for q in query_ids}
+
+    def hotspots(self, query_id: str, top_n: int = 3) -> List[Hotspot]:
+        return rank_hotspots(self.get([query_id]).get(query_id, []), top_n=top_n)
+
+    def _fetch(self, query_ids: List[str]) -> Dict[str, List[OperatorStat]]:
+        query = "\nUNION ALL\n".join(
+            f"SELECT * FROM TABLE(GET_QUERY_OPERATOR_STATS('{q}'))" for q in query_ids)
+        self.statements += 1
+        rows = pd.read_sql(query, self.conn_sf)
+        by_query: Dict[str, List[OperatorStat]] = {}
+        for op in parse_operator_stats(rows):
+            by_query.setdefault(op.query_id, []).append(op)
+        return by_query
+
+
+# Shared by every optimizer in the process; profiles of finished queries are immutable
+default_operator_stats_cache = OperatorStatsCache()
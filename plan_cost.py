@@ -0,0 +1,123 @@
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+
+@dataclass
+class PlanCost:
+    """Compiler estimates from `EXPLAIN USING JSON`; nothing is executed to get them."""
+    partitions_assigned: int = 0
+    partitions_total: int = 0
+    bytes_assigned: int = 0
+    operations: int = 0
+    joins: int = 0
+    cartesian_joins: int = 0
+    # Scanned objects in plan order (build side before probe side for each join)
+    join_order: List[str] = field(default_factory=list)
+    # Object -> (partitions assigned, bytes assigned)
+    table_scans: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+
+    @property
+    def pruning_ratio(self) -> float:
+        """Fraction of partitions skipped by pruning (1.0 = everything pruned)."""
+        if not self.partitions_total:
+            return 0.0
+        return 1 - self.partitions_assigned / self.partitions_total
+
+    def cost_key(self) -> Tuple[int, int, int, int]:
+        # Bytes dominate warehouse time; ties go to fewer partitions, fewer
+        # cartesian joins, then a smaller plan.
+        return self.bytes_assigned, self.partitions_assigned, self.cartesian_joins, self.operations
+
+
+@dataclass
+class PlanComparison:
+    original: Optional[PlanCost]
+    optimized: Optional[PlanCost]
+    accepted: bool
+    reason: str = ""
+
+    @property
+    def bytes_saved(self) -> Optional[int]:
+        if self.original is None or self.optimized is None:
+            return None
+        return self.original.bytes_assigned - self.optimized.bytes_assigned
+
+
+def parse_explain_json(content: Union[str, Dict[str, Any]]) -> PlanCost:
+    """Build a PlanCost from the JSON document returned by `EXPLAIN USING JSON`."""
+    plan = json.loads(content) if isinstance(content, str) else content
+    stats = plan.get("GlobalStats", {})
+    cost = PlanCost(
+        partitions_assigned=int(stats.get("partitionsAssigned", 0)),
+        partitions_total=int(stats.get("partitionsTotal", 0)),
+        bytes_assigned=int(stats.get("bytesAssigned", 0)),
+    )
+    # "Operations" is a list of plans (one per statement step), each a list of operators
+    for step in plan.get("Operations", []):
+        for op in sorted(step, key=lambda o: o.get("id", 0)):
+            cost.operations += 1
+            name = op.get("operation", "")
+            if name.endswith("Join") and name != "JoinFilter":
+                cost.joins += 1
+                if name == "CartesianJoin":
+                    cost.cartesian_joins += 1
+            elif name in ("TableScan", "ExternalScan"):
+                for obj in op.get("objects", []):
+                    cost.join_order.append(obj)
+                    partitions, size = cost.table_scans.get(obj, (0, 0))
+                    cost.table_scans[obj] = (partitions + int(op.get("partitionsAssigned", 0)),
+                                             size + int(op.get("bytesAssigned", 0)))
+    return cost
+
+
+def explain(conn_sf, query: str) -> PlanCost:
+    """Compile `query` with EXPLAIN USING JSON (no warehouse time) and parse the plan."""
+    cursor = conn_sf.cursor()
+    try:
+        cursor.execute(f"EXPLAIN USING JSON {query.strip().rstrip(';')}")
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return parse_explain_json(row[0])
+
+
+def compare_plans(original: PlanCost, optimized: PlanCost, min_improvement: float = 0.0) -> PlanComparison:
+    """Accept `optimized` only if its estimated cost is lower.
+
+    With `min_improvement` (e.g. 0.1), bytes must drop by at least that
+    fraction; otherwise any strict improvement of `PlanCost.cost_key` counts.
+    """
+    if optimized.cartesian_joins > original.cartesian_joins:
+        return PlanComparison(original, optimized, False, "rewrite introduces a cartesian join")
+    if min_improvement > 0:
+        target = original.bytes_assigned * (1 - min_improvement)
+        if optimized.bytes_assigned > target:
+            return PlanComparison(original, optimized, False,
+                                  f"bytes {optimized.bytes_assigned} > {target:.0f} ({min_improvement:.0%} below original)")
+        return PlanComparison(original, optimized, True, "estimated bytes reduced")
+    if optimized.cost_key() < original.cost_key():
+        return PlanComparison(original, optimized, True, "estimated cost reduced")
+    return PlanComparison(original, optimized, False,
+                          f"estimated cost not reduced ({optimized.bytes_assigned} vs {original.bytes_assigned} bytes, "
+                          f"{optimized.partitions_assigned} vs {original.partitions_assigned} partitions)")
+
+
+class PlanPrescreen:
+    """Reject rewrites whose compiled plan is not cheaper before any of them runs."""
+
+    def __init__(self, conn_sf, min_improvement: float = 0.0):
+        self.conn_sf = conn_sf
+        self.min_improvement = min_improvement
+
+    def check(self, original_query: str, optimized_query: str) -> PlanComparison:
+        try:
+            original = explain(self.conn_sf, original_query)
+        except Exception as e:
+            # Without a baseline plan there is nothing to screen against
+            return PlanComparison(None, None, True, f"original could not be explained: {e}")
+        try:
+            optimized = explain(self.conn_sf, optimized_query)
+        except Exception as e:
+            return PlanComparison(original, None, False, f"rewrite does not compile: {e}")
+        return compare_plans(original, optimized, self.min_improvement)
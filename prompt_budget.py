@@ -0,0 +1,166 @@
+from typing import Dict, Iterable, List, Optional, Set
+
+import pandas as pd
+
+from sql_parser import tokenize
+
+# Context windows (tokens) of the Cortex COMPLETE models used here
+CONTEXT_WINDOWS: Dict[str, int] = {
+    "snowflake-arctic": 4096,
+    "llama2-70b-chat": 4096,
+    "llama3-8b": 8000,
+    "llama3-70b": 8000,
+    "llama3.1-8b": 128000,
+    "llama3.1-70b": 128000,
+    "mistral-7b": 32000,
+    "mixtral-8x7b": 32000,
+    "mistral-large": 32000,
+    "gemma-7b": 8000,
+    "reka-flash": 100000,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# Average characters per token of each model family's tokenizer on SQL-heavy
+# English text; SentencePiece (Llama 2) splits SQL finer than tiktoken-style BPE.
+_CHARS_PER_TOKEN: Dict[str, float] = {
+    "llama2": 3.2,
+    "llama3": 3.8,
+    "mistral": 3.4,
+    "mixtral": 3.4,
+    "snowflake-arctic": 3.6,
+}
+_DEFAULT_CHARS_PER_TOKEN = 3.5
+
+
+def context_window(model: str) -> int:
+    return CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Estimate the token count of `text` for `model` (rounded up, so it errs on the safe side)."""
+    ratio = _DEFAULT_CHARS_PER_TOKEN
+    for prefix, chars in _CHARS_PER_TOKEN.items():
+        if model and model.startswith(prefix):
+            ratio = chars
+            break
+    return int(len(text) / ratio) + 1 if text else 0
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Cut `text` to about `max_tokens` tokens, marking the cut."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    marker = "\n... (truncated)"
+    keep = max(0, int(len(text) * max_tokens / count_tokens(text, model)) - len(marker))
+    return text[:keep] + marker
+
+
+def referenced_identifiers(query: str) -> Set[str]:
+    """Upper-cased identifiers in `query` (a superset of the columns it references)."""
+    identifiers = set()
+    for tok in tokenize(query):
+        if tok.kind == "ident":
+            identifiers.add(tok.upper)
+        elif tok.kind == "quoted":
+            identifiers.add(tok.value[1:-1].upper())
+    return identifiers
+
+
+def compact_schema(table: str, schema: pd.DataFrame, query: Optional[str] = None) -> str:
+    """One-line `table(col TYPE, ...)` summary of DESCRIBE output.
+
+    With `query`, only the columns the query mentions are kept and the rest
+    are counted; `SELECT *` keeps every column.
+    """
+    if not isinstance(schema, pd.DataFrame):
+        return f"{table}: {schema}"
+    lookup = {c.lower(): c for c in schema.columns}
+    names = schema[lookup.get("name", schema.columns[0])].astype(str)
+    types = schema[lookup["type"]].astype(str) if "type" in lookup else pd.Series([""] * len(schema), index=schema.index)
+    keep = pd.Series(True, index=schema.index)
+    if query is not None:
+        identifiers = referenced_identifiers(query)
+        if not any(t.value == "*" for t in tokenize(query)):
+            keep = names.str.upper().isin(identifiers)
+    columns = [f"{n} {t}".strip() for n, t in zip(names[keep], types[keep])]
+    omitted = int((~keep).sum())
+    if omitted:
+        columns.append(f"... {omitted} more columns")
+    return f"{table}({', '.join(columns)})"
+
+
+def summarize_frame(df: pd.DataFrame, sample_rows: int = 5, max_width: int = 60) -> str:
+    """Row/column counts plus the first `sample_rows` rows, instead of the whole result."""
+    sample = df.head(sample_rows).to_string(index=False, max_colwidth=max_width)
+    if len(df) <= sample_rows:
+        return f"{len(df)} rows x {df.shape[1]} columns:\n{sample}"
+    return f"{len(df)} rows x {df.shape[1]} columns (first {sample_rows} shown):\n{sample}"
+
+
+def trim_history(messages: List[Dict[str, str]], max_tokens: int, model: Optional[str] = None,
+                 summary_chars: int = 120) -> List[Dict[str, str]]:
+    """Keep the newest chat messages that fit `max_tokens`.
+
+    Older messages are replaced by a single message listing the start of each
+    earlier user request, so the model still knows what was already covered.
+    """
+    kept: List[Dict[str, str]] = []
+    used = 0
+    for message in reversed(messages):
+        tokens = count_tokens(message["content"], model)
+        if used + tokens > max_tokens:
+            break
+        kept.append(message)
+        used += tokens
+    kept.reverse()
+    dropped = messages[:len(messages) - len(kept)]
+    if not dropped:
+        return kept
+    asked = [m["content"][:summary_chars].replace("\n", " ") for m in dropped if m["role"] == "user"]
+    summary = f"(Earlier conversation: {len(dropped)} messages omitted."
+    if asked:
+        summary += " The user asked: " + "; ".join(asked)
+    summary = truncate_to_tokens(summary + ")", max(0, max_tokens - used), model)
+    # The summary must not push the history over budget; drop it rather than a real turn
+    if count_tokens(summary, model) + used > max_tokens:
+        return kept
+    return [{"role": "assistant", "content": summary}] + kept
+
+
+class PromptBudget:
+    """Token budget for one Cortex call.
+
+    `max_tokens` defaults to the model's context window minus
+    `reserve_for_output`; `take` charges text against it and `remaining`
+    is what is left for further context.
+    """
+
+    def __init__(self, model: str, max_tokens: Optional[int] = None, reserve_for_output: int = 1024):
+        self.model = model
+        self.max_tokens = max_tokens or max(0, context_window(model) - reserve_for_output)
+        self.used = 0
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.max_tokens - self.used)
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    def take(self, text: str, max_tokens: Optional[int] = None) -> str:
+        """Truncate `text` to what is left (and to `max_tokens`), charge it and return it."""
+        limit = self.remaining if max_tokens is None else min(self.remaining, max_tokens)
+        text = truncate_to_tokens(text, limit, self.model)
+        self.used += self.count(text)
+        return text
+
+    def fit_sections(self, sections: Iterable[str], separator: str = "\n") -> str:
+        """Add sections in order while they fit whole; stop at the first that does not."""
+        fitted = []
+        for section in sections:
+            tokens = self.count(section + separator)
+            if tokens > self.remaining:
+                break
+            fitted.append(section)
+            self.used += tokens
+        return separator.join(fitted)
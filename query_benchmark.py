@@ -0,0 +1,264 @@
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from fingerprint import fingerprint
+from query_jobs import SUCCEEDED, JobManager
+from query_metrics import QueryMetricsProvider
+
+# Warehouse credits per hour by size (standard warehouses)
+CREDITS_PER_HOUR = {
+    "X-SMALL": 1, "SMALL": 2, "MEDIUM": 4, "LARGE": 8, "X-LARGE": 16, "2X-LARGE": 32,
+    "3X-LARGE": 64, "4X-LARGE": 128, "5X-LARGE": 256, "6X-LARGE": 512,
+}
+
+RUN_COLUMNS = ["VARIANT", "ITERATION", "WARMUP", "QUERY_ID", "ELAPSED_MS", "EXECUTION_MS", "BYTES_SCANNED",
+               "PARTITIONS_SCANNED", "CREDITS", "SOURCE"]
+
+
+def estimate_credits(execution_ms: float, warehouse_size: Optional[str], cloud_services: float = 0.0) -> float:
+    """Warehouse credits attributable to one query: execution time at the warehouse's hourly rate."""
+    rate = CREDITS_PER_HOUR.get(str(warehouse_size or "").upper(), 0)
+    return execution_ms / 3600000 * rate + (cloud_services or 0.0)
+
+
+def bootstrap_ci(values: np.ndarray, stat: Callable[[np.ndarray], float] = np.median, confidence: float = 0.95,
+                 resamples: int = 2000, seed: int = 0) -> Tuple[float, float]:
+    """Percentile bootstrap confidence interval of `stat` over `values`."""
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        v = stat(values) if len(values) else float("nan")
+        return v, v
+    rng = np.random.default_rng(seed)
+    samples = rng.choice(values, size=(resamples, len(values)), replace=True)
+    stats = np.apply_along_axis(stat, 1, samples)
+    alpha = (1 - confidence) / 2
+    return float(np.quantile(stats, alpha)), float(np.quantile(stats, 1 - alpha))
+
+
+@dataclass
+class BenchmarkReport:
+    fingerprint: str
+    runs: pd.DataFrame     # one row per execution, warm-up runs flagged
+    summary: pd.DataFrame  # one row per variant over the measured runs
+    speedup: Optional[float] = None  # median original / median optimized execution time
+    speedup_ci: Optional[Tuple[float, float]] = None
+
+    def to_string(self) -> str:
+        text = self.summary.to_string()
+        if self.speedup is not None:
+            text += f"\nSpeedup (median execution time): {self.speedup:.2f}x"
+            if self.speedup_ci is not None:
+                text += f" (95% CI {self.speedup_ci[0]:.2f}x - {self.speedup_ci[1]:.2f}x)"
+        return text
+
+
+class QueryBenchmark:
+    """Repeated, cache-free timing of query variants.
+
+    Each variant runs `warmup + runs` times with USE_CACHED_RESULT = FALSE,
+    one query at a time, alternating the variant order each round so neither
+    always runs on a warmer warehouse. Warm-up rounds are dropped; the rest
+    are summarized as median/p95 with bootstrap confidence intervals of the
+    server-side EXECUTION_TIME (from QueryMetricsProvider), which leaves out
+    time spent queued or compiling. Benchmarks sharing a warehouse should
+    pass one `lock` (e.g. a multiprocessing.Lock across batch workers) so
+    only one of them runs at a time.
+
+    USE_CACHED_RESULT is a session parameter, so `conn_sf` should be a
+    connection of its own: on a shared one, other callers' queries would
+    skip the result cache while a benchmark runs. The session's previous
+    setting (SHOW PARAMETERS ... IN SESSION) is restored afterwards.
+    """
+
+    def __init__(self, conn_sf, runs: int = 5, warmup: int = 1, metrics: Optional[QueryMetricsProvider] = None,
+                 store: Optional["BenchmarkStore"] = None, run_timeout: Optional[float] = 1800.0,
+                 confidence: float = 0.95, jobs: Optional[JobManager] = None, lock=None):
+        self.conn_sf = conn_sf
+        self.runs = runs
+        self.warmup = warmup
+        self.metrics = metrics or QueryMetricsProvider(conn_sf)
+        self.store = store
+        self.run_timeout = run_timeout
+        self.confidence = confidence
+        self.jobs = jobs or JobManager(conn_sf, metrics=self.metrics)
+        self.lock = lock if lock is not None else contextlib.nullcontext()
+
+    def compare(self, original_query: str, optimized_query: str,
+                on_progress: Optional[Callable[[int, int], None]] = None) -> BenchmarkReport:
+        return self.run({"original": original_query, "optimized": optimized_query},
+                        key_query=original_query, on_progress=on_progress)
+
+    def run(self, variants: Dict[str, str], key_query: Optional[str] = None,
+            on_progress: Optional[Callable[[int, int], None]] = None) -> BenchmarkReport:
+        names = list(variants)
+        total = (self.warmup + self.runs) * len(names)
+        executed: List[Tuple[str, int, str]] = []
+        with self.lock:
+            previous = self._result_cache_setting()
+            self._set_result_cache("FALSE")
+            try:
+                for iteration in range(self.warmup + self.runs):
+                    order = names if iteration % 2 == 0 else names[::-1]
+                    for name in order:
+                        job = self.jobs.submit(variants[name], label=name, timeout=self.run_timeout)
+                        self.jobs.wait([job])
+                        if job.state != SUCCEEDED:
+                            raise RuntimeError(f"{name} run {iteration} {job.state}: {job.error}")
+                        executed.append((name, iteration, job.job_id))
+                        if on_progress is not None:
+                            on_progress(len(executed), total)
+            finally:
+                self._set_result_cache(previous)
+
+        runs = self._collect(executed)
+        summary = self._summarize(runs[~runs["WARMUP"]], names)
+        report = BenchmarkReport(fingerprint(key_query or variants[names[0]]), runs, summary)
+        if "original" in variants and "optimized" in variants:
+            measured = runs[~runs["WARMUP"]]
+            original = measured.loc[measured["VARIANT"] == "original", "EXECUTION_MS"].to_numpy(dtype=float)
+            optimized = measured.loc[measured["VARIANT"] == "optimized", "EXECUTION_MS"].to_numpy(dtype=float)
+            if len(original) and len(optimized) and np.median(optimized) > 0:
+                report.speedup = float(np.median(original) / np.median(optimized))
+                report.speedup_ci = _ratio_ci(original, optimized, self.confidence)
+        if self.store is not None:
+            self.store.save(report)
+        return report
+
+    def _result_cache_setting(self) -> Optional[str]:
+        """USE_CACHED_RESULT as set on this session ('TRUE'/'FALSE'), or None when it is inherited."""
+        cursor = self.conn_sf.cursor()
+        try:
+            cursor.execute("SHOW PARAMETERS LIKE 'USE_CACHED_RESULT' IN SESSION")
+            columns = [d[0].lower() for d in cursor.description or []]
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        if row is None or "value" not in columns or "level" not in columns:
+            return None
+        value, level = str(row[columns.index("value")]).upper(), str(row[columns.index("level")] or "").upper()
+        return value if level == "SESSION" and value in ("TRUE", "FALSE") else None
+
+    def _set_result_cache(self, value: Optional[str]):
+        cursor = self.conn_sf.cursor()
+        try:
+            if value is None:
+                cursor.execute("ALTER SESSION UNSET USE_CACHED_RESULT")
+            else:
+                cursor.execute(f"ALTER SESSION SET USE_CACHED_RESULT = {value}")
+        finally:
+            cursor.close()
+
+    def _collect(self, executed: List[Tuple[str, int, str]]) -> pd.DataFrame:
+        metrics = self.metrics.get([qid for _, _, qid in executed]).set_index("QUERY_ID")
+        rows = []
+        for name, iteration, qid in executed:
+            m = metrics.loc[qid]
+            execution_ms = m["EXECUTION_TIME"] if pd.notna(m["EXECUTION_TIME"]) else m["TOTAL_ELAPSED_TIME"]
+            rows.append({
+                "VARIANT": name, "ITERATION": iteration, "WARMUP": iteration < self.warmup, "QUERY_ID": qid,
+                "ELAPSED_MS": m["TOTAL_ELAPSED_TIME"], "EXECUTION_MS": execution_ms,
+                "BYTES_SCANNED": m["BYTES_SCANNED"], "PARTITIONS_SCANNED": m["PARTITIONS_SCANNED"],
+                "CREDITS": estimate_credits(execution_ms or 0.0, m["WAREHOUSE_SIZE"],
+                                            m["CREDITS_USED_CLOUD_SERVICES"] if pd.notna(m["CREDITS_USED_CLOUD_SERVICES"]) else 0.0),
+                "SOURCE": m["SOURCE"],
+            })
+        return pd.DataFrame(rows, columns=RUN_COLUMNS)
+
+    def _summarize(self, measured: pd.DataFrame, names: List[str]) -> pd.DataFrame:
+        rows = []
+        for name in names:
+            runs = measured[measured["VARIANT"] == name]
+            execution = runs["EXECUTION_MS"].to_numpy(dtype=float)
+            low, high = bootstrap_ci(execution, confidence=self.confidence)
+            rows.append({
+                "VARIANT": name, "RUNS": len(runs),
+                "MEDIAN_MS": float(np.median(execution)) if len(execution) else None,
+                "MEDIAN_CI_LOW_MS": low, "MEDIAN_CI_HIGH_MS": high,
+                "P95_MS": float(np.percentile(execution, 95)) if len(execution) else None,
+                "BYTES_SCANNED": runs["BYTES_SCANNED"].median(),
+                "PARTITIONS_SCANNED": runs["PARTITIONS_SCANNED"].median(),
+                "CREDITS_PER_RUN": runs["CREDITS"].mean(),
+            })
+        return pd.DataFrame(rows).set_index("VARIANT")
+
+
+def _ratio_ci(original: np.ndarray, optimized: np.ndarray, confidence: float, resamples: int = 2000,
+              seed: int = 0) -> Tuple[float, float]:
+    """Bootstrap CI of median(original) / median(optimized), resampling both sides independently."""
+    rng = np.random.default_rng(seed)
+    a = np.median(rng.choice(original, size=(resamples, len(original))), axis=1)
+    b = np.median(rng.choice(optimized, size=(resamples, len(optimized))), axis=1)
+    ratios = a / np.where(b > 0, b, np.nan)
+    alpha = (1 - confidence) / 2
+    return float(np.nanquantile(ratios, alpha)), float(np.nanquantile(ratios, 1 - alpha))
+
+
+class BenchmarkStore:
+    """SQLite log of benchmark runs, keyed by the original query's fingerprint, for regression tracking."""
+
+    def __init__(self, path: Optional[str] = None):
+        path = path or os.path.expanduser("~/.cache/optima/benchmarks.sqlite")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS benchmark_runs ("
+                " benchmark_id TEXT NOT NULL, fingerprint TEXT NOT NULL, recorded_at REAL NOT NULL,"
+                " variant TEXT NOT NULL, iteration INTEGER NOT NULL, warmup INTEGER NOT NULL, query_id TEXT,"
+                " elapsed_ms REAL, execution_ms REAL, bytes_scanned REAL, partitions_scanned REAL, credits REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS benchmark_runs_fp ON benchmark_runs (fingerprint, recorded_at)")
+
+    def save(self, report: BenchmarkReport) -> str:
+        benchmark_id = uuid.uuid4().hex
+        now = time.time()
+        rows = [(benchmark_id, report.fingerprint, now, r.VARIANT, int(r.ITERATION), int(r.WARMUP), r.QUERY_ID,
+                 _num(r.ELAPSED_MS), _num(r.EXECUTION_MS), _num(r.BYTES_SCANNED), _num(r.PARTITIONS_SCANNED),
+                 _num(r.CREDITS))
+                for r in report.runs.itertuples(index=False)]
+        with self._lock, self._db:
+            self._db.executemany("INSERT INTO benchmark_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return benchmark_id
+
+    def history(self, query_fingerprint: str, variant: Optional[str] = None) -> pd.DataFrame:
+        """Median execution time per benchmark (oldest first), measured runs only."""
+        sql = ("SELECT benchmark_id, variant, MIN(recorded_at) AS recorded_at, COUNT(*) AS runs, "
+               "AVG(COALESCE(execution_ms, elapsed_ms)) AS mean_ms, "
+               "GROUP_CONCAT(COALESCE(execution_ms, elapsed_ms)) AS execution "
+               "FROM benchmark_runs WHERE fingerprint = ? AND warmup = 0")
+        params: list = [query_fingerprint]
+        if variant is not None:
+            sql += " AND variant = ?"
+            params.append(variant)
+        sql += " GROUP BY benchmark_id, variant ORDER BY recorded_at"
+        with self._lock:
+            history = pd.read_sql_query(sql, self._db, params=params)
+        history["median_ms"] = [float(np.median([float(v) for v in e.split(",")])) if e else None
+                                for e in history.pop("execution")]
+        return history
+
+    def regression(self, query_fingerprint: str, variant: str = "optimized", tolerance: float = 0.1) -> Optional[dict]:
+        """Compare the latest benchmark's median with the best earlier one; flag slowdowns beyond `tolerance`."""
+        history = self.history(query_fingerprint, variant)
+        if len(history) < 2:
+            return None
+        latest = history.iloc[-1]["median_ms"]
+        baseline = history.iloc[:-1]["median_ms"].min()
+        return {"latest_ms": latest, "baseline_ms": baseline, "change": latest / baseline - 1 if baseline else None,
+                "regressed": bool(baseline and latest > baseline * (1 + tolerance))}
+
+
+def _num(value) -> Optional[float]:
+    return None if value is None or pd.isna(value) else float(value)
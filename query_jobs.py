@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+
+from query_metrics import QueryMetricsProvider
+from query_stream import QueryStream
+from tracing import span
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+TIMED_OUT = "timed_out"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED, TIMED_OUT)
+
+
+@dataclass
+class Job:
+    job_id: str  # the Snowflake query id
+    query: str
+    label: str = ""
+    state: str = QUEUED
+    submitted_at: float = 0.0
+    finished_at: Optional[float] = None
+    timeout: Optional[float] = None
+    error: str = ""
+
+    @property
+    def done(self) -> bool:
+        return self.state in FINISHED
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.time()) - self.submitted_at
+
+
+def _status_name(status) -> str:
+    return getattr(status, "name", str(status))
+
+
+class JobManager:
+    """Run queries asynchronously (`execute_async`) and track them by query id.
+
+    Submitting returns immediately; `poll` refreshes states with one
+    `get_query_status` per unfinished job, and `wait` polls with exponential
+    backoff until the jobs finish, cancelling any that pass their timeout
+    with SYSTEM$CANCEL_QUERY. With a `store_path`, job state is written to
+    JSON after every change so a new session (e.g. after a Streamlit rerun)
+    can pick up the same jobs; the queries keep running server-side. Without
+    one, `attach` picks a job up again from its query id alone.
+    """
+
+    def __init__(self, conn_sf, store_path: Optional[str] = None, poll_interval: float = 0.25,
+                 max_poll_interval: float = 5.0, backoff: float = 1.5,
+                 metrics: Optional[QueryMetricsProvider] = None):
+        self.conn_sf = conn_sf
+        self.store_path = store_path
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.metrics = metrics
+        self.jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        if store_path and os.path.exists(store_path):
+            with open(store_path) as f:
+                self.jobs = {j["job_id"]: Job(**j) for j in json.load(f)}
+
+    def submit(self, query: str, label: str = "", timeout: Optional[float] = None) -> Job:
+        with span("warehouse.submit", label=label) as s:
+            cursor = self.conn_sf.cursor()
+            try:
+                cursor.execute_async(query)
+                job = Job(cursor.sfqid, query, label, RUNNING, time.time(), timeout=timeout)
+            finally:
+                cursor.close()
+            s.set(query_id=job.job_id)
+        with self._lock:
+            self.jobs[job.job_id] = job
+        self._save()
+        return job
+
+    def submit_all(self, queries: Iterable[str], labels: Optional[Iterable[str]] = None,
+                   timeout: Optional[float] = None) -> List[Job]:
+        """Submit every query before waiting on any, so they run concurrently on the warehouse."""
+        queries = list(queries)
+        labels = list(labels) if labels is not None else [""] * len(queries)
+        return [self.submit(q, label, timeout) for q, label in zip(queries, labels)]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def attach(self, job_id: str, label: str = "", timeout: Optional[float] = None) -> Job:
+        """Track a query submitted earlier (e.g. in a previous Streamlit run) by its id, and poll it once.
+
+        The query text is not known; `timeout` counts from now.
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                job = self.jobs[job_id] = Job(job_id, "", label, RUNNING, time.time(), timeout=timeout)
+        self.poll([job])
+        return job
+
+    def poll(self, jobs: Optional[Iterable[Job]] = None) -> List[Job]:
+        """Refresh the state of unfinished jobs (all tracked jobs by default)."""
+        jobs = list(self.jobs.values()) if jobs is None else list(jobs)
+        changed = False
+        for job in jobs:
+            if job.done:
+                continue
+            try:
+                status = self.conn_sf.get_query_status(job.job_id)
+            except Exception as e:
+                self._finish(job, FAILED, str(e))
+                changed = True
+                continue
+            if self.conn_sf.is_still_running(status):
+                if job.timeout is not None and job.elapsed > job.timeout:
+                    self.cancel(job, state=TIMED_OUT)
+                continue
+            if self.conn_sf.is_an_error(status):
+                name = _status_name(status)
+                self._finish(job, CANCELLED if name in ("ABORTED", "ABORTING") else FAILED, name)
+            else:
+                self._finish(job, SUCCEEDED)
+            changed = True
+        if changed:
+            self._save()
+        return jobs
+
+    def wait(self, jobs: Iterable[Job], timeout: Optional[float] = None,
+             on_poll: Optional[Callable[[List[Job]], None]] = None) -> List[Job]:
+        """Poll with backoff until every job is finished (or `timeout` seconds pass).
+
+        `on_poll` is called with the jobs after every poll, e.g. to render progress.
+        """
+        jobs = list(jobs)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = self.poll_interval
+        with span("warehouse.wait", jobs=len(jobs), query_id=",".join(j.job_id for j in jobs)) as s:
+            polls = 0
+            while True:
+                self.poll(jobs)
+                polls += 1
+                if on_poll is not None:
+                    on_poll(jobs)
+                if all(j.done for j in jobs) or (deadline is not None and time.monotonic() >= deadline):
+                    s.set(polls=polls, states=",".join(j.state for j in jobs))
+                    return jobs
+                sleep = interval if deadline is None else min(interval, max(0.0, deadline - time.monotonic()))
+                time.sleep(sleep)
+                interval = min(interval * self.backoff, self.max_poll_interval)
+
+    def cancel(self, job: Job, state: str = CANCELLED):
+        cursor = self.conn_sf.cursor()
+        try:
+            cursor.execute(f"SELECT SYSTEM$CANCEL_QUERY('{job.job_id}')")
+        finally:
+            cursor.close()
+        self._finish(job, state, "timeout exceeded" if state == TIMED_OUT else "cancelled by user")
+        self._save()
+
+    def result(self, job: Job, max_rows: Optional[int] = None, max_bytes: Optional[int] = None) -> QueryStream:
+        """Stream a finished job's rows (blocks until the query is done if it is not)."""
+        if job.state in (FAILED, CANCELLED, TIMED_OUT):
+            raise RuntimeError(f"Job {job.job_id} {job.state}: {job.error}")
+        cursor = self.conn_sf.cursor()
+        cursor.get_results_from_sfqid(job.job_id)
+        return QueryStream(cursor, max_rows=max_rows, max_bytes=max_bytes)
+
+    def forget(self, finished_only: bool = True):
+        with self._lock:
+            self.jobs = {k: j for k, j in self.jobs.items() if finished_only and not j.done}
+        self._save()
+
+    def _finish(self, job: Job, state: str, error: str = ""):
+        job.state = state
+        job.error = error
+        job.finished_at = time.time()
+        if self.metrics is not None:
+            self.metrics.record_client_timing(job.job_id, job.elapsed)
+
+    def _save(self):
+        if not self.store_path:
+            return
+        with self._lock:
+            payload = [asdict(j) for j in self.jobs.values()]
+        directory = os.path.dirname(self.store_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = self.store_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(payload, f)
+        os.replace(tmp, self.store_path)
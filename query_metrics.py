@@ -0,0 +1,119 @@
+import logging
+import re
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+from snowflake.connector.errors import ProgrammingError
+
+from query_stream import execute_stream
+
+logger = logging.getLogger(__name__)
+
+METRIC_COLUMNS = ["QUERY_ID", "TOTAL_ELAPSED_TIME", "EXECUTION_TIME", "BYTES_SCANNED", "PARTITIONS_SCANNED",
+                  "PARTITIONS_TOTAL", "ROWS_PRODUCED", "WAREHOUSE_SIZE", "CREDITS_USED_CLOUD_SERVICES", "SOURCE"]
+
+# The INFORMATION_SCHEMA table functions have no partition counts; only the ACCOUNT_USAGE view does
+_COLUMNS = ["query_id", "total_elapsed_time", "execution_time", "bytes_scanned", "rows_produced", "warehouse_size",
+            "credits_used_cloud_services"]
+_ACCOUNT_USAGE_COLUMNS = _COLUMNS + ["partitions_scanned", "partitions_total"]
+
+_QUERY_ID_RE = re.compile(r"^[0-9a-fA-F-]{36}$")
+
+
+def _id_list(query_ids: Iterable[str]) -> str:
+    ids = [q for q in query_ids if _QUERY_ID_RE.match(q or "")]
+    return ", ".join(f"'{q}'" for q in ids)
+
+
+class QueryMetricsProvider:
+    """Look up timing and scan metrics for query ids without waiting on ACCOUNT_USAGE.
+
+    Lookups go, in order, to INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION()
+    (queries from this session, available immediately), INFORMATION_SCHEMA.QUERY_HISTORY()
+    (other sessions of this user, last 7 days) and finally the client-side
+    timings recorded with `record_client_timing`. Each tier is queried once for
+    the whole batch of ids. Ids answered only from client timings are kept
+    pending until `backfill` finds them in ACCOUNT_USAGE.QUERY_HISTORY.
+    Times are in milliseconds, like QUERY_HISTORY. PARTITIONS_SCANNED and
+    PARTITIONS_TOTAL come only from ACCOUNT_USAGE and are empty until then.
+    """
+
+    def __init__(self, conn_sf, result_limit: int = 10000):
+        self.conn_sf = conn_sf
+        self.result_limit = result_limit
+        self._server: Dict[str, dict] = {}
+        self._client: Dict[str, float] = {}
+        self._pending: set = set()
+        self._lock = threading.Lock()
+
+    def record_client_timing(self, query_id: Optional[str], elapsed_seconds: float):
+        """Remember the wall time the client observed for `query_id`."""
+        if query_id:
+            with self._lock:
+                self._client[query_id] = elapsed_seconds * 1000
+
+    def get(self, query_ids: Iterable[str]) -> pd.DataFrame:
+        """Return one row of metrics per query id (SOURCE says where it came from)."""
+        query_ids = [q for q in dict.fromkeys(query_ids) if q]
+        missing = [q for q in query_ids if q not in self._server]
+        for source, table in (
+            ("session", f"TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION(RESULT_LIMIT => {self.result_limit}))"),
+            ("information_schema", f"TABLE(INFORMATION_SCHEMA.QUERY_HISTORY(RESULT_LIMIT => {self.result_limit}))"),
+        ):
+            if not missing:
+                break
+            missing = self._fetch(table, missing, source, _COLUMNS)
+        rows = []
+        with self._lock:
+            for q in query_ids:
+                if q in self._server:
+                    rows.append(self._server[q])
+                elif q in self._client:
+                    self._pending.add(q)
+                    rows.append({"QUERY_ID": q, "TOTAL_ELAPSED_TIME": self._client[q], "SOURCE": "client"})
+                else:
+                    self._pending.add(q)
+                    rows.append({"QUERY_ID": q, "SOURCE": "missing"})
+        return pd.DataFrame(rows, columns=METRIC_COLUMNS)
+
+    def backfill(self) -> int:
+        """Replace client-side/missing metrics with ACCOUNT_USAGE rows once they land; return how many did."""
+        with self._lock:
+            pending = list(self._pending)
+        if not pending:
+            return 0
+        missing = self._fetch("SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY", pending, "account_usage",
+                              _ACCOUNT_USAGE_COLUMNS)
+        with self._lock:
+            self._pending = set(missing) | (self._pending - set(pending))
+        return len(pending) - len(missing)
+
+    @property
+    def pending(self) -> List[str]:
+        return sorted(self._pending)
+
+    def _fetch(self, table: str, query_ids: List[str], source: str, columns: List[str]) -> List[str]:
+        """Load metrics for `query_ids` from `table`; return the ids it did not have."""
+        id_list = _id_list(query_ids)
+        if not id_list:
+            return query_ids
+        query = f"""
+        SELECT {", ".join(columns)}
+        FROM {table}
+        WHERE query_id IN ({id_list})
+          AND execution_status NOT IN ('RUNNING', 'QUEUED', 'RESUMING_WAREHOUSE')
+        """
+        try:
+            found = execute_stream(self.conn_sf, query).to_pandas()
+        except ProgrammingError as e:
+            # E.g. no access to ACCOUNT_USAGE; the next tier (or the client timing) answers instead
+            logger.warning("Query metrics lookup in %s failed: %s", source, e)
+            return query_ids
+        found.columns = [c.upper() for c in found.columns]
+        with self._lock:
+            for row in found.to_dict("records"):
+                row["SOURCE"] = source
+                self._server[row["QUERY_ID"]] = row
+                self._pending.discard(row["QUERY_ID"])
+        return [q for q in query_ids if q not in self._server]
@@ -0,0 +1,112 @@
+import pandas as pd
+from typing import Any, Iterator, Optional, Union
+
+Batch = Union[pd.DataFrame, Any]  # pandas DataFrame or pyarrow Table/RecordBatch
+
+
+class QueryStream:
+    """A query executed exactly once, whose rows are consumed batch by batch.
+
+    The query id is available as soon as `execute_stream` returns. Rows are
+    only pulled from Snowflake while iterating, and iteration stops (marking
+    the stream `truncated`) once `max_rows` or `max_bytes` would be exceeded.
+    """
+
+    def __init__(self, cursor, max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+                 arrow: bool = False, batch_size: int = 10000):
+        self.cursor = cursor
+        self.query_id: Optional[str] = cursor.sfqid
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.arrow = arrow
+        self.batch_size = batch_size
+        self.rows_fetched = 0
+        self.bytes_fetched = 0
+        self.truncated = False
+        self._consumed = False
+
+    def __iter__(self) -> Iterator[Batch]:
+        if self._consumed:
+            raise RuntimeError("QueryStream can only be iterated once")
+        self._consumed = True
+        try:
+            for batch in self._raw_batches():
+                rows = _batch_rows(batch, self.arrow)
+                if self.max_rows is not None and self.rows_fetched + rows > self.max_rows:
+                    rows = self.max_rows - self.rows_fetched
+                    batch = batch.slice(0, rows) if self.arrow else batch.iloc[:rows]
+                    self.truncated = True
+                size = _batch_bytes(batch, self.arrow)
+                if self.max_bytes is not None and self.bytes_fetched + size > self.max_bytes:
+                    self.truncated = True
+                    break
+                self.rows_fetched += rows
+                self.bytes_fetched += size
+                if rows:
+                    yield batch
+                if self.truncated:
+                    break
+        finally:
+            self.close()
+
+    def to_pandas(self) -> pd.DataFrame:
+        """Concatenate the (capped) batches into a single DataFrame."""
+        frames = [b if not self.arrow else b.to_pandas() for b in self]
+        if not frames:
+            return pd.DataFrame(columns=self._columns())
+        return pd.concat(frames, ignore_index=True)
+
+    def close(self):
+        self.cursor.close()
+
+    def _columns(self):
+        return [d[0] for d in (self.cursor.description or [])]
+
+    def _raw_batches(self) -> Iterator[Batch]:
+        # Prefer the connector's native result-chunk iterators; fall back to
+        # DB-API fetchmany for cursors without them and for non-Arrow results
+        # (DESCRIBE, SHOW, ...), which the native iterators refuse.
+        native = None
+        try:
+            if self.arrow and hasattr(self.cursor, "fetch_arrow_batches"):
+                native = self.cursor.fetch_arrow_batches()
+            elif not self.arrow and hasattr(self.cursor, "fetch_pandas_batches"):
+                native = self.cursor.fetch_pandas_batches()
+        except Exception:
+            native = None
+        if native is not None:
+            yield from (b for b in native if b is not None)
+            return
+        columns = self._columns()
+        while True:
+            rows = self.cursor.fetchmany(self.batch_size)
+            if not rows:
+                return
+            frame = pd.DataFrame.from_records(rows, columns=columns)
+            if self.arrow:
+                import pyarrow as pa
+                yield pa.Table.from_pandas(frame, preserve_index=False)
+            else:
+                yield frame
+
+
+def execute_stream(conn_sf, query: str, max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+                   arrow: bool = False, batch_size: int = 10000) -> QueryStream:
+    """Execute `query` once and return a stream over its results."""
+    cursor = conn_sf.cursor()
+    try:
+        cursor.execute(query)
+    except Exception:
+        cursor.close()
+        raise
+    return QueryStream(cursor, max_rows=max_rows, max_bytes=max_bytes, arrow=arrow, batch_size=batch_size)
+
+
+def _batch_rows(batch: Batch, arrow: bool) -> int:
+    return batch.num_rows if arrow else len(batch)
+
+
+def _batch_bytes(batch: Batch, arrow: bool) -> int:
+    if arrow:
+        return batch.nbytes
+    return int(batch.memory_usage(index=False, deep=True).sum())
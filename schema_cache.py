@@ -0,0 +1,201 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from connection_manager import credential_key
+from tracing import span
+
+
+def _split_identifier(name: str) -> List[str]:
+    """Split `db.schema."Table"` on dots outside double quotes."""
+    parts, current, quoted = [], [], False
+    for ch in name.strip():
+        if ch == '"':
+            quoted = not quoted
+            current.append(ch)
+        elif ch == "." and not quoted:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(ch)
+    parts.append("".join(current).strip())
+    return parts
+
+
+def _normalize_part(part: str) -> str:
+    # Snowflake folds unquoted identifiers to upper case; quoted ones are kept verbatim
+    if len(part) >= 2 and part[0] == part[-1] == '"':
+        return part[1:-1].replace('""', '"')
+    return part.upper()
+
+
+def qualified_name(table: str, database: Optional[str] = None, schema: Optional[str] = None) -> str:
+    """Return the upper-cased `DATABASE.SCHEMA.TABLE` key for a (partially) qualified table name."""
+    parts = [_normalize_part(p) for p in _split_identifier(table)]
+    if len(parts) == 1 and schema:
+        parts.insert(0, _normalize_part(schema))
+    if len(parts) == 2 and database:
+        parts.insert(0, _normalize_part(database))
+    return ".".join(parts)
+
+
+def quote_identifier(part: str) -> str:
+    """Double-quote one identifier with Snowflake's case folding applied, so it is used verbatim."""
+    return '"' + _normalize_part(part).replace('"', '""') + '"'
+
+
+def _string_literal(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+def connection_scope(conn_sf) -> str:
+    """Who a connection sees tables as: a hash of its account, user and role."""
+    return credential_key(*(str(getattr(conn_sf, name, None) or "").upper() for name in ("account", "user", "role")))
+
+
+class SchemaCache:
+    """Thread-safe TTL + LRU cache of `DESCRIBE TABLE` results keyed by fully qualified name.
+
+    Keys are scoped by `connection_scope`, so a table described under one
+    account, user and role is never served to another whose role may not
+    see it, or to another account with the same names. Concurrent misses for the same table share one in-flight lookup. `warm`
+    fills the cache for a whole database/schema with one
+    INFORMATION_SCHEMA.COLUMNS query instead of one DESCRIBE per table.
+    """
+
+    def __init__(self, ttl: float = 3600.0, maxsize: int = 512):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, pd.DataFrame]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        with self._lock:
+            return self._get_locked(key)
+
+    def put(self, key: str, schema: pd.DataFrame):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, schema)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def key(self, conn_sf, table: str) -> str:
+        """Cache key of `table` as seen through `conn_sf`."""
+        name = qualified_name(table, getattr(conn_sf, "database", None), getattr(conn_sf, "schema", None))
+        return f"{connection_scope(conn_sf)}/{name}"
+
+    def invalidate(self, key: Optional[str] = None):
+        """Drop one table (a `key`), or everything when `key` is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def get_or_load(self, key: str, loader: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        with self._lock:
+            schema = self._get_locked(key)
+            if schema is not None:
+                return schema
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            schema = loader()
+        except Exception as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        self.put(key, schema)
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_result(schema)
+        return schema
+
+    def describe(self, conn_sf, table: str) -> pd.DataFrame:
+        """Return the DESCRIBE TABLE output for `table`, from cache when fresh."""
+        key = self.key(conn_sf, table)
+        def load() -> pd.DataFrame:
+            with span("snowflake.describe", table=key.split("/", 1)[1]) as s:
+                schema = pd.read_sql(f"DESCRIBE TABLE {table.strip()}", conn_sf)
+                s.set(columns=len(schema))
+                return schema
+
+        return self.get_or_load(key, load)
+
+    def warm(self, conn_sf, database: str, schema: Optional[str] = None) -> int:
+        """Load every table of `database` (optionally one `schema`) in a single query; return the table count."""
+        query = f"""
+        SELECT table_catalog, table_schema, table_name, column_name, data_type,
+               character_maximum_length, numeric_precision, numeric_scale,
+               is_nullable, column_default, comment
+        FROM {quote_identifier(database)}.INFORMATION_SCHEMA.COLUMNS
+        WHERE table_schema <> 'INFORMATION_SCHEMA'
+        """
+        if schema:
+            query += f"  AND table_schema = {_string_literal(_normalize_part(schema))}\n"
+        query += "ORDER BY table_catalog, table_schema, table_name, ordinal_position"
+        columns = pd.read_sql(query, conn_sf)
+        columns.columns = [c.upper() for c in columns.columns]
+        scope = connection_scope(conn_sf)
+        tables = 0
+        for (db, sch, tbl), group in columns.groupby(["TABLE_CATALOG", "TABLE_SCHEMA", "TABLE_NAME"], sort=False):
+            self.put(f"{scope}/{db}.{sch}.{tbl}", _describe_frame(group))
+            tables += 1
+        return tables
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate, "size": len(self._entries)}
+
+    def _get_locked(self, key: str) -> Optional[pd.DataFrame]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+
+def _column_type(row) -> str:
+    data_type = row["DATA_TYPE"]
+    if data_type in ("TEXT", "VARCHAR") and pd.notna(row["CHARACTER_MAXIMUM_LENGTH"]):
+        return f"VARCHAR({int(row['CHARACTER_MAXIMUM_LENGTH'])})"
+    if data_type == "NUMBER" and pd.notna(row["NUMERIC_PRECISION"]):
+        return f"NUMBER({int(row['NUMERIC_PRECISION'])},{int(row['NUMERIC_SCALE'])})"
+    return data_type
+
+
+def _describe_frame(columns: pd.DataFrame) -> pd.DataFrame:
+    # Shape INFORMATION_SCHEMA.COLUMNS rows like the leading DESCRIBE TABLE columns
+    return pd.DataFrame({
+        "name": columns["COLUMN_NAME"].values,
+        "type": [_column_type(row) for _, row in columns.iterrows()],
+        "kind": "COLUMN",
+        "null?": columns["IS_NULLABLE"].str[:1].values,
+        "default": columns["COLUMN_DEFAULT"].values,
+        "comment": columns["COMMENT"].values,
+    })
+
+
+# Shared by every tool in the process so repeated tables are described once per TTL (per account, user and role)
+default_schema_cache = SchemaCache()
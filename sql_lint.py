@@ -0,0 +1,321 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from sql_parser import Token, tokenize
+
+ERROR = "error"
+WARNING = "warning"
+INFO = "info"
+
+CORRECTNESS = "correctness"
+PERFORMANCE = "performance"
+
+# Functions that, wrapped around a filtered column, stop Snowflake from
+# pruning micro-partitions on that column's min/max metadata.
+_PRUNING_KILLERS = frozenset("""
+    DATE TO_DATE TRY_TO_DATE TO_TIMESTAMP TO_TIMESTAMP_NTZ TO_TIMESTAMP_LTZ TO_TIMESTAMP_TZ TO_CHAR TO_VARCHAR
+    TO_NUMBER TO_DECIMAL YEAR MONTH DAY DAYOFWEEK WEEK QUARTER HOUR DATE_TRUNC TRUNC DATE_PART EXTRACT
+    UPPER LOWER TRIM LTRIM RTRIM SUBSTR SUBSTRING LEFT RIGHT CAST TRY_CAST COALESCE NVL IFNULL
+""".split())
+_AGGREGATES = frozenset("COUNT SUM AVG MIN MAX COUNT_IF ANY_VALUE LISTAGG ARRAY_AGG MEDIAN APPROX_COUNT_DISTINCT".split())
+_COMPARISONS = frozenset("= < > <= >= <> != BETWEEN IN LIKE ILIKE".split())
+_CLAUSES = frozenset("SELECT FROM WHERE GROUP HAVING QUALIFY ORDER LIMIT FETCH OFFSET ON USING".split())
+_SET_OPERATORS = frozenset("UNION EXCEPT INTERSECT MINUS".split())
+# Constructs the rules do not model; queries using them go to Cortex
+_UNMODELLED = frozenset("PIVOT UNPIVOT MATCH_RECOGNIZE CONNECT RECURSIVE".split())
+_CASTS = frozenset("CAST TRY_CAST".split())
+_NUMERIC_TYPES = frozenset("INT INTEGER BIGINT SMALLINT TINYINT BYTEINT NUMBER NUMERIC DECIMAL FLOAT DOUBLE REAL".split())
+
+
+@dataclass
+class Finding:
+    rule: str
+    severity: str
+    category: str
+    message: str
+    suggestion: str = ""
+    snippet: str = ""
+
+
+@dataclass
+class LintReport:
+    findings: List[Finding] = field(default_factory=list)
+    # True when the rules cannot vouch for the query on their own
+    needs_llm: bool = False
+    reason: str = ""
+
+    @property
+    def correctness_findings(self) -> List[Finding]:
+        return [f for f in self.findings if f.category == CORRECTNESS]
+
+    def summary(self) -> str:
+        """Plain-text list of findings, e.g. as hints for a Cortex prompt."""
+        return "\n".join(f"- [{f.severity}] {f.message}" + (f" Suggestion: {f.suggestion}" if f.suggestion else "")
+                         for f in self.findings)
+
+
+class _Frame:
+    __slots__ = ("kind", "start", "clauses")
+
+    def __init__(self, kind: str, start: int):
+        self.kind = kind        # 'query', 'subquery', 'over', 'call', 'list'
+        self.start = start
+        self.clauses: dict = {}  # clause keyword -> first token index at this level
+
+
+def _snippet(tokens: List[Token], start: int, end: int) -> str:
+    return " ".join(t.value for t in tokens[max(0, start):end])
+
+
+def _frame_kind(tokens: List[Token], i: int) -> str:
+    nxt = tokens[i + 1].upper if i + 1 < len(tokens) else ""
+    prev = tokens[i - 1] if i > 0 else None
+    if nxt in ("SELECT", "WITH"):
+        return "subquery"
+    if prev is not None and prev.upper in ("OVER", "GROUP"):
+        return "over"
+    if prev is not None and (prev.kind in ("ident", "quoted") or prev.upper in ("LEFT", "RIGHT")):
+        return "call"
+    return "list"
+
+
+def _scan(tokens: List[Token]):
+    """Assign every token to its parenthesis frame; return (frame per token, frames, balanced)."""
+    frames = [_Frame("query", 0)]
+    stack = [0]
+    owner = [0] * len(tokens)
+    for i, tok in enumerate(tokens):
+        if tok.value == "(":
+            frames.append(_Frame(_frame_kind(tokens, i), i))
+            stack.append(len(frames) - 1)
+        elif tok.value == ")":
+            if len(stack) == 1:
+                return owner, frames, False
+            owner[i] = stack.pop()
+            continue
+        owner[i] = stack[-1]
+        if tok.kind == "keyword" and tok.upper in _CLAUSES:
+            frames[stack[-1]].clauses.setdefault(tok.upper, i)
+        elif tok.upper == "TOP" and i > 0 and tokens[i - 1].upper in ("SELECT", "DISTINCT"):
+            frames[stack[-1]].clauses.setdefault("LIMIT", i)
+    return owner, frames, len(stack) == 1
+
+
+def _clause_at(tokens: List[Token], owner: List[int], i: int) -> Optional[str]:
+    """Nearest clause keyword before `i` in the same frame."""
+    frame = owner[i]
+    for j in range(i - 1, -1, -1):
+        if owner[j] == frame and tokens[j].kind == "keyword" and tokens[j].upper in _CLAUSES | _SET_OPERATORS | {"JOIN"}:
+            return tokens[j].upper
+    return None
+
+
+def _close(tokens: List[Token], i: int) -> int:
+    """Index of the ')' matching the '(' at `i` (or len(tokens))."""
+    depth = 0
+    for j in range(i, len(tokens)):
+        if tokens[j].value == "(":
+            depth += 1
+        elif tokens[j].value == ")":
+            depth -= 1
+            if depth == 0:
+                return j
+    return len(tokens)
+
+
+def _cast_literal_mismatch(tokens: List[Token], i: int) -> Optional[Token]:
+    """For a CAST(... AS <number>) or `::<number>` at `i`, the non-numeric string literal it is compared with."""
+    n = len(tokens)
+    if tokens[i].value == "::":
+        type_at, end = i + 1, i + 1
+    else:
+        end = _close(tokens, i + 1)
+        type_at = next((j + 1 for j in range(end - 1, i, -1) if tokens[j].upper == "AS"), n)
+    if type_at >= n or tokens[type_at].upper not in _NUMERIC_TYPES:
+        return None
+    after = end + 1
+    if after + 1 < n and tokens[after].value == "(":  # NUMBER(10, 2)
+        after = _close(tokens, after) + 1
+    if after + 1 >= n or tokens[after].value not in _COMPARISONS:
+        return None
+    literal = tokens[after + 1]
+    if literal.kind != "string":
+        return None
+    try:
+        float(literal.value.strip("'").strip())
+    except ValueError:
+        return literal
+    return None
+
+
+def lint(sql: str) -> LintReport:
+    """Check `sql` against the local rule set; see `LintReport.needs_llm` for when to escalate."""
+    tokens = tokenize(sql)
+    report = LintReport()
+    if not tokens:
+        return report
+    add = report.findings.append
+    owner, frames, balanced = _scan(tokens)
+    if not balanced or any(t.kind == "string" and (len(t.value) < 2 or t.value[-1] not in "'$") for t in tokens):
+        report.needs_llm, report.reason = True, "unbalanced parentheses or unterminated literal"
+        return report
+    first = tokens[0].upper if tokens[0].value != "(" else tokens[1].upper if len(tokens) > 1 else ""
+    if first not in ("SELECT", "WITH"):
+        report.needs_llm, report.reason = True, "not a SELECT statement"
+        return report
+    unmodelled = sorted({t.upper for t in tokens if t.kind == "keyword" and t.upper in _UNMODELLED})
+    n = len(tokens)
+
+    for i, tok in enumerate(tokens):
+        u = tok.upper
+        prev = tokens[i - 1].upper if i else ""
+        nxt = tokens[i + 1].upper if i + 1 < n else ""
+
+        # Checked alongside the rules below, which also look at casts
+        literal = _cast_literal_mismatch(tokens, i) if (u in _CASTS and nxt == "(") or tok.value == "::" else None
+        if literal is not None:
+            add(Finding("cast_literal_mismatch", ERROR, CORRECTNESS,
+                        f"A value cast to a number is compared with the non-numeric string {literal.value}; "
+                        "the comparison fails at run time.",
+                        "Compare against a number, or cast to the type the literal has.",
+                        _snippet(tokens, i, min(i + 10, n))))
+
+        if tok.value == "*" and (prev in ("SELECT", "DISTINCT", ",") or (prev == "." and i > 2 and tokens[i - 3].upper in ("SELECT", "DISTINCT", ","))):
+            if _clause_at(tokens, owner, i) == "SELECT" and frames[owner[i]].kind in ("query", "subquery"):
+                add(Finding("select_star", WARNING, PERFORMANCE,
+                            "SELECT * reads every column; Snowflake storage is columnar, so unused columns still cost I/O.",
+                            "List only the columns the caller needs.", _snippet(tokens, i - 1, i + 1)))
+
+        elif u == "IN" and prev == "NOT" and nxt == "(":
+            end = _close(tokens, i + 1)
+            if i + 2 < n and tokens[i + 2].upper in ("SELECT", "WITH"):
+                add(Finding("not_in_subquery", ERROR, CORRECTNESS,
+                            "NOT IN (subquery) returns no rows at all if the subquery yields a NULL.",
+                            "Use NOT EXISTS (SELECT 1 FROM ... WHERE inner.col = outer.col), or filter NULLs in the subquery.",
+                            _snippet(tokens, i - 2, min(end + 1, i + 8))))
+            elif any(t.upper == "NULL" for t in tokens[i + 2:end]):
+                add(Finding("not_in_null", ERROR, CORRECTNESS,
+                            "NOT IN with a NULL in the list is never true, so the predicate filters out every row.",
+                            "Remove NULL from the list and add `OR col IS NULL` if NULLs should match.",
+                            _snippet(tokens, i - 2, end + 1)))
+
+        elif u == "UNION" and nxt != "ALL":
+            add(Finding("union_distinct", WARNING, CORRECTNESS,
+                        "UNION removes duplicates with an extra sort/aggregate; if the inputs cannot overlap or duplicates are wanted, UNION ALL is cheaper and may be what was meant.",
+                        "UNION ALL", _snippet(tokens, i - 1, i + 2)))
+
+        elif u == "BETWEEN":
+            j = i + 1
+            while j < n and tokens[j].upper != "AND":
+                j += 1
+            bound = tokens[j + 1] if j + 1 < n else None
+            if bound is not None and (bound.kind == "string" and any(c in bound.value for c in "-:/")
+                                      or bound.upper in ("CURRENT_DATE", "CURRENT_TIMESTAMP", "DATEADD", "TO_DATE", "DATE")):
+                column = tokens[i - 1].value if i else "col"
+                low = tokens[i + 1].value if i + 1 < n else "low"
+                add(Finding("between_inclusive", WARNING, CORRECTNESS,
+                            "BETWEEN includes its upper bound; on dates/timestamps that double-counts the boundary or drops the rest of the last day.",
+                            f"{column} >= {low} AND {column} < <exclusive upper bound>",
+                            _snippet(tokens, i - 1, j + 2)))
+
+        elif ((tok.kind == "ident" and u in _PRUNING_KILLERS) or u in ("LEFT", "RIGHT")) and nxt == "(" \
+                and prev in ("WHERE", "AND", "OR", "ON", "(", "NOT"):
+            end = _close(tokens, i + 1)
+            after = tokens[end + 1].upper if end + 1 < n else ""
+            clause = _clause_at(tokens, owner, i)
+            if after in _COMPARISONS and clause in ("WHERE", "ON", "JOIN") and any(
+                    t.kind in ("ident", "quoted") for t in tokens[i + 2:end]):
+                column = next(t.value for t in tokens[i + 2:end] if t.kind in ("ident", "quoted"))
+                add(Finding("function_on_filter_column", WARNING, PERFORMANCE,
+                            f"{tok.value}(...) around a filtered column prevents partition pruning on it.",
+                            f"Compare {column} itself against a range, e.g. {column} >= <start> AND {column} < <end>.",
+                            _snippet(tokens, i, min(end + 3, n))))
+
+        elif tok.value == "::" and i > 0 and tokens[i - 1].kind in ("ident", "quoted") \
+                and _clause_at(tokens, owner, i) == "WHERE" and i + 2 < n and tokens[i + 2].upper in _COMPARISONS:
+            add(Finding("function_on_filter_column", WARNING, PERFORMANCE,
+                        f"Casting {tokens[i - 1].value} in the filter prevents partition pruning on it.",
+                        "Cast the literal instead of the column.", _snippet(tokens, i - 1, i + 4)))
+
+        elif u == "CROSS" and nxt == "JOIN" and not (i + 2 < n and tokens[i + 2].upper in ("LATERAL", "TABLE")):
+            add(Finding("cartesian_join", WARNING, PERFORMANCE,
+                        "CROSS JOIN produces every combination of rows.",
+                        "Join with an ON condition unless the product is intended (e.g. a one-row table).",
+                        _snippet(tokens, i, i + 3)))
+
+        elif u == "JOIN" and prev not in ("CROSS", "NATURAL") and nxt not in ("LATERAL", "TABLE"):
+            frame = owner[i]
+            j = i + 1
+            while j < n and not (owner[j] == frame and (tokens[j].upper in ("ON", "USING", "JOIN", "MATCH_CONDITION")
+                                                       or tokens[j].upper in _CLAUSES or tokens[j].upper in _SET_OPERATORS
+                                                       or tokens[j].value in (")", ";"))):
+                j += 1
+            if j >= n or tokens[j].upper not in ("ON", "USING", "MATCH_CONDITION"):
+                add(Finding("cartesian_join", ERROR, CORRECTNESS,
+                            "JOIN without ON/USING is a cartesian product.",
+                            "Add the join condition, e.g. JOIN b ON a.key = b.key.", _snippet(tokens, i, j)))
+
+        elif u == "ON" and _clause_at(tokens, owner, i) == "JOIN":
+            frame = owner[i]
+            j = i + 1
+            while j < n and not (owner[j] == frame and (tokens[j].upper in _CLAUSES or tokens[j].upper in (
+                    "JOIN", "LEFT", "RIGHT", "INNER", "FULL", "CROSS", "NATURAL") or tokens[j].upper in _SET_OPERATORS
+                                                       or tokens[j].value in (")", ";", ","))):
+                j += 1
+            condition = tokens[i + 1:j]
+            if any(t.upper == "OR" for t in condition):
+                add(Finding("or_in_join", WARNING, PERFORMANCE,
+                            "OR in a join condition prevents a hash join and falls back to a nested loop.",
+                            "Split into UNION ALL of single-condition joins, or join on a derived key.",
+                            _snippet(tokens, i, j)))
+            for k in range(len(condition) - 6):
+                a, dot1, _, op, b, dot2 = condition[k:k + 6]
+                if dot1.value == "." and dot2.value == "." and op.value == "=" and a.upper == b.upper \
+                        and a.kind in ("ident", "quoted"):
+                    add(Finding("join_same_table", ERROR, CORRECTNESS,
+                                f"The join condition compares two columns of {a.value}; the joined table is not constrained.",
+                                "Compare a column of each joined table.", _snippet(tokens, i + 1 + k, i + 1 + k + 7)))
+
+        elif u == "ORDER" and nxt == "BY" and frames[owner[i]].kind == "subquery" \
+                and "LIMIT" not in frames[owner[i]].clauses and "FETCH" not in frames[owner[i]].clauses:
+            add(Finding("order_by_in_subquery", WARNING, PERFORMANCE,
+                        "ORDER BY inside a subquery without LIMIT is a wasted sort; the outer query does not keep the order.",
+                        "Remove it, or move it to the outermost query.", _snippet(tokens, i, i + 4)))
+
+        elif tok.value == "," and _clause_at(tokens, owner, i) == "FROM" \
+                and nxt not in ("LATERAL", "TABLE") and frames[owner[i]].kind in ("query", "subquery"):
+            frame = frames[owner[i]]
+            from_at = frame.clauses.get("FROM", -1)
+            where_at = next((j for j in range(i, n) if owner[j] == owner[i] and tokens[j].upper == "WHERE"), None)
+            if where_at is None:
+                add(Finding("cartesian_join", ERROR, CORRECTNESS,
+                            "Comma-separated tables with no WHERE clause form a cartesian product.",
+                            "Use JOIN ... ON with the join keys.", _snippet(tokens, from_at, i + 2)))
+            else:
+                add(Finding("implicit_join", INFO, PERFORMANCE,
+                            "Comma join: a missing predicate in WHERE silently becomes a cartesian product.",
+                            "Use explicit JOIN ... ON.", _snippet(tokens, from_at, i + 2)))
+
+    top = frames[0]
+    top_owner = [i for i in range(n) if owner[i] == 0]
+    has_aggregate = any(tokens[i].upper in _AGGREGATES and i + 1 < n and tokens[i + 1].value == "(" for i in top_owner)
+    if not any(c in top.clauses for c in ("LIMIT", "FETCH", "WHERE", "GROUP")) and not has_aggregate:
+        add(Finding("missing_limit", INFO, PERFORMANCE,
+                    "Unfiltered query without LIMIT returns (and may scan) the whole table.",
+                    "Add LIMIT while exploring, or a WHERE clause on a clustering/date column.", ""))
+
+    # Without the schema, types, argument counts and quoting cannot be checked, so
+    # escalating on every predicate or call would send (nearly) every query to
+    # Cortex. Escalate when a correctness rule fired, at any severity, or the
+    # query uses constructs the rules do not model.
+    if unmodelled:
+        report.needs_llm, report.reason = True, f"uses {', '.join(unmodelled)}"
+    elif any(f.category == CORRECTNESS and f.severity == ERROR for f in report.findings):
+        report.needs_llm, report.reason = True, "correctness errors need a rewrite"
+    elif report.correctness_findings:
+        report.needs_llm, report.reason = True, "correctness warnings need a second look"
+    return report
+
+
+def lint_many(queries: List[str]) -> List[LintReport]:
+    return [lint(q) for q in queries]
@@ -0,0 +1,239 @@
+import re
+from typing import List, NamedTuple, Optional, Set
+
+
+class Token(NamedTuple):
+    kind: str   # 'ident', 'quoted', 'keyword', 'string', 'number', 'punct', 'op', 'var'
+    value: str
+    upper: str  # upper-cased value for keyword/ident matching
+
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|//[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>'(?:[^'\\]|\\.|'')*(?:'|\Z)|\$\$.*?(?:\$\$|\Z))
+  | (?P<quoted>"(?:[^"]|"")*(?:"|\Z))
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<var>[@$][A-Za-z0-9_~/.%$]*|:(?!:)[A-Za-z0-9_~/.%$]*|\?)
+  | (?P<punct>[(),.;\[\]{}])
+  | (?P<op>::|\|\||<=|>=|<>|!=|=>|->>|->|[-+*/%<>=!|&^~])
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+KEYWORDS = frozenset("""
+    SELECT FROM WHERE GROUP BY HAVING QUALIFY ORDER LIMIT OFFSET FETCH UNION ALL EXCEPT INTERSECT MINUS
+    WITH RECURSIVE AS ON USING JOIN INNER LEFT RIGHT FULL OUTER CROSS NATURAL ASOF LATERAL TABLE
+    AND OR NOT IN IS NULL LIKE ILIKE RLIKE BETWEEN EXISTS CASE WHEN THEN ELSE END DISTINCT
+    INSERT INTO UPDATE DELETE MERGE SET VALUES WINDOW PARTITION OVER SAMPLE TABLESAMPLE AT BEFORE
+    CHANGES MATCH_RECOGNIZE PIVOT UNPIVOT CONNECT START TOP ANY SOME MATERIALIZED
+""".split())
+
+# Keywords that end a FROM list at the current nesting level
+_FROM_TERMINATORS = frozenset(
+    "WHERE GROUP HAVING QUALIFY ORDER LIMIT OFFSET FETCH UNION EXCEPT INTERSECT MINUS WINDOW "
+    "SELECT CONNECT START".split()
+)
+
+
+def tokenize(sql: str) -> List[Token]:
+    """Split SQL into tokens, dropping whitespace and comments."""
+    tokens = []
+    append = tokens.append
+    for m in _TOKEN_RE.finditer(sql):
+        kind = m.lastgroup
+        if kind == "ws" or kind == "comment":
+            continue
+        value = m.group()
+        if kind == "ident":
+            upper = value.upper()
+            append(Token("keyword" if upper in KEYWORDS else "ident", value, upper))
+        else:
+            append(Token(kind, value, value))
+    return tokens
+
+
+_PLAIN_IDENT_RE = re.compile(r"[A-Z_][A-Z0-9_$]*\Z")
+
+
+def normalize_identifier(part: str) -> str:
+    """Canonical SQL spelling of one identifier part: unquoted parts are upper-cased,
+    quoted parts stay quoted unless they are plain upper-case names."""
+    if len(part) >= 2 and part[0] == part[-1] == '"':
+        inner = part[1:-1]
+        if _PLAIN_IDENT_RE.match(inner) and inner.upper() not in KEYWORDS:
+            return inner
+        return part
+    return part.upper()
+
+
+def _read_name(tokens: List[Token], i: int):
+    """Read a dotted object name starting at `i`; return (parts, next index)."""
+    parts = [tokens[i].value]
+    i += 1
+    n = len(tokens)
+    while i + 1 < n and tokens[i].value == ".":
+        nxt = tokens[i + 1]
+        if nxt.value == ".":
+            # `db..table` addresses the PUBLIC schema
+            parts.append("PUBLIC")
+            i += 1
+        elif nxt.kind in ("ident", "quoted", "keyword"):
+            parts.append(nxt.value)
+            i += 2
+        else:
+            break
+    return parts, i
+
+
+def _cte_names(tokens: List[Token]) -> Set[str]:
+    names = set()
+    n = len(tokens)
+    for i, tok in enumerate(tokens):
+        if tok.upper != "WITH":
+            continue
+        j = i + 1
+        if j < n and tokens[j].upper == "RECURSIVE":
+            j += 1
+        while j < n and tokens[j].kind in ("ident", "quoted"):
+            name = tokens[j].value
+            j += 1
+            if j < n and tokens[j].value == "(":  # column list
+                j = _skip_parens(tokens, j)
+            if j >= n or tokens[j].upper != "AS":
+                break
+            j += 1
+            if j < n and tokens[j].upper == "NOT":
+                j += 1
+            if j < n and tokens[j].upper == "MATERIALIZED":
+                j += 1
+            if j >= n or tokens[j].value != "(":
+                break
+            names.add(normalize_identifier(name))
+            j = _skip_parens(tokens, j)
+            if j < n and tokens[j].value == ",":
+                j += 1
+            else:
+                break
+    return names
+
+
+def _skip_parens(tokens: List[Token], i: int) -> int:
+    """Given tokens[i] == '(', return the index just past its matching ')'."""
+    depth = 0
+    n = len(tokens)
+    while i < n:
+        v = tokens[i].value
+        if v == "(":
+            depth += 1
+        elif v == ")":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return n
+
+
+def extract_tables(sql: str, include_ctes: bool = False) -> List[str]:
+    """Return the distinct base tables referenced by `sql`, in order of first appearance.
+
+    CTE names, subqueries, table functions (`TABLE(...)`, `LATERAL FLATTEN(...)`,
+    `GENERATOR(...)`), stages and aliases are excluded. Names are normalized with
+    `normalize_identifier` so `sales`, `SALES` and `"SALES"` are one table.
+    """
+    return extract_tables_from_tokens(tokenize(sql), include_ctes)
+
+
+def extract_tables_from_tokens(tokens: List[Token], include_ctes: bool = False) -> List[str]:
+    ctes = set() if include_ctes else _cte_names(tokens)
+    tables: List[str] = []
+    seen = set()
+    # Per nesting level: whether it is a query (saw SELECT) and whether we are in its FROM list
+    is_query = [False]
+    in_from = [False]
+    expect_table = False
+    n = len(tokens)
+    i = 0
+    while i < n:
+        tok = tokens[i]
+        v = tok.value
+        if expect_table:
+            expect_table = False
+            if tok.upper in ("LATERAL", "TABLE") or tok.kind in ("var", "string"):
+                i += 1
+                continue
+            if tok.kind in ("ident", "quoted"):
+                parts, j = _read_name(tokens, i)
+                if j < n and tokens[j].value == "(":
+                    i = j  # table function such as FLATTEN(...) or GENERATOR(...)
+                    continue
+                name = ".".join(normalize_identifier(p) for p in parts)
+                if name and not (len(parts) == 1 and name in ctes) and name not in seen:
+                    seen.add(name)
+                    tables.append(name)
+                i = j
+                continue
+        if v == "(":
+            is_query.append(False)
+            in_from.append(False)
+            # `FROM (` / `JOIN (` may open a parenthesized join: tables follow directly
+            if i > 0 and tokens[i - 1].upper in ("FROM", "JOIN") and i + 1 < n and tokens[i + 1].kind in ("ident", "quoted"):
+                is_query[-1] = True
+                in_from[-1] = True
+                expect_table = True
+        elif v == ")":
+            if len(is_query) > 1:
+                is_query.pop()
+                in_from.pop()
+        elif tok.kind == "keyword":
+            u = tok.upper
+            if u == "SELECT":
+                is_query[-1] = True
+                in_from[-1] = False
+            elif u == "FROM" and is_query[-1] and tokens[i - 1].upper != "DISTINCT":
+                in_from[-1] = True
+                expect_table = True
+            elif u == "JOIN" and in_from[-1]:
+                expect_table = True
+            elif u in _FROM_TERMINATORS:
+                in_from[-1] = False
+        elif v == "," and in_from[-1]:
+            expect_table = True
+        i += 1
+    return tables
+
+
+# Statements that write; none may appear anywhere in a read-only query
+_WRITE_KEYWORDS = frozenset("INSERT UPDATE DELETE MERGE".split())
+# SYSTEM$ functions can cancel queries, abort sessions or change state, so only these inspection ones may be called
+_READ_ONLY_SYSTEM_FUNCTIONS = frozenset("""
+    SYSTEM$CLUSTERING_DEPTH SYSTEM$CLUSTERING_INFORMATION SYSTEM$EXPLAIN_PLAN_JSON
+    SYSTEM$ESTIMATE_SEARCH_OPTIMIZATION_COSTS SYSTEM$TYPEOF
+""".split())
+
+
+def read_only_error(sql: str) -> Optional[str]:
+    """Why `sql` is not a single read-only SELECT/WITH statement, or None when it is."""
+    tokens = tokenize(sql)
+    while tokens and tokens[-1].value == ";":
+        tokens.pop()
+    if not tokens:
+        return "empty query"
+    if any(t.value == ";" for t in tokens):
+        return "only a single statement is allowed"
+    first = next((t.upper for t in tokens if t.value != "("), "")
+    if first not in ("SELECT", "WITH"):
+        return f"only SELECT/WITH queries are allowed, not {first or tokens[0].value}"
+    writes = sorted({t.upper for t in tokens if t.kind == "keyword" and t.upper in _WRITE_KEYWORDS})
+    if writes:
+        return f"query contains {', '.join(writes)}"
+    calls = sorted({
+        normalize_identifier(t.value) for t, nxt in zip(tokens, tokens[1:])
+        if t.kind in ("ident", "quoted") and nxt.value == "("
+    })
+    system_calls = [c for c in calls if c.strip('"').upper().startswith("SYSTEM$")
+                    and c not in _READ_ONLY_SYSTEM_FUNCTIONS]
+    if system_calls:
+        return f"query calls {', '.join(system_calls)}"
+    return None
+
@@ -0,0 +1,46 @@
+"""Table versions are read where each query ran, and an unknown version never lets a query be reused."""
+import pandas as pd
+
+from analysis_ledger import AnalysisLedger, LedgerDecision
+from fake_snowflake import FakeConnection
+
+VERSION_COLUMNS = ["TABLE_SCHEMA", "TABLE_NAME", "LAST_ALTERED", "ROW_COUNT", "COLUMN_HASH"]
+
+
+def _warehouse():
+    def responder(sql, params=None):
+        if '"ANALYTICS".INFORMATION_SCHEMA.TABLES' in sql:
+            return VERSION_COLUMNS, [("PUBLIC", "SALES", "2024-01-31 02:00:00", 100, "1")]
+        return VERSION_COLUMNS, []
+
+    con = FakeConnection(responder=responder)
+    # The optimizer's own session points at ACCOUNT_USAGE, not where the queries ran
+    con.database, con.schema = "SNOWFLAKE", "ACCOUNT_USAGE"
+    return con
+
+
+def _ranked(database, schema):
+    return pd.DataFrame([{"FINGERPRINT": "fp", "QUERY_TEXT": "SELECT * FROM sales", "TOTAL_ELAPSED_TIME": 100.0,
+                          "EXECUTION_COUNT": 1, "DATABASE_NAME": database, "SCHEMA_NAME": schema}])
+
+
+def _analyze_then_rerun(tmp_path, database, schema) -> LedgerDecision:
+    con, ledger = _warehouse(), AnalysisLedger(str(tmp_path / "ledger.sqlite"))
+    _, decisions = ledger.partition(con, _ranked(database, schema))
+    ledger.record(decisions["fp"], {"status": "verified"})
+    _, decisions = ledger.partition(con, _ranked(database, schema))
+    return decisions["fp"]
+
+
+def test_unqualified_tables_resolve_against_the_query_history_context(tmp_path):
+    decision = _analyze_then_rerun(tmp_path, "ANALYTICS", "PUBLIC")
+    assert list(decision.tables) == ["ANALYTICS.PUBLIC.SALES"]
+    assert decision.tables["ANALYTICS.PUBLIC.SALES"] is not None
+    assert decision.reuse
+
+
+def test_unresolved_tables_count_as_changed(tmp_path):
+    decision = _analyze_then_rerun(tmp_path, None, None)
+    assert decision.tables == {"SALES": None}
+    assert decision.reason == "tables_changed"
+    assert not decision.reuse
@@ -0,0 +1,10 @@
+from completion_cache import cache_key
+
+
+def test_cache_key_trims_surrounding_whitespace():
+    assert cache_key("m", "  SELECT 1\n") == cache_key("m", "SELECT 1")
+
+
+def test_cache_key_keeps_whitespace_inside_literals():
+    assert cache_key("m", "SELECT * FROM t WHERE s = 'a  b'") != cache_key("m", "SELECT * FROM t WHERE s = 'a b'")
+    assert cache_key("m", 'SELECT "my  col" FROM t') != cache_key("m", 'SELECT "my col" FROM t')
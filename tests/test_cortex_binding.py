@@ -0,0 +1,41 @@
+"""Fuzz the bound COMPLETE request: arbitrary prompts must round-trip and never reach the SQL text."""
+import json
+import random
+
+import pytest
+
+from cortex_client import CortexClient
+from fake_snowflake import FakeConnection, cortex_response
+
+ALPHABET = ["'", "''", '"', "\\", "\\'", "$$", "%s", "%", "?", ":1", "{}", "{{'role'}}", ";", "--", "/*", "*/",
+            "\n", "\r\n", "\t", "\x00", "é", "日本", "🙂", "NULL", "') ; DROP TABLE t; --", " ", "a", "SELECT"]
+
+
+def _random_text(rng: random.Random, max_parts: int) -> str:
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, max_parts)))
+
+
+@pytest.mark.parametrize("paramstyle", ["pyformat", "qmark", "numeric"])
+def test_prompts_round_trip_without_reaching_sql(paramstyle):
+    rng = random.Random(paramstyle)
+    statements = set()
+
+    def echo(sql, params=None):
+        statements.add(sql)
+        if "OBJECT_CONSTRUCT(" in sql:
+            return cortex_response(sql, json.loads(params[0])[1]["content"])
+        return cortex_response(sql, params[0])
+
+    failures = []
+    for i in range(700):
+        prompt = _random_text(rng, 40)
+        system = _random_text(rng, 10) if i % 2 else None
+        con = FakeConnection(responder=echo)
+        con._paramstyle = paramstyle
+        completion = CortexClient.for_connection(con).complete(prompt, system=system)
+        if completion != prompt:
+            failures.append((prompt, system, completion))
+
+    assert failures == []
+    leaked = [sql for sql in statements if "DROP TABLE" in sql or "🙂" in sql]
+    assert leaked == []
@@ -0,0 +1,72 @@
+"""A timed-out COMPLETE is cancelled before the router falls back to the next model."""
+from cortex_client import CortexClient
+from fake_snowflake import FakeConnection
+from model_router import ModelPolicy, ModelRouter
+
+
+def _router(con, timeout):
+    return ModelRouter(CortexClient.for_connection(con),
+                       {"rewrite": ModelPolicy(["slow-model", "fast-model"], timeout=timeout)})
+
+
+def test_timed_out_statement_is_cancelled_before_fallback():
+    con = FakeConnection(async_duration=lambda sql: 5.0 if "slow-model" in sql else 0.0)
+    router = _router(con, timeout=0.2)
+
+    assert router.complete("rewrite", "tune this") == "SELECT 1"
+    assert router.last_model == "fast-model"
+    slow = [qid for qid, sql in con.queries.items() if "slow-model" in sql and "CANCEL" not in sql]
+    assert len(slow) == 1
+    assert con.get_query_status(slow[0]) == "ABORTED"
+    assert any(f"SYSTEM$CANCEL_QUERY('{slow[0]}')" in sql for sql in con.executed)
+
+
+def test_batch_timeout_scales_with_prompts_per_statement():
+    # Each prompt may take the policy timeout; four in one statement get four times as long
+    con = FakeConnection(async_duration=lambda sql: 0.5 if "slow-model" in sql else 0.0)
+    router = _router(con, timeout=0.2)
+
+    assert router.complete_batch("rewrite", ["a", "b", "c", "d"], batch_size=4) == ["SELECT 1"] * 4
+    assert router.last_model == "slow-model"
+    assert not any("CANCEL_QUERY" in sql for sql in con.executed)
+
+
+def _single_session_router(con, timeout):
+    # One session and a short acquire timeout: a leaked lease would fail the fallback
+    client = CortexClient(lambda: con, pool_size=1, owns_connections=False, acquire_timeout=0.5)
+    return ModelRouter(client, {"rewrite": ModelPolicy(["slow-model", "fast-model"], timeout=timeout)})
+
+
+def test_stream_timeout_cancels_the_statement_and_returns_the_lease():
+    con = FakeConnection(async_duration=lambda sql: 5.0 if "slow-model" in sql else 0.0)
+    router = _single_session_router(con, timeout=0.2)
+
+    assert "".join(router.stream("rewrite", "tune this")) == "SELECT 1"
+    assert router.last_model == "fast-model"
+    slow = [qid for qid, sql in con.queries.items() if "slow-model" in sql and "CANCEL" not in sql]
+    assert con.get_query_status(slow[0]) == "ABORTED"
+    with router.client.session():
+        pass
+
+
+def test_rest_stream_read_timeout_returns_the_lease(monkeypatch):
+    import requests
+    from urllib3.exceptions import ReadTimeoutError
+
+    import cortex_client
+
+    def stream_rest(host, token, model, messages, timeout=300.0):
+        if model == "slow-model":
+            raise requests.exceptions.ConnectionError(ReadTimeoutError(None, host, "Read timed out."))
+        yield "SELECT 2"
+
+    monkeypatch.setattr(cortex_client, "_stream_rest", stream_rest)
+    con = FakeConnection()
+    con.rest, con.host = type("Rest", (), {"token": "t"})(), "example.snowflakecomputing.com"
+    router = _single_session_router(con, timeout=0.2)
+
+    assert "".join(router.stream("rewrite", "tune this")) == "SELECT 2"
+    assert router.last_model == "fast-model"
+    assert not any("slow-model" in sql for sql in con.executed)  # no SQL fallback after a timeout
+    with router.client.session():
+        pass
@@ -0,0 +1,20 @@
+"""Recorded GET_QUERY_OPERATOR_STATS output (fixtures/operator_stats): the known hotspot ranks first."""
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from conftest import FIXTURES
+from operator_stats import parse_operator_stats, rank_hotspots
+
+DIRECTORY = os.path.join(FIXTURES, "operator_stats")
+
+
+@pytest.mark.parametrize("name", sorted(n for n in os.listdir(DIRECTORY) if n.endswith(".json")))
+def test_expected_hotspot_ranks_first(name):
+    with open(os.path.join(DIRECTORY, name)) as f:
+        doc = json.load(f)
+    top = rank_hotspots(parse_operator_stats(pd.DataFrame(doc["rows"])))[0]
+    assert top.operator.operator_type == doc["expected_top"]
+    assert any(doc["expected_issue"] in issue for issue in top.issues), top.issues
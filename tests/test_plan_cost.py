@@ -0,0 +1,32 @@
+"""Recorded EXPLAIN plans (fixtures/explain): only the pruned rewrite of the full-scan join passes the screen."""
+import os
+
+import pytest
+
+from conftest import FIXTURES
+from fake_snowflake import FakeConnection
+from plan_cost import PlanPrescreen
+
+PLANS = {name[:-len(".json")]: open(os.path.join(FIXTURES, "explain", name)).read()
+         for name in os.listdir(os.path.join(FIXTURES, "explain")) if name.endswith(".json")}
+
+
+def _prescreen() -> PlanPrescreen:
+    # The plan to answer with is named in the query's comment
+    def respond(sql, params=None):
+        if sql.startswith("EXPLAIN"):
+            return ["content"], [(PLANS[sql.split("/*")[1].split("*/")[0].strip()],)]
+        return ["1"], [(1,)]
+
+    return PlanPrescreen(FakeConnection(responder=respond))
+
+
+@pytest.mark.parametrize("rewrite, accepted, reason", [
+    ("sales_join_pruned", True, "estimated cost reduced"),
+    ("sales_join_full_scan", False, "estimated cost not reduced"),
+    ("sales_cartesian", False, "cartesian join"),
+])
+def test_prescreen_on_recorded_plans(rewrite, accepted, reason):
+    comparison = _prescreen().check("SELECT /* sales_join_full_scan */ 1", f"SELECT /* {rewrite} */ 1")
+    assert comparison.accepted is accepted
+    assert reason in comparison.reason
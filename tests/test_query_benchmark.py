@@ -0,0 +1,35 @@
+"""The benchmark turns the result cache off and puts the session's own setting back afterwards."""
+import re
+
+import pytest
+
+from fake_snowflake import FakeConnection
+from query_benchmark import QueryBenchmark
+
+COLUMNS = ["key", "value", "default", "level", "description", "type"]
+HISTORY = ["QUERY_ID", "TOTAL_ELAPSED_TIME", "EXECUTION_TIME", "BYTES_SCANNED", "PARTITIONS_SCANNED",
+           "PARTITIONS_TOTAL", "ROWS_PRODUCED", "WAREHOUSE_SIZE", "CREDITS_USED_CLOUD_SERVICES"]
+
+
+@pytest.mark.parametrize("value, level, restore", [
+    ("false", "SESSION", "ALTER SESSION SET USE_CACHED_RESULT = FALSE"),
+    ("true", "SESSION", "ALTER SESSION SET USE_CACHED_RESULT = TRUE"),
+    ("false", "USER", "ALTER SESSION UNSET USE_CACHED_RESULT"),
+    ("true", "", "ALTER SESSION UNSET USE_CACHED_RESULT"),
+])
+def test_restores_the_previous_session_value(value, level, restore):
+    def responder(sql, params=None):
+        if sql.startswith("SHOW PARAMETERS"):
+            return COLUMNS, [("USE_CACHED_RESULT", value, "true", level, "", "BOOLEAN")]
+        if "QUERY_HISTORY" in sql:
+            return HISTORY, [(qid, 10, 10, 0, 1, 1, 1, "X-Small", 0.0)
+                             for qid in re.findall(r"'([0-9a-f-]{36})'", sql)]
+        return ["1"], [(1,)]
+
+    con = FakeConnection(responder=responder)
+    benchmark = QueryBenchmark(con, runs=1, warmup=0)
+    benchmark.jobs.poll_interval = 0.001
+    benchmark.compare("SELECT 1", "SELECT 2")
+    session = [sql for sql in con.executed if sql.startswith(("SHOW", "ALTER"))]
+    assert session == ["SHOW PARAMETERS LIKE 'USE_CACHED_RESULT' IN SESSION",
+                       "ALTER SESSION SET USE_CACHED_RESULT = FALSE", restore]
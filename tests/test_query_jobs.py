@@ -0,0 +1,17 @@
+"""Reattaching to a running query from its id alone, as a Streamlit rerun does."""
+from fake_snowflake import FakeConnection
+from query_jobs import RUNNING, SUCCEEDED, JobManager
+
+
+def test_attach_picks_up_a_query_submitted_by_another_manager():
+    con = FakeConnection(async_duration=0.2)
+    job_id = JobManager(con).submit("SELECT 1").job_id
+
+    jobs = JobManager(con, poll_interval=0.01)
+    job = jobs.attach(job_id, timeout=60)
+    assert job.state == RUNNING
+    assert jobs.attach(job_id) is job
+
+    jobs.wait([job])
+    assert job.state == SUCCEEDED
+    assert jobs.result(job).to_pandas().iloc[0, 0] == 1
@@ -0,0 +1,60 @@
+"""Each metrics tier selects only columns its source has, and a failing tier is logged, not hidden."""
+import logging
+import re
+
+from snowflake.connector.errors import ProgrammingError
+
+from fake_snowflake import FakeConnection
+from query_metrics import QueryMetricsProvider
+
+QUERY_ID = "01b2c3d4-0000-4a5b-8c00-000000000001"
+# What INFORMATION_SCHEMA.QUERY_HISTORY() / QUERY_HISTORY_BY_SESSION() return, in part
+TABLE_FUNCTION_COLUMNS = {"QUERY_ID", "TOTAL_ELAPSED_TIME", "EXECUTION_TIME", "BYTES_SCANNED", "ROWS_PRODUCED",
+                          "WAREHOUSE_SIZE", "CREDITS_USED_CLOUD_SERVICES", "EXECUTION_STATUS"}
+
+
+def _connection(session_rows=True, failing=()):
+    def responder(sql, params=None):
+        selected = [c.strip().upper() for c in re.search(r"SELECT\s+(.*?)\s+FROM", sql, re.S).group(1).split(",")]
+        tier = "session" if "BY_SESSION" in sql else "information_schema" if "INFORMATION_SCHEMA" in sql else "view"
+        if tier in failing:
+            raise ProgrammingError(f"SQL compilation error: {tier} unavailable")
+        unknown = [c for c in selected if tier != "view" and c not in TABLE_FUNCTION_COLUMNS]
+        if unknown:
+            raise ProgrammingError(f"SQL compilation error: invalid identifier '{unknown[0]}'")
+        if tier == "session" and not session_rows:
+            return selected, []
+        values = {"QUERY_ID": QUERY_ID, "WAREHOUSE_SIZE": "X-Small"}
+        return selected, [tuple(values.get(c, 10) for c in selected)]
+
+    return FakeConnection(responder=responder)
+
+
+def test_fast_tiers_compile_and_answer(caplog):
+    with caplog.at_level(logging.WARNING):
+        metrics = QueryMetricsProvider(_connection()).get([QUERY_ID])
+    assert metrics["SOURCE"].tolist() == ["session"]
+    assert metrics["EXECUTION_TIME"].tolist() == [10]
+    assert caplog.records == []
+
+
+def test_information_schema_answers_other_sessions():
+    metrics = QueryMetricsProvider(_connection(session_rows=False)).get([QUERY_ID])
+    assert metrics["SOURCE"].tolist() == ["information_schema"]
+
+
+def test_failing_tier_is_logged_and_skipped(caplog):
+    with caplog.at_level(logging.WARNING, logger="query_metrics"):
+        metrics = QueryMetricsProvider(_connection(failing=("session",))).get([QUERY_ID])
+    assert metrics["SOURCE"].tolist() == ["information_schema"]
+    assert "session unavailable" in caplog.text
+
+
+def test_partition_counts_come_from_account_usage():
+    provider = QueryMetricsProvider(_connection(failing=("session", "information_schema")))
+    provider.record_client_timing(QUERY_ID, 1.5)
+    assert provider.get([QUERY_ID])["SOURCE"].tolist() == ["client"]
+    assert provider.backfill() == 1
+    metrics = provider.get([QUERY_ID])
+    assert metrics["SOURCE"].tolist() == ["account_usage"]
+    assert metrics["PARTITIONS_SCANNED"].tolist() == [10]
@@ -0,0 +1,44 @@
+"""The read-only guard in front of query_sql_database_tool."""
+import pytest
+
+from sql_parser import read_only_error
+from tool_dispatch import ToolCall, ToolDispatcher, TurnBudget
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT a FROM t",
+    "select a from t;",
+    "WITH x AS (SELECT a FROM t) SELECT * FROM x",
+    "(SELECT a FROM t) UNION ALL (SELECT a FROM u)",
+    "SELECT 'delete me' AS note FROM t",
+    "SELECT SYSTEM$CLUSTERING_INFORMATION('db.s.t')",
+    "SELECT system$explain_plan_json('SELECT 1')",
+    "SELECT t.system$flag FROM t",
+])
+def test_allows_single_read_only_queries(query):
+    assert read_only_error(query) is None, query
+
+
+@pytest.mark.parametrize("query, reason", [
+    ("", "empty query"),
+    ("SELECT 1; DROP TABLE t", "single statement"),
+    ("DROP TABLE t", "not DROP"),
+    ("WITH x AS (SELECT 1) DELETE FROM t", "DELETE"),
+    ("SELECT SYSTEM$CANCEL_ALL_QUERIES(CURRENT_SESSION())", "SYSTEM$CANCEL_ALL_QUERIES"),
+    ("SELECT system$abort_session(42)", "SYSTEM$ABORT_SESSION"),
+    ("SELECT a FROM t WHERE SYSTEM$CANCEL_QUERY('01b2') IS NOT NULL", "SYSTEM$CANCEL_QUERY"),
+    ('SELECT "SYSTEM$CANCEL_ALL_QUERIES"(1)', "SYSTEM$CANCEL_ALL_QUERIES"),
+])
+def test_refuses_writes_and_unlisted_system_functions(query, reason):
+    error = read_only_error(query)
+    assert error and reason in error, (query, error)
+
+
+def test_dispatcher_refuses_without_running_the_tool():
+    ran = []
+    dispatcher = ToolDispatcher({"query_sql_database_tool": lambda query: ran.append(query) or "ok"})
+    call = ToolCall("query_sql_database_tool", {"query": "SELECT SYSTEM$CANCEL_ALL_QUERIES(CURRENT_SESSION())"})
+    [result] = dispatcher.dispatch([call], TurnBudget())
+    assert result.error
+    assert result.output.startswith("Error: refused to run query_sql_database_tool")
+    assert not ran
@@ -0,0 +1,35 @@
+"""When the local rules may answer a check on their own, and when Cortex has to."""
+import pytest
+
+from sql_lint import lint
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT a FROM t WHERE CAST(x AS INT) = 'abc'",
+    "SELECT a FROM t WHERE x::NUMBER(10, 2) = 'n/a'",
+    "SELECT a FROM t WHERE d BETWEEN '2024-01-01' AND '2024-01-31'",
+    "SELECT a FROM t UNION SELECT a FROM u",
+    "SELECT a FROM t WHERE a NOT IN (1, NULL)",
+    "SELECT a FROM t1 JOIN t2",
+    "SELECT * FROM t UNPIVOT (v FOR k IN (a, b))",
+    "SELECT a FROM t WHERE (b = 1",
+    "DELETE FROM t",
+])
+def test_escalates_when_a_correctness_rule_fires_or_the_query_is_not_modelled(query):
+    report = lint(query)
+    assert report.needs_llm, query
+    assert report.reason
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT a, b FROM t LIMIT 10",
+    "SELECT COUNT(*) FROM t",
+    "SELECT a FROM t WHERE b = 1",
+    "SELECT a FROM t WHERE CAST(x AS INT) = '12'",
+    "SELECT t1.a FROM t1 JOIN t2 ON t1.id = t2.id",
+    "SELECT DATEADD(day, 1, d) FROM t LIMIT 5",
+    "SELECT * FROM t WHERE DATE(ts) = '2024-01-01'",
+    "SELECT a FROM t UNION ALL SELECT a FROM u",
+])
+def test_decides_queries_no_correctness_rule_flags(query):
+    assert not lint(query).needs_llm, query
@@ -0,0 +1,166 @@
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+import pandas as pd
+from pydantic import BaseModel, ValidationError
+
+from concurrency import bounded_map
+from prompt_budget import count_tokens, summarize_frame, truncate_to_tokens
+from sql_parser import read_only_error
+from tracing import span
+from Utility import _InfoSQLDatabaseToolInput, _QuerySQLCheckerToolInput, _QuerySQLDataBaseToolInput
+
+# Tool name -> input model the arguments are validated against
+TOOL_INPUTS: Dict[str, Type[BaseModel]] = {
+    "query_sql_database_tool": _QuerySQLDataBaseToolInput,
+    "info_snowflake_table_tool": _InfoSQLDatabaseToolInput,
+    "query_sql_checker_tool": _QuerySQLCheckerToolInput,
+}
+
+TOOL_DESCRIPTIONS: Dict[str, str] = {
+    "query_sql_database_tool": "Run a SELECT query and return its result and query_id.",
+    "info_snowflake_table_tool": "Return the schema of a comma-separated list of tables.",
+    "query_sql_checker_tool": "Check a SQL query for common mistakes and return the corrected query.",
+}
+
+# Checks run on validated arguments before a tool executes; each returns an error message or None.
+# Tool calls come from model output, which query history or table data can steer, so SQL is read-only.
+TOOL_GUARDS: Dict[str, Callable[[Dict[str, Any]], Optional[str]]] = {
+    "query_sql_database_tool": lambda arguments: read_only_error(arguments["query"]),
+}
+
+_JSON_BLOCK_RE = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+
+
+def tool_instructions() -> str:
+    """Prompt section describing the tools and the JSON format for calling them."""
+    lines = ["You can call tools. To do so, reply with a single JSON block and nothing else:",
+             '```json\n{"tool_calls": [{"name": "<tool>", "arguments": {...}}]}\n```',
+             "Calls in the same block run in parallel, so only group calls that do not depend on each other.",
+             "When you have everything you need, answer in plain text without a JSON block.",
+             "Available tools:"]
+    for name, model in TOOL_INPUTS.items():
+        lines.append(f"- {name}: {TOOL_DESCRIPTIONS[name]} Arguments: {json.dumps(model.model_json_schema()['properties'])}")
+    return "\n".join(lines)
+
+
+@dataclass
+class ToolCall:
+    name: str
+    arguments: Dict[str, Any]
+
+
+@dataclass
+class ToolResult:
+    call: ToolCall
+    output: str
+    error: bool = False
+    query_id: Optional[str] = None
+
+
+@dataclass
+class TurnBudget:
+    """Limits for one user turn: LLM round trips, tool calls and (estimated) tokens."""
+    max_steps: int = 4
+    max_tool_calls: int = 6
+    max_tokens: int = 12000
+    max_tool_output_tokens: int = 1500
+    model: Optional[str] = None
+    steps: int = 0
+    tool_calls: int = 0
+    tokens: int = 0
+
+    def charge(self, text: str):
+        self.tokens += count_tokens(text, self.model)
+
+    @property
+    def exhausted(self) -> bool:
+        return self.steps >= self.max_steps or self.tool_calls >= self.max_tool_calls or self.tokens >= self.max_tokens
+
+
+def parse_tool_calls(text: str) -> Tuple[List[ToolCall], List[str]]:
+    """Extract and validate the tool calls in an LLM reply.
+
+    Returns the valid calls plus one error message per rejected call; a reply
+    without a `tool_calls` JSON object has no calls.
+    """
+    payload = None
+    for candidate in _JSON_BLOCK_RE.findall(text) or [text.strip()]:
+        try:
+            payload = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(payload, dict) and "tool_calls" in payload:
+            break
+        payload = None
+    if payload is None:
+        return [], []
+    calls, errors = [], []
+    raw_calls = payload["tool_calls"] if isinstance(payload["tool_calls"], list) else [payload["tool_calls"]]
+    for raw in raw_calls:
+        name = raw.get("name") if isinstance(raw, dict) else None
+        if name not in TOOL_INPUTS:
+            errors.append(f"Error: unknown tool {name!r}; expected one of {sorted(TOOL_INPUTS)}")
+            continue
+        try:
+            arguments = TOOL_INPUTS[name].model_validate(raw.get("arguments") or {})
+        except ValidationError as e:
+            errors.append(f"Error: invalid arguments for {name}: {e.errors(include_url=False)}")
+            continue
+        calls.append(ToolCall(name, arguments.model_dump()))
+    return calls, errors
+
+
+def _format_output(output: Any, max_tokens: int, model: Optional[str]) -> Tuple[str, Optional[str]]:
+    query_id = None
+    if isinstance(output, tuple):
+        output, query_id = output
+    if isinstance(output, pd.DataFrame):
+        # Row count plus a sample; the model never needs the full result set
+        output = summarize_frame(output)
+        if query_id:
+            output += f"\nquery_id: {query_id}"
+    return truncate_to_tokens(str(output), max_tokens, model), query_id
+
+
+class ToolDispatcher:
+    """Run validated tool calls from `get_tools`, independent calls in parallel.
+
+    Calls beyond the budget's remaining tool allowance, or failing their
+    `TOOL_GUARDS` check, are rejected rather than run, and each output is truncated to `max_tool_output_tokens`.
+    """
+
+    def __init__(self, tools: Dict[str, Callable[..., Any]], max_concurrency: int = 4,
+                 call_timeout: Optional[float] = 300.0):
+        self.tools = tools
+        self.max_concurrency = max_concurrency
+        self.call_timeout = call_timeout
+
+    def dispatch(self, calls: List[ToolCall], budget: TurnBudget) -> List[ToolResult]:
+        allowed = calls[:max(0, budget.max_tool_calls - budget.tool_calls)]
+        budget.tool_calls += len(allowed)
+
+        def run(call: ToolCall) -> Any:
+            guard = TOOL_GUARDS.get(call.name)
+            refusal = guard(call.arguments) if guard is not None else None
+            if refusal:
+                return f"Error: refused to run {call.name}: {refusal}"
+            with span(f"tool.{call.name}") as s:
+                output = self.tools[call.name](**call.arguments)
+                if isinstance(output, tuple):
+                    s.set(query_id=output[1])
+                return output
+
+        results = []
+        outputs = bounded_map(run, allowed, max_concurrency=self.max_concurrency, timeout=self.call_timeout)
+        for call, output in zip(allowed, outputs):
+            if isinstance(output, Exception):
+                results.append(ToolResult(call, f"Error: {output!r}", error=True))
+                continue
+            text, query_id = _format_output(output, budget.max_tool_output_tokens, budget.model)
+            results.append(ToolResult(call, text, error=text.startswith("Error:"), query_id=query_id))
+        for call in calls[len(allowed):]:
+            results.append(ToolResult(call, "Error: tool call budget exhausted for this turn", error=True))
+        return results
@@ -1,13 +1,25 @@
-from cortex_inference import cortex_inference
+from cortex_inference import get_cortex_client
 import pandas as pd
+from model_router import ModelRouter
+from prompt_budget import compact_schema
+from query_stream import execute_stream
+from schema_cache import default_schema_cache
+from sql_lint import lint
+from tracing import annotate
+
+def get_tools(con, client=None):
+    client = client or get_cortex_client()
+    # Checking is a cheap lint, so it goes to the router's small-model policy
+    router = ModelRouter(client)
 
-def get_tools(con):
     def query_sql_database_tool(query: str):
         """Tool for querying Snowflake database."""
         try:
-            results = pd.read_sql(query, con)
-            query_id = con.cursor().sfqid
-            return results, query_id
+            # One execution: the query_id comes from the cursor that ran the query
+            stream = execute_stream(con, query)
+            result = stream.to_pandas()
+            annotate(rows=stream.rows_fetched, bytes=stream.bytes_fetched, truncated=stream.truncated)
+            return result, stream.query_id
         except Exception as e:
             return f"Error: {e}", None
 
@@ -16,13 +28,14 @@ def get_tools(con):
         output_schema = ""
         _table_names = table_names.split(",")
         for t in _table_names:
-            schema = pd.read_sql(f"DESCRIBE TABLE {t}", con)
-            output_schema += f"Schema for table {t}: {schema}\n"
+            schema = default_schema_cache.describe(con, t.strip())
+            # Column names and types only; the other DESCRIBE columns are mostly noise to the model
+            output_schema += compact_schema(t.strip(), schema) + "\n"
         return output_schema
 
     def query_sql_checker_tool(query: str):
-        """Use Snowflake Cortex to check the SQL query for common mistakes."""
-        prompt = f"""
+        """Check the SQL query for common mistakes locally, escalating to Cortex when the rules can't decide."""
+        template = """
         {query}
         Double check the query above for common mistakes, including:
         - Using NOT IN with NULL values
@@ -35,7 +48,12 @@ def get_tools(con):
         - Using the proper columns for joins
         If there are any mistakes, rewrite the query. Output the final SQL query only.
         """
-        return cortex_inference(prompt)
+        report = lint(query)
+        annotate(lint_findings=len(report.findings), needs_llm=report.needs_llm)
+        if not report.needs_llm:
+            return query
+        return router.complete("check", f"Static analysis found:\n{report.summary()}\n" + template.format(query=query),
+                               template=template)
 
     return {
         "query_sql_database_tool": query_sql_database_tool,
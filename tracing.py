@@ -0,0 +1,267 @@
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+_current: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    """One timed stage. Times are wall-clock nanoseconds, as OpenTelemetry uses."""
+    name: str
+    trace_id: str  # 32 hex chars
+    span_id: str   # 16 hex chars
+    parent_id: Optional[str] = None
+    start_ns: int = 0
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+    _start_perf: int = field(default=0, repr=False)
+    _tracer: Optional["Tracer"] = field(default=None, repr=False)
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return None if self.end_ns is None else (self.end_ns - self.start_ns) / 1e6
+
+    def set(self, **attributes) -> "Span":
+        """Add attributes (None values are skipped)."""
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+        return self
+
+    def end(self, error: Optional[BaseException] = None):
+        if self.end_ns is not None:
+            return
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        # Duration from the monotonic clock, anchored at the wall-clock start
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._start_perf)
+        if self._tracer is not None:
+            self._tracer._finish(self)
+
+
+class Tracer:
+    """Collects spans per stage of the pipeline and keeps the most recent `max_spans`.
+
+    `span` opens a span as a child of the current one (a new trace when there
+    is none); the current span follows contextvars, so `bounded_map` workers
+    nest under the span that started them. When a trace's root span ends, the
+    whole trace is handed to each exporter (see `OTLPFileExporter` and
+    `OTLPHttpExporter`). Export failures are counted, never raised.
+    """
+
+    def __init__(self, max_spans: int = 10000, exporters: Optional[List[Callable[[List[Span]], None]]] = None,
+                 service_name: str = "optima"):
+        self.service_name = service_name
+        self.exporters = list(exporters or [])
+        self.export_errors = 0
+        self.last_trace_id: Optional[str] = None
+        self._spans: Deque[Span] = deque(maxlen=max_spans)
+        self._open: Dict[str, List[Span]] = {}
+        self._lock = threading.Lock()
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """Start a span under the current one without making it current (e.g. around a generator)."""
+        parent = _current.get()
+        span = Span(name, parent.trace_id if parent is not None else secrets.token_hex(16), secrets.token_hex(8),
+                    parent.span_id if parent is not None else None, time.time_ns(), _tracer=self,
+                    _start_perf=time.perf_counter_ns())
+        span.set(**attributes)
+        if parent is None:
+            with self._lock:
+                self._open[span.trace_id] = []
+                self.last_trace_id = span.trace_id
+        return span
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        span = self.start_span(name, **attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.end(e)
+            raise
+        finally:
+            span.end()
+            try:
+                _current.reset(token)
+            except ValueError:
+                # Closed from another context (e.g. a generator finalized elsewhere)
+                pass
+
+    def spans(self, trace_id: Optional[str] = None) -> List[Span]:
+        with self._lock:
+            spans = list(self._spans)
+        return spans if trace_id is None else [s for s in spans if s.trace_id == trace_id]
+
+    def last_trace(self) -> List[Span]:
+        return self.spans(self.last_trace_id) if self.last_trace_id else []
+
+    def summary(self, trace_id: Optional[str] = None) -> pd.DataFrame:
+        """p50/p95 latency and token totals per stage over the retained spans."""
+        rows = [{"STAGE": s.name, "MS": s.duration_ms, "ERROR": s.error is not None,
+                 "TOKENS": s.attributes.get("prompt_tokens", 0) + s.attributes.get("completion_tokens", 0)}
+                for s in self.spans(trace_id)]
+        if not rows:
+            return pd.DataFrame(columns=["COUNT", "ERRORS", "P50_MS", "P95_MS", "MAX_MS", "TOTAL_MS", "TOKENS"])
+        frame = pd.DataFrame(rows)
+        grouped = frame.groupby("STAGE")
+        return pd.DataFrame({
+            "COUNT": grouped.size(),
+            "ERRORS": grouped["ERROR"].sum(),
+            "P50_MS": grouped["MS"].median(),
+            "P95_MS": grouped["MS"].apply(lambda ms: float(np.percentile(ms, 95))),
+            "MAX_MS": grouped["MS"].max(),
+            "TOTAL_MS": grouped["MS"].sum(),
+            "TOKENS": grouped["TOKENS"].sum(),
+        }).sort_values("TOTAL_MS", ascending=False)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def _finish(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+            trace = self._open.get(span.trace_id)
+            if trace is not None:
+                trace.append(span)
+            if span.parent_id is not None:
+                return
+            trace = self._open.pop(span.trace_id, [span])
+        for exporter in self.exporters:
+            try:
+                exporter(trace)
+            except Exception:
+                self.export_errors += 1
+
+
+def annotate(**attributes):
+    """Add attributes to the current span, if any (a no-op outside a trace)."""
+    span = _current.get()
+    if span is not None:
+        span.set(**attributes)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def trace_frame(spans: List[Span]) -> pd.DataFrame:
+    """One row per span in start order, names indented by depth, for display."""
+    if not spans:
+        return pd.DataFrame(columns=["STAGE", "START_MS", "DURATION_MS", "ERROR", "ATTRIBUTES"])
+    by_id = {s.span_id: s for s in spans}
+
+    def depth(span: Span) -> int:
+        d = 0
+        while span.parent_id in by_id:
+            span = by_id[span.parent_id]
+            d += 1
+        return d
+
+    origin = min(s.start_ns for s in spans)
+    return pd.DataFrame([{
+        "STAGE": "  " * depth(s) + s.name,
+        "START_MS": (s.start_ns - origin) / 1e6,
+        "DURATION_MS": s.duration_ms,
+        "ERROR": s.error or "",
+        "ATTRIBUTES": json.dumps(s.attributes, default=str),
+    } for s in sorted(spans, key=lambda s: s.start_ns)])
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, (int, np.integer)):
+        return {"intValue": str(int(value))}  # int64 is a string in OTLP/JSON
+    if isinstance(value, (float, np.floating)):
+        return {"doubleValue": float(value)}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans: List[Span], service_name: str = "optima") -> Dict[str, Any]:
+    """Encode spans as an OTLP/JSON `ExportTraceServiceRequest`."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+        "scopeSpans": [{
+            "scope": {"name": "optima.tracing"},
+            "spans": [{
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                "parentSpanId": s.parent_id or "",
+                "name": s.name,
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns or s.start_ns),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+            } for s in spans],
+        }],
+    }]}
+
+
+class OTLPFileExporter:
+    """Append each finished trace as one OTLP/JSON line (the OpenTelemetry Collector file format)."""
+
+    def __init__(self, path: str, service_name: str = "optima"):
+        self.path = path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, spans: List[Span]):
+        line = json.dumps(to_otlp(spans, self.service_name))
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class OTLPHttpExporter:
+    """POST each finished trace to an OTLP/HTTP collector (`<endpoint>/v1/traces`, JSON encoding)."""
+
+    def __init__(self, endpoint: str, service_name: str = "optima", headers: Optional[Dict[str, str]] = None,
+                 timeout: float = 5.0):
+        self.url = endpoint.rstrip("/") + ("" if endpoint.rstrip("/").endswith("/v1/traces") else "/v1/traces")
+        self.service_name = service_name
+        self.headers = {"Content-Type": "application/json", **(headers or {})}
+        self.timeout = timeout
+
+    def __call__(self, spans: List[Span]):
+        import requests
+
+        response = requests.post(self.url, data=json.dumps(to_otlp(spans, self.service_name)),
+                                 headers=self.headers, timeout=self.timeout)
+        response.raise_for_status()
+
+
+def _default_exporters() -> List[Callable[[List[Span]], None]]:
+    # Standard OpenTelemetry environment variables, so a collector can be attached without code changes
+    exporters: List[Callable[[List[Span]], None]] = []
+    service_name = os.environ.get("OTEL_SERVICE_NAME", "optima")
+    endpoint = os.environ.get("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT") or os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+    if endpoint:
+        exporters.append(OTLPHttpExporter(endpoint, service_name))
+    if os.environ.get("OPTIMA_TRACE_FILE"):
+        exporters.append(OTLPFileExporter(os.environ["OPTIMA_TRACE_FILE"], service_name))
+    return exporters
+
+
+# Shared by every stage in the process
+default_tracer = Tracer(exporters=_default_exporters(), service_name=os.environ.get("OTEL_SERVICE_NAME", "optima"))
+
+
+def span(name: str, **attributes):
+    """`default_tracer.span`, for instrumenting module code."""
+    return default_tracer.span(name, **attributes)